@@ -0,0 +1,548 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Benchmark do Sistema de Webhook Kolmeya
+
+Comandos:
+  simulador  API Kolmeya local (/sms/enviar) com latência e taxa de erro configuráveis
+  popular    Gera massa de dados diretamente no banco SQLite
+  carga      Gera carga concorrente contra um servidor em execução
+  relatorio  Para cada tamanho de banco: popula, sobe o servidor e mede a carga
+
+Exemplos:
+  python benchmark.py simulador --porta 5099 --latencia-ms 80 --taxa-erro 0.02
+  python benchmark.py popular --banco bench.db --clientes 1000000
+  python benchmark.py carga --url http://localhost:5000 --concorrencia 32 --duracao 30
+  python benchmark.py relatorio --tamanhos 10000,100000,1000000 --workers 4 --threads 4
+"""
+
+import os
+import sys
+import json
+import math
+import time
+import random
+import sqlite3
+import argparse
+import itertools
+import threading
+import subprocess
+from datetime import datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+from requests.adapters import HTTPAdapter
+
+import webkolm
+
+DIRETORIO = os.path.dirname(os.path.abspath(__file__))
+
+# Cenários da carga (métodos de GeradorCarga) e seus pesos padrão
+CENARIOS = ('enviar', 'clique', 'webhook', 'dashboard', 'cliques')
+MIX_PADRAO = 'enviar=1,clique=5,webhook=3,dashboard=1,cliques=1'
+
+EVENTOS_WEBHOOK = ('sms_enviado', 'sms_entregue', 'sms_clicado', 'sms_erro')
+
+# Cliques simulam o navegador de um celular (outros User-Agents são classificados como robôs;
+# sem Accept-Language, cliques repetidos no mesmo link cairiam na regra de rajada)
+USER_AGENT_CLIQUE = (
+    'Mozilla/5.0 (Linux; Android 13; SM-A536B) AppleWebKit/537.36 '
+    '(KHTML, like Gecko) Chrome/120.0.0.0 Mobile Safari/537.36'
+)
+
+# ---------------------------------------------------------------------------
+# Simulador da API Kolmeya
+# ---------------------------------------------------------------------------
+
+class ManipuladorSimulador(BaseHTTPRequestHandler):
+    """Responde POST /sms/enviar como a API do Kolmeya, com latência e erros simulados"""
+
+    protocol_version = 'HTTP/1.1'
+    latencia = 0.05
+    variacao = 0.0
+    taxa_erro = 0.0
+    contador = itertools.count(1)
+
+    def do_POST(self):
+        corpo = self.rfile.read(int(self.headers.get('Content-Length', 0) or 0))
+        if self.path.split('?')[0].rstrip('/') != '/sms/enviar':
+            self._responder(404, {'erro': 'Endpoint não encontrado'})
+            return
+
+        time.sleep(max(0.0, random.uniform(self.latencia - self.variacao, self.latencia + self.variacao)))
+
+        if random.random() < self.taxa_erro:
+            self._responder(500, {'erro': 'Erro simulado'})
+            return
+
+        try:
+            dados = json.loads(corpo or b'{}')
+        except ValueError:
+            self._responder(400, {'erro': 'JSON inválido'})
+            return
+        self._responder(200, {
+            'status': 'enviado',
+            'id': next(self.contador),
+            'telefone': dados.get('telefone')
+        })
+
+    def _responder(self, status, dados):
+        corpo = json.dumps(dados).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(corpo)))
+        self.end_headers()
+        self.wfile.write(corpo)
+
+    def log_message(self, formato, *args):
+        pass
+
+
+def iniciar_simulador(porta, latencia_ms=50, variacao_ms=0, taxa_erro=0.0):
+    """Inicia o simulador em uma thread e retorna o servidor (use shutdown() para parar)"""
+    manipulador = type('Manipulador', (ManipuladorSimulador,), {
+        'latencia': latencia_ms / 1000,
+        'variacao': variacao_ms / 1000,
+        'taxa_erro': taxa_erro,
+    })
+    servidor = ThreadingHTTPServer(('127.0.0.1', porta), manipulador)
+    servidor.daemon_threads = True
+    threading.Thread(target=servidor.serve_forever, name='simulador-kolmeya', daemon=True).start()
+    return servidor
+
+# ---------------------------------------------------------------------------
+# Massa de dados
+# ---------------------------------------------------------------------------
+
+def popular_banco(banco, clientes, taxa_clique=0.3, taxa_entrega=0.9, dias=30, lote=50000):
+    """
+    Insere `clientes` contatos com cliques e webhooks de envio/entrega distribuídos
+    nos últimos `dias` dias, aplicando antes as migrações do sistema
+    Os triggers ficam desativados durante a carga; contadores, status dos links e
+    agregações são recalculados em lote no final
+    A massa de dados é gerada apenas para o SQLite (BANCO_BACKEND=sqlite)
+    """
+    if webkolm.repositorio.nome != 'sqlite':
+        raise SystemExit('popular: disponível apenas com BANCO_BACKEND=sqlite')
+    conn = sqlite3.connect(banco, isolation_level=None)
+    conn.execute('PRAGMA auto_vacuum=INCREMENTAL')
+    conn.execute('PRAGMA journal_mode=WAL')
+    webkolm.aplicar_migracoes(conn)
+    conn.execute('PRAGMA synchronous=OFF')
+    conn.execute('PRAGMA cache_size=-262144')
+
+    inicio = datetime.utcnow() - timedelta(days=dias)
+    segundos_periodo = dias * 86400
+
+    gatilhos = conn.execute("SELECT name, sql FROM sqlite_master WHERE type = 'trigger'").fetchall()
+    for nome, _ in gatilhos:
+        conn.execute(f'DROP TRIGGER {nome}')
+    try:
+        inseridos = inserir_massa(conn, clientes, inicio, segundos_periodo, taxa_clique, taxa_entrega, lote)
+    finally:
+        if conn.in_transaction:
+            conn.rollback()
+        print("  Recalculando contadores, status dos links e agregações...")
+        conn.execute('BEGIN')
+        for tabela in ('contatos', 'links', 'cliques', 'webhooks'):
+            conn.execute(f"UPDATE contadores SET valor = (SELECT COUNT(*) FROM {tabela}) WHERE nome = '{tabela}'")
+        for comando in webkolm.SQL_RECALCULAR_STATUS_LINKS:
+            conn.execute(comando)
+        for _, sql in gatilhos:
+            conn.execute(sql)
+        conn.execute('COMMIT')
+
+    webkolm.recalcular_agregados(conn, inicio.strftime('%Y-%m-%d'))
+    conn.execute('PRAGMA optimize')
+    conn.close()
+    return inseridos
+
+
+def inserir_massa(conn, clientes, inicio, segundos_periodo, taxa_clique, taxa_entrega, lote):
+    """Gera e insere os registros em transações de `lote` clientes"""
+    campanhas = [f'campanha-{numero}' for numero in range(1, 11)]
+    rand = random.Random(42)
+
+    def data(segundos):
+        return (inicio + timedelta(seconds=segundos)).strftime('%Y-%m-%d %H:%M:%S')
+
+    inseridos = 0
+    t0 = time.perf_counter()
+    while inseridos < clientes:
+        quantidade = min(lote, clientes - inseridos)
+        linhas_contatos, linhas_links, linhas_cliques, linhas_webhooks = [], [], [], []
+        for _ in range(quantidade):
+            link_id = webkolm.gerar_link_id()
+            telefone = f'55119{rand.randrange(10 ** 8):08d}'
+            nome = f'Cliente {inseridos}'
+            # CPF único por contato (a chave de deduplicação dos contatos)
+            cpf = f'{inseridos:011d}'
+            criado = rand.uniform(0, segundos_periodo)
+            contato_id = inseridos + 1
+            linhas_contatos.append((
+                contato_id, webkolm.chave_contato(telefone, cpf), telefone, nome, cpf, data(criado)
+            ))
+            linhas_links.append((link_id, contato_id, rand.choice(campanhas), data(criado)))
+
+            enviado = criado + rand.uniform(1, 60)
+            linhas_webhooks.append((
+                'sms_enviado', telefone, link_id,
+                json.dumps({'evento': 'sms_enviado', 'telefone': telefone, 'link_id': link_id}),
+                f'sms_enviado:{link_id}', data(enviado)
+            ))
+            if rand.random() < taxa_entrega:
+                entregue = enviado + rand.uniform(1, 120)
+                linhas_webhooks.append((
+                    'sms_entregue', telefone, link_id,
+                    json.dumps({'evento': 'sms_entregue', 'telefone': telefone, 'link_id': link_id}),
+                    f'sms_entregue:{link_id}', data(entregue)
+                ))
+                if rand.random() < taxa_clique:
+                    linhas_cliques.append((
+                        link_id, f'10.0.{rand.randrange(256)}.{rand.randrange(256)}',
+                        'Mozilla/5.0 (Linux; Android 13) Mobile', data(entregue + rand.expovariate(1 / 3600))
+                    ))
+            inseridos += 1
+
+        # Em ordem cronológica, os índices por data e as agregações são atualizados em sequência
+        linhas_links.sort(key=lambda linha: linha[-1])
+        linhas_cliques.sort(key=lambda linha: linha[-1])
+        linhas_webhooks.sort(key=lambda linha: linha[-1])
+
+        conn.execute('BEGIN')
+        conn.executemany('''
+            INSERT INTO contatos (id, chave, telefone, nome, cpf, data_criacao)
+            VALUES (?, ?, ?, ?, ?, ?)
+        ''', linhas_contatos)
+        conn.executemany('''
+            INSERT INTO links (link_id, contato_id, campanha, data_criacao)
+            VALUES (?, ?, ?, ?)
+        ''', linhas_links)
+        conn.executemany('''
+            INSERT INTO cliques (link_id, ip_address, user_agent, data_clique)
+            VALUES (?, ?, ?, ?)
+        ''', linhas_cliques)
+        conn.executemany('''
+            INSERT OR IGNORE INTO webhooks (evento, telefone, link_id, dados, chave_dedupe, data_recebimento)
+            VALUES (?, ?, ?, ?, ?, ?)
+        ''', linhas_webhooks)
+        conn.execute('COMMIT')
+        print(f"  {inseridos}/{clientes} clientes ({inseridos / (time.perf_counter() - t0):.0f}/s)", end='\r')
+
+    print()
+    return inseridos
+
+# ---------------------------------------------------------------------------
+# Gerador de carga
+# ---------------------------------------------------------------------------
+
+def ler_mix(texto):
+    """Converte 'clique=5,webhook=3' em {'clique': 5.0, 'webhook': 3.0}"""
+    mix = {}
+    for parte in texto.split(','):
+        if not parte.strip():
+            continue
+        nome, _, peso = parte.partition('=')
+        nome = nome.strip()
+        if nome not in CENARIOS:
+            raise ValueError(f'Cenário desconhecido: {nome} (use {", ".join(CENARIOS)})')
+        mix[nome] = float(peso or 1)
+    return mix
+
+
+def carregar_link_ids(url, limite=10000):
+    """Lê até `limite` link_ids existentes pela exportação NDJSON de links"""
+    link_ids = []
+    with requests.get(f'{url}/exportar/links?formato=ndjson', stream=True, timeout=30) as resposta:
+        resposta.raise_for_status()
+        for linha in resposta.iter_lines():
+            if linha:
+                link_ids.append(json.loads(linha)['link_id'])
+            if len(link_ids) >= limite:
+                break
+    return link_ids
+
+
+class GeradorCarga:
+    """Executa os cenários em threads concorrentes e registra a latência de cada requisição"""
+
+    def __init__(self, url, concorrencia, mix, link_ids=None, timeout=30):
+        self.url = url.rstrip('/')
+        self.concorrencia = concorrencia
+        self.mix = mix
+        self.link_ids = list(link_ids or [])
+        self.timeout = timeout
+        self._ids_webhook = itertools.count(1)
+
+    def _sessao(self):
+        sessao = requests.Session()
+        adaptador = HTTPAdapter(pool_connections=1, pool_maxsize=1)
+        sessao.mount('http://', adaptador)
+        sessao.mount('https://', adaptador)
+        return sessao
+
+    def _link_id(self, sessao):
+        if not self.link_ids:
+            self.enviar(sessao)
+        return random.choice(self.link_ids)
+
+    def enviar(self, sessao):
+        resposta = sessao.post(f'{self.url}/enviar-sms', json={
+            'telefone': f'55119{random.randrange(10 ** 8):08d}',
+            'nome': 'Cliente Benchmark',
+            'cpf': f'{random.randrange(10 ** 11):011d}',
+            'mensagem': 'Oferta de teste',
+            'campanha': 'benchmark'
+        }, timeout=self.timeout)
+        if resposta.status_code in (200, 202):
+            self.link_ids.append(resposta.json()['link_id'])
+            return True
+        return False
+
+    def clique(self, sessao):
+        resposta = sessao.get(
+            f'{self.url}/c/{self._link_id(sessao)}',
+            headers={'User-Agent': USER_AGENT_CLIQUE, 'Accept-Language': 'pt-BR,pt;q=0.9'},
+            allow_redirects=False, timeout=self.timeout
+        )
+        return resposta.status_code == 302
+
+    def webhook(self, sessao):
+        link_id = self._link_id(sessao)
+        resposta = sessao.post(f'{self.url}/webhook-kolmeya', json={
+            'evento': random.choice(EVENTOS_WEBHOOK),
+            'id': f'bench-{os.getpid()}-{next(self._ids_webhook)}',
+            'telefone': '5511999999999',
+            'link_id': link_id
+        }, timeout=self.timeout)
+        return resposta.status_code == 200
+
+    def dashboard(self, sessao):
+        return sessao.get(f'{self.url}/dashboard', timeout=self.timeout).status_code == 200
+
+    def cliques(self, sessao):
+        return sessao.get(f'{self.url}/cliques?limite=100', timeout=self.timeout).status_code == 200
+
+    def _executar(self, fim, resultados):
+        sessao = self._sessao()
+        nomes = list(self.mix)
+        pesos = [self.mix[nome] for nome in nomes]
+        while time.monotonic() < fim:
+            nome = random.choices(nomes, pesos)[0]
+            inicio = time.perf_counter()
+            try:
+                ok = getattr(self, nome)(sessao)
+            except requests.RequestException:
+                ok = False
+            resultados.append((nome, (time.perf_counter() - inicio) * 1000, ok))
+
+    def executar(self, duracao):
+        """Gera carga por `duracao` segundos. Retorna (resultados, duração real)"""
+        fim = time.monotonic() + duracao
+        por_thread = [[] for _ in range(self.concorrencia)]
+        threads = [
+            threading.Thread(target=self._executar, args=(fim, resultados), daemon=True)
+            for resultados in por_thread
+        ]
+        inicio = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return [item for resultados in por_thread for item in resultados], time.perf_counter() - inicio
+
+
+# ---------------------------------------------------------------------------
+# Relatórios
+# ---------------------------------------------------------------------------
+
+def percentil(ordenados, p):
+    """Percentil pelo método do posto mais próximo (lista já ordenada)"""
+    if not ordenados:
+        return None
+    indice = max(0, min(len(ordenados) - 1, math.ceil(p / 100 * len(ordenados)) - 1))
+    return ordenados[indice]
+
+
+def resumir(resultados, duracao):
+    """Vazão, erros e latências (ms) por cenário e no total"""
+    grupos = {}
+    for nome, latencia, ok in resultados:
+        grupos.setdefault(nome, []).append((latencia, ok))
+    grupos['total'] = [(latencia, ok) for _, latencia, ok in resultados]
+
+    resumo = {}
+    for nome, medidas in grupos.items():
+        latencias = sorted(latencia for latencia, _ in medidas)
+        resumo[nome] = {
+            'requisicoes': len(medidas),
+            'erros': sum(1 for _, ok in medidas if not ok),
+            'rps': round(len(medidas) / duracao, 1) if duracao else 0,
+            'p50_ms': round(percentil(latencias, 50), 2) if latencias else None,
+            'p95_ms': round(percentil(latencias, 95), 2) if latencias else None,
+            'p99_ms': round(percentil(latencias, 99), 2) if latencias else None,
+            'max_ms': round(latencias[-1], 2) if latencias else None,
+        }
+    return resumo
+
+
+def imprimir_resumo(resumo, titulo):
+    print(f"\n📊 {titulo}")
+    print(f"{'cenário':<10} {'req':>8} {'erros':>6} {'req/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'máx ms':>8}")
+    for nome in sorted(resumo, key=lambda nome: (nome == 'total', nome)):
+        dados = resumo[nome]
+        print(
+            f"{nome:<10} {dados['requisicoes']:>8} {dados['erros']:>6} {dados['rps']:>8} "
+            f"{dados['p50_ms']:>8} {dados['p95_ms']:>8} {dados['p99_ms']:>8} {dados['max_ms']:>8}"
+        )
+
+
+def aguardar_servidor(url, timeout=60):
+    limite = time.monotonic() + timeout
+    while time.monotonic() < limite:
+        try:
+            if requests.get(f'{url}/', timeout=2).status_code == 200:
+                return True
+        except requests.RequestException:
+            pass
+        time.sleep(0.5)
+    return False
+
+
+def remover_banco(banco):
+    for sufixo in ('', '-wal', '-shm'):
+        if os.path.exists(banco + sufixo):
+            os.remove(banco + sufixo)
+
+
+def executar_relatorio(args):
+    """Mede a carga para cada tamanho de banco, com servidor e simulador locais"""
+    simulador = iniciar_simulador(args.porta_simulador, args.latencia_ms, args.variacao_ms, args.taxa_erro)
+    url = f'http://127.0.0.1:{args.porta}'
+    relatorio = {}
+    try:
+        for tamanho in args.tamanhos:
+            banco = os.path.join(args.diretorio, f'benchmark_{tamanho}.db')
+            remover_banco(banco)
+            print(f"\n🗄️ Populando {banco} com {tamanho} clientes...")
+            popular_banco(banco, tamanho)
+
+            ambiente = dict(
+                os.environ,
+                DATABASE_PATH=banco,
+                PORT=str(args.porta),
+                DEBUG='False',
+                KOLMEYA_API_URL=f'http://127.0.0.1:{args.porta_simulador}',
+                KOLMEYA_API_KEY='benchmark',
+            )
+            servidor = subprocess.Popen(
+                [sys.executable, os.path.join(DIRETORIO, 'webkolm.py'), 'servir',
+                 '--workers', str(args.workers), '--threads', str(args.threads)],
+                env=ambiente, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+            )
+            try:
+                if not aguardar_servidor(url):
+                    raise RuntimeError('Servidor não respondeu a tempo')
+                gerador = GeradorCarga(url, args.concorrencia, args.mix, carregar_link_ids(url))
+                if args.aquecimento:
+                    gerador.executar(args.aquecimento)
+                resultados, duracao = gerador.executar(args.duracao)
+                relatorio[tamanho] = resumir(resultados, duracao)
+                imprimir_resumo(relatorio[tamanho], f"{tamanho} clientes")
+            finally:
+                servidor.terminate()
+                servidor.wait(60)
+                if not args.manter_bancos:
+                    remover_banco(banco)
+    finally:
+        simulador.shutdown()
+
+    print("\n📈 Total por tamanho de banco")
+    print(f"{'clientes':>10} {'req/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'erros':>6}")
+    for tamanho, resumo in relatorio.items():
+        total = resumo['total']
+        print(
+            f"{tamanho:>10} {total['rps']:>8} {total['p50_ms']:>8} {total['p95_ms']:>8} "
+            f"{total['p99_ms']:>8} {total['erros']:>6}"
+        )
+    if args.saida:
+        with open(args.saida, 'w', encoding='utf-8') as arquivo:
+            json.dump(relatorio, arquivo, indent=2, ensure_ascii=False)
+        print(f"\n💾 Relatório salvo em {args.saida}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark do Sistema de Webhook Kolmeya')
+    comandos = parser.add_subparsers(dest='comando', required=True)
+
+    def opcoes_simulador(subparser):
+        subparser.add_argument('--porta-simulador', type=int, default=5099)
+        subparser.add_argument('--latencia-ms', type=float, default=50, help='Latência média da API simulada')
+        subparser.add_argument('--variacao-ms', type=float, default=20, help='Variação (±) da latência')
+        subparser.add_argument('--taxa-erro', type=float, default=0.0, help='Fração de respostas HTTP 500')
+
+    def opcoes_carga(subparser):
+        subparser.add_argument('--concorrencia', type=int, default=16, help='Clientes simultâneos')
+        subparser.add_argument('--duracao', type=float, default=30, help='Duração da medição em segundos')
+        subparser.add_argument('--mix', type=ler_mix, default=ler_mix(MIX_PADRAO), help=f'Pesos (padrão: {MIX_PADRAO})')
+
+    parser_simulador = comandos.add_parser('simulador', help='Inicia o simulador da API Kolmeya')
+    opcoes_simulador(parser_simulador)
+
+    parser_popular = comandos.add_parser('popular', help='Gera massa de dados no banco')
+    parser_popular.add_argument('--banco', default=webkolm.DATABASE_PATH)
+    parser_popular.add_argument('--clientes', type=int, default=100000)
+    parser_popular.add_argument('--taxa-clique', type=float, default=0.3)
+    parser_popular.add_argument('--dias', type=int, default=30)
+
+    parser_carga = comandos.add_parser('carga', help='Gera carga contra um servidor em execução')
+    parser_carga.add_argument('--url', default='http://localhost:5000')
+    opcoes_carga(parser_carga)
+    parser_carga.add_argument('--saida', help='Salva o resumo em JSON')
+
+    parser_relatorio = comandos.add_parser('relatorio', help='Mede a carga em vários tamanhos de banco')
+    parser_relatorio.add_argument(
+        '--tamanhos', type=lambda texto: [int(valor) for valor in texto.split(',')],
+        default=[10000, 100000, 1000000], help='Quantidades de clientes (ex.: 10000,100000)'
+    )
+    parser_relatorio.add_argument('--diretorio', default='.', help='Onde criar os bancos temporários')
+    parser_relatorio.add_argument('--manter-bancos', action='store_true')
+    parser_relatorio.add_argument('--porta', type=int, default=5098)
+    parser_relatorio.add_argument('--workers', type=int, default=1)
+    parser_relatorio.add_argument('--threads', type=int, default=1)
+    parser_relatorio.add_argument('--aquecimento', type=float, default=3, help='Segundos de carga descartados')
+    parser_relatorio.add_argument('--saida', help='Salva o relatório em JSON')
+    opcoes_simulador(parser_relatorio)
+    opcoes_carga(parser_relatorio)
+
+    args = parser.parse_args()
+
+    if args.comando == 'simulador':
+        iniciar_simulador(args.porta_simulador, args.latencia_ms, args.variacao_ms, args.taxa_erro)
+        print(f"🛰️ Simulador Kolmeya em http://127.0.0.1:{args.porta_simulador}/sms/enviar (Ctrl+C para parar)")
+        print(f"   Use KOLMEYA_API_URL=http://127.0.0.1:{args.porta_simulador} no servidor")
+        try:
+            while True:
+                time.sleep(3600)
+        except KeyboardInterrupt:
+            pass
+    elif args.comando == 'popular':
+        print(f"🗄️ Populando {args.banco} com {args.clientes} clientes...")
+        t0 = time.perf_counter()
+        popular_banco(args.banco, args.clientes, taxa_clique=args.taxa_clique, dias=args.dias)
+        print(f"✅ Concluído em {time.perf_counter() - t0:.1f}s")
+    elif args.comando == 'carga':
+        gerador = GeradorCarga(args.url, args.concorrencia, args.mix, carregar_link_ids(args.url))
+        print(f"🚀 {args.concorrencia} clientes por {args.duracao}s contra {args.url}...")
+        resultados, duracao = gerador.executar(args.duracao)
+        resumo = resumir(resultados, duracao)
+        imprimir_resumo(resumo, f"{args.url} ({duracao:.1f}s)")
+        if args.saida:
+            with open(args.saida, 'w', encoding='utf-8') as arquivo:
+                json.dump(resumo, arquivo, indent=2, ensure_ascii=False)
+    else:
+        executar_relatorio(args)
+
+
+if __name__ == '__main__':
+    main()
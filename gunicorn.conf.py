@@ -0,0 +1,34 @@
+"""
+Configuração do gunicorn para o Sistema de Webhook Kolmeya
+Uso: gunicorn -c gunicorn.conf.py wsgi:app  (ou python webkolm.py servir --workers N)
+"""
+
+import os
+
+bind = f"0.0.0.0:{os.getenv('PORT', 5000)}"
+# Mesmos padrões de webkolm.py (WEB_WORKERS, WEB_THREADS) e config.env.example
+workers = int(os.getenv('WEB_WORKERS', 2))
+threads = int(os.getenv('WEB_THREADS', 4))
+worker_class = 'gthread'
+timeout = int(os.getenv('WEB_TIMEOUT', 30))
+graceful_timeout = int(os.getenv('WEB_GRACEFUL_TIMEOUT', 30))
+keepalive = 5
+accesslog = '-' if os.getenv('WEB_ACCESS_LOG', 'False').lower() == 'true' else None
+
+# O webkolm divide os limites de taxa do Kolmeya pelo número de processos
+os.environ['WEB_WORKERS'] = str(workers)
+os.environ['WEB_THREADS'] = str(threads)
+
+
+def on_starting(server):
+    """Aplica as migrações uma única vez, no processo mestre, antes de criar os workers"""
+    import webkolm
+    webkolm.init_database()
+    # Os workers abrem as próprias conexões
+    webkolm.obter_pool().fechar()
+
+
+def worker_exit(server, worker):
+    """Grava os buffers e aguarda os envios em andamento antes de o worker sair"""
+    import webkolm
+    webkolm.encerrar_processo()
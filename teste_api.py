@@ -30,9 +30,9 @@ def testar_envio_sms():
             headers={'Content-Type': 'application/json'}
         )
         
-        if response.status_code == 200:
+        if response.status_code in (200, 202):
             resultado = response.json()
-            print("✅ SMS enviado com sucesso!")
+            print("✅ SMS enfileirado com sucesso!")
             print(f"📱 Link ID: {resultado.get('link_id')}")
             print(f"🔗 Link rastreável: {resultado.get('link_rastreavel')}")
             return resultado.get('link_id')
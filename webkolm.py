@@ -6,17 +6,53 @@ Integração completa para disparo de SMS e rastreamento de cliques
 """
 
 import os
+import io
+import math
+import sys
+import signal
+import csv
 import json
 import sqlite3
 import requests
-from datetime import datetime
-from flask import Flask, request, jsonify, redirect, render_template_string
+from requests.adapters import HTTPAdapter
+from collections import deque, Counter, OrderedDict
+from datetime import datetime, timedelta, timezone
+from flask import Flask, Response, g, request, jsonify, redirect, render_template
+from jinja2 import DictLoader
+from werkzeug.http import is_resource_modified
+from werkzeug.middleware.proxy_fix import ProxyFix
 from flask_cors import CORS
-import uuid
+import secrets
+import string
+import zlib
+import gzip
+import base64
+import hashlib
+import bisect
+import re
+import ipaddress
+import itertools
+import functools
+import importlib.util
+import time
+import random
+import atexit
 import logging
+import logging.handlers
+import argparse
+import threading
+import queue
+import tempfile
+from contextlib import contextmanager
 
-# Configuração de logging
-logging.basicConfig(level=logging.INFO)
+# Opcional: necessário apenas com BANCO_BACKEND=postgres
+try:
+    import psycopg2
+    import psycopg2.extensions
+except ImportError:
+    psycopg2 = None
+
+# Configuração de logging (ver configurar_logging)
 logger = logging.getLogger(__name__)
 
 app = Flask(__name__)
@@ -32,111 +68,3137 @@ DESTINO_URL = os.getenv('DESTINO_URL', 'https://google.com')
 import os
 from dotenv import load_dotenv
 
-# Carrega variáveis de ambiente do arquivo .env se existir
-load_dotenv()
+# Carrega variáveis de ambiente do arquivo .env se existir
+load_dotenv()
+
+# Configurações do banco de dados
+# BANCO_BACKEND=sqlite usa o arquivo DATABASE_PATH; BANCO_BACKEND=postgres usa DATABASE_URL,
+# compartilhado entre várias instâncias atrás de um balanceador
+BANCO_BACKEND = os.getenv('BANCO_BACKEND', 'sqlite').lower()
+DATABASE_URL = os.getenv('DATABASE_URL', '')
+DATABASE_PATH = os.getenv('DATABASE_PATH', 'kolmeya_webhook.db')
+# Máximo de conexões abertas por processo; com todas em uso, espera até DB_POOL_ESPERA segundos
+DB_POOL_TAMANHO = int(os.getenv('DB_POOL_TAMANHO', 8))
+DB_POOL_ESPERA = float(os.getenv('DB_POOL_ESPERA', 10))
+DB_BUSY_TIMEOUT_MS = int(os.getenv('DB_BUSY_TIMEOUT_MS', 5000))
+DB_CACHE_STATEMENTS = int(os.getenv('DB_CACHE_STATEMENTS', 256))
+DB_CACHE_KB = int(os.getenv('DB_CACHE_KB', 16384))
+
+# Configurações do cache de links
+CACHE_LINKS_TAMANHO = int(os.getenv('CACHE_LINKS_TAMANHO', 100000))
+CACHE_LINKS_TTL = float(os.getenv('CACHE_LINKS_TTL', 3600))
+
+# Configurações da gravação em lote de cliques (write-behind)
+CLIQUES_LOTE_TAMANHO = int(os.getenv('CLIQUES_LOTE_TAMANHO', 500))
+CLIQUES_LOTE_INTERVALO_MS = int(os.getenv('CLIQUES_LOTE_INTERVALO_MS', 200))
+CLIQUES_BUFFER_CAPACIDADE = int(os.getenv('CLIQUES_BUFFER_CAPACIDADE', 50000))
+CLIQUES_BUFFER_POLITICA = os.getenv('CLIQUES_BUFFER_POLITICA', 'bloquear')
+
+# Configurações da ingestão de webhooks
+WEBHOOKS_LOTE_TAMANHO = int(os.getenv('WEBHOOKS_LOTE_TAMANHO', 500))
+WEBHOOKS_LOTE_INTERVALO_MS = int(os.getenv('WEBHOOKS_LOTE_INTERVALO_MS', 200))
+WEBHOOKS_BUFFER_CAPACIDADE = int(os.getenv('WEBHOOKS_BUFFER_CAPACIDADE', 50000))
+WEBHOOKS_BUFFER_POLITICA = os.getenv('WEBHOOKS_BUFFER_POLITICA', 'bloquear')
+WEBHOOK_DEDUPE_CACHE = int(os.getenv('WEBHOOK_DEDUPE_CACHE', 100000))
+WEBHOOK_DEDUPE_TTL = float(os.getenv('WEBHOOK_DEDUPE_TTL', 86400))
+# Campos do payload que identificam o evento no Kolmeya, em ordem de preferência
+WEBHOOK_CAMPOS_ID = ('id_evento', 'evento_id', 'event_id', 'id')
+
+# Tempo que o resumo do dashboard fica em cache
+DASHBOARD_CACHE_TTL = float(os.getenv('DASHBOARD_CACHE_TTL', 2))
+
+# Paginação da listagem de cliques
+CLIQUES_LIMITE_PADRAO = int(os.getenv('CLIQUES_LIMITE_PADRAO', 100))
+CLIQUES_LIMITE_MAXIMO = int(os.getenv('CLIQUES_LIMITE_MAXIMO', 1000))
+
+# Exportação de dados
+EXPORTACAO_TAMANHO_PAGINA = int(os.getenv('EXPORTACAO_TAMANHO_PAGINA', 5000))
+# 'clientes' é a visão que junta links e contatos, no formato anterior à migração 10
+TABELAS_EXPORTACAO = {
+    'clientes': ('id', 'telefone', 'nome', 'cpf', 'link_id', 'campanha', 'data_criacao'),
+    'contatos': ('id', 'chave', 'telefone', 'nome', 'cpf', 'data_criacao'),
+    'contatos_historico': ('id', 'contato_id', 'telefone', 'nome', 'data_criacao'),
+    'links': ('id', 'link_id', 'contato_id', 'versao_contato_id', 'campanha', 'data_criacao'),
+    'cliques': ('id', 'link_id', 'ip_address', 'user_agent', 'data_clique'),
+    'webhooks': ('id', 'evento', 'telefone', 'link_id', 'dados', 'chave_dedupe', 'data_recebimento'),
+}
+
+# Retenção: registros mais antigos que N dias vão para arquivos NDJSON.gz mensais (0 desativa)
+RETENCAO_DIAS = {
+    'cliques': int(os.getenv('RETENCAO_CLIQUES_DIAS', 0)),
+    'webhooks': int(os.getenv('RETENCAO_WEBHOOKS_DIAS', 0)),
+}
+COLUNAS_DATA_ARQUIVO = {'cliques': 'data_clique', 'webhooks': 'data_recebimento'}
+ARQUIVO_DIRETORIO = os.getenv('ARQUIVO_DIRETORIO', 'arquivo')
+ARQUIVO_LOTE = int(os.getenv('ARQUIVO_LOTE', 2000))
+ARQUIVO_PAUSA_MS = int(os.getenv('ARQUIVO_PAUSA_MS', 50))
+ARQUIVO_VACUUM_PAGINAS = int(os.getenv('ARQUIVO_VACUUM_PAGINAS', 1000))
+ARQUIVO_LIMITE_CONSULTA = int(os.getenv('ARQUIVO_LIMITE_CONSULTA', 10000))
+
+# Links rastreáveis: IDs curtos em base62 e formato do link
+# 'consulta' gera /clique?id=<id>; 'caminho' gera o link mais curto /c/<id>
+LINK_ID_TAMANHO = int(os.getenv('LINK_ID_TAMANHO', 8))
+LINK_FORMATO = os.getenv('LINK_FORMATO', 'consulta')
+ALFABETO_BASE62 = string.digits + string.ascii_letters
+
+# Filtro de Bloom dos link_ids existentes (rejeita IDs desconhecidos sem consultar o banco)
+# A capacidade é a mínima: o filtro é dimensionado para o dobro dos links existentes
+FILTRO_LINKS_CAPACIDADE = int(os.getenv('FILTRO_LINKS_CAPACIDADE', 100000))
+FILTRO_LINKS_TAXA_FP = float(os.getenv('FILTRO_LINKS_TAXA_FP', 0.001))
+FILTRO_LINKS_SINCRONIZACAO = float(os.getenv('FILTRO_LINKS_SINCRONIZACAO', 1))
+# No PostgreSQL, inserções concorrentes podem ser confirmadas fora da ordem dos ids:
+# cada sincronização relê os últimos N ids para não perder links
+FILTRO_LINKS_SOBREPOSICAO = int(os.getenv('FILTRO_LINKS_SOBREPOSICAO', 0 if BANCO_BACKEND == 'sqlite' else 20000))
+
+# Robôs e pré-visualizações em /clique: aplicativos de mensagem e scanners das operadoras
+# abrem o link antes da pessoa. Esses acessos são classificados antes de consultar o banco,
+# redirecionados sem gravar o clique e, com BOT_CONTAR, somados à métrica 'cliques_bot'
+BOT_FILTRO_ATIVO = os.getenv('BOT_FILTRO_ATIVO', 'true').lower() == 'true'
+BOT_CONTAR = os.getenv('BOT_CONTAR', 'true').lower() == 'true'
+# Trechos (expressões regulares, sem diferenciar maiúsculas) de User-Agents de robôs;
+# BOT_PADROES_UA_EXTRA acrescenta outros, separados por vírgula
+BOT_PADROES_UA = (
+    r'(?<!cu)bot\b', 'crawl', 'spider', 'slurp', 'preview', 'facebookexternalhit',
+    'facebookcatalog', 'whatsapp', 'embedly', 'vkshare', 'pinterest', 'outbrain', 'scanner',
+    'headlesschrome', 'phantomjs', 'lighthouse', 'python-requests', 'python-urllib', 'curl/',
+    'wget', 'go-http-client', 'okhttp', 'java/', 'axios', 'node-fetch', 'libwww-perl',
+    'httpclient', 'google-read-aloud', 'mediapartners',
+) + tuple(p.strip() for p in os.getenv('BOT_PADROES_UA_EXTRA', '').split(',') if p.strip())
+# Faixas de IP (CIDR, separadas por vírgula) dos robôs de pré-visualização (padrão: Google e Meta)
+BOT_REDES_IP = os.getenv(
+    'BOT_REDES_IP',
+    '66.249.64.0/19,69.63.176.0/20,66.220.144.0/20,173.252.64.0/18,31.13.24.0/21,31.13.64.0/18,2a03:2880::/32'
+)
+# Mais de BOT_RAJADA_LIMITE acessos ao mesmo link em BOT_RAJADA_JANELA segundos são tratados
+# como robôs (0 desativa a regra), mas só os que também vêm sem Accept-Language: navegadores
+# sempre enviam o cabeçalho, então cliques repetidos de uma pessoa nunca são descartados
+BOT_RAJADA_JANELA = float(os.getenv('BOT_RAJADA_JANELA', 2))
+BOT_RAJADA_LIMITE = int(os.getenv('BOT_RAJADA_LIMITE', 3))
+BOT_CACHE_UA = int(os.getenv('BOT_CACHE_UA', 4096))
+
+# Número de proxies confiáveis à frente do servidor (1 no Render). O IP do cliente é o
+# endereço que o último deles acrescentou ao X-Forwarded-For; os anteriores vêm do cliente
+# e podem ser forjados. 0 usa o endereço da conexão e ignora o cabeçalho
+PROXIES_CONFIAVEIS = int(os.getenv('PROXIES_CONFIAVEIS', 0))
+if PROXIES_CONFIAVEIS > 0:
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=PROXIES_CONFIAVEIS)
+
+# Estatísticas: número máximo de períodos por série
+ESTATISTICAS_MAXIMO_PERIODOS = int(os.getenv('ESTATISTICAS_MAXIMO_PERIODOS', 10000))
+
+# Configurações de ingestão em lote
+TAMANHO_LOTE_INSERCAO = int(os.getenv('TAMANHO_LOTE_INSERCAO', 5000))
+CAMPOS_OBRIGATORIOS = ('telefone', 'nome', 'cpf', 'mensagem')
+# Sem CPF o contato é identificado pelo telefone (ver chave_contato)
+CAMPOS_OPCIONAIS_VAZIOS = ('cpf',)
+
+# Configurações da fila de envio de SMS
+ENVIO_WORKERS = int(os.getenv('ENVIO_WORKERS', 4))
+ENVIO_MAX_TENTATIVAS = int(os.getenv('ENVIO_MAX_TENTATIVAS', 5))
+ENVIO_BACKOFF_BASE = float(os.getenv('ENVIO_BACKOFF_BASE', 2))
+ENVIO_BACKOFF_MAXIMO = float(os.getenv('ENVIO_BACKOFF_MAXIMO', 300))
+ENVIO_TEMPO_RESERVA = float(os.getenv('ENVIO_TEMPO_RESERVA', 120))
+ENVIO_INTERVALO_CONSULTA = float(os.getenv('ENVIO_INTERVALO_CONSULTA', 1))
+
+# Processos do servidor em produção (gunicorn); os limites de taxa do Kolmeya
+# são divididos entre eles. Os padrões são os mesmos do gunicorn.conf.py;
+# com WEB_WORKERS=1 e WEB_THREADS=1, `servir` usa o servidor de desenvolvimento
+WEB_WORKERS = max(1, int(os.getenv('WEB_WORKERS', 2)))
+WEB_THREADS = max(1, int(os.getenv('WEB_THREADS', 4)))
+
+# Eventos ao vivo (/eventos): cada conexão ocupa uma thread do worker enquanto estiver
+# aberta. O limite por processo nunca passa de WEB_THREADS - 1, para sempre sobrar uma
+# thread para as demais requisições; com WEB_THREADS=1 os eventos ficam desativados e o
+# dashboard consulta a própria página a cada DASHBOARD_ATUALIZACAO segundos
+EVENTOS_MAX_ASSINANTES = min(int(os.getenv('EVENTOS_MAX_ASSINANTES', 2)), WEB_THREADS - 1)
+DASHBOARD_ATUALIZACAO = float(os.getenv('DASHBOARD_ATUALIZACAO', 15))
+EVENTOS_FILA_ASSINANTE = int(os.getenv('EVENTOS_FILA_ASSINANTE', 1000))
+EVENTOS_INTERVALO = float(os.getenv('EVENTOS_INTERVALO', 1))
+EVENTOS_LOTE = int(os.getenv('EVENTOS_LOTE', 500))
+EVENTOS_KEEPALIVE = float(os.getenv('EVENTOS_KEEPALIVE', 15))
+EVENTOS_DURACAO_MAXIMA = float(os.getenv('EVENTOS_DURACAO_MAXIMA', 600))
+# No PostgreSQL, lotes gravados por workers diferentes podem ser confirmados fora da ordem
+# dos ids: cada leitura relê os últimos N ids e pula os já publicados
+EVENTOS_SOBREPOSICAO = int(os.getenv('EVENTOS_SOBREPOSICAO', 0 if BANCO_BACKEND == 'sqlite' else 5000))
+
+# Configurações do cliente HTTP do Kolmeya
+KOLMEYA_TIMEOUT = float(os.getenv('KOLMEYA_TIMEOUT', 30))
+KOLMEYA_POOL_CONEXOES = int(os.getenv('KOLMEYA_POOL_CONEXOES', max(10, ENVIO_WORKERS)))
+KOLMEYA_TAXA_MAXIMA = float(os.getenv('KOLMEYA_TAXA_MAXIMA', 20))
+KOLMEYA_TAXA_RAJADA = int(os.getenv('KOLMEYA_TAXA_RAJADA', 0)) or None
+KOLMEYA_DISJUNTOR_LIMITE_ERRO = float(os.getenv('KOLMEYA_DISJUNTOR_LIMITE_ERRO', 0.5))
+KOLMEYA_DISJUNTOR_VOLUME_MINIMO = int(os.getenv('KOLMEYA_DISJUNTOR_VOLUME_MINIMO', 20))
+KOLMEYA_DISJUNTOR_JANELA = float(os.getenv('KOLMEYA_DISJUNTOR_JANELA', 60))
+KOLMEYA_DISJUNTOR_TEMPO_ABERTO = float(os.getenv('KOLMEYA_DISJUNTOR_TEMPO_ABERTO', 30))
+
+# Configurações de logging: as mensagens são formatadas e gravadas por uma thread
+# em segundo plano; eventos de alto volume podem ser amostrados e limitados
+LOG_NIVEL = os.getenv('LOG_NIVEL', 'INFO').upper()
+LOG_FORMATO = os.getenv('LOG_FORMATO', 'json')  # 'json' (uma linha por evento) ou 'texto'
+LOG_FILA_CAPACIDADE = int(os.getenv('LOG_FILA_CAPACIDADE', 10000))
+LOG_LIMITE_POR_SEGUNDO = int(os.getenv('LOG_LIMITE_POR_SEGUNDO', 100))
+LOG_AMOSTRAGEM = {
+    'clique': float(os.getenv('LOG_AMOSTRAGEM_CLIQUES', 0.01)),
+    'webhook': float(os.getenv('LOG_AMOSTRAGEM_WEBHOOKS', 0.1)),
+}
+
+class FormatadorJSON(logging.Formatter):
+    """Uma linha JSON compacta por registro, com os campos passados em extra={'campos': {...}}"""
+
+    def format(self, record):
+        registro = {
+            'ts': time.strftime('%Y-%m-%dT%H:%M:%S', time.gmtime(record.created)) + f'.{int(record.msecs):03d}Z',
+            'nivel': record.levelname,
+            'logger': record.name,
+            'mensagem': record.getMessage(),
+            'pid': record.process,
+        }
+        evento = getattr(record, 'evento', None)
+        if evento:
+            registro['evento'] = evento
+        campos = getattr(record, 'campos', None)
+        if campos:
+            registro.update(campos)
+        if record.exc_info:
+            registro['excecao'] = self.formatException(record.exc_info)
+        return json.dumps(registro, ensure_ascii=False, separators=(',', ':'), default=str)
+
+class FiltroVolume(logging.Filter):
+    """
+    Amostragem e limite por segundo dos registros de eventos de alto volume
+    (marcados com extra={'evento': ...}); os demais registros passam sempre
+    """
+
+    def __init__(self, amostragem, limite_por_segundo):
+        super().__init__()
+        self.amostragem = amostragem
+        self.limite_por_segundo = limite_por_segundo
+        self.descartados = {'amostragem': 0, 'limite': 0}
+        self._janelas = {}
+        # Chamado pelas threads de requisição (gthread) ao mesmo tempo
+        self._lock = threading.Lock()
+
+    def filter(self, record):
+        evento = getattr(record, 'evento', None)
+        if evento is None:
+            return True
+        taxa = self.amostragem.get(evento, 1.0)
+        if taxa < 1.0 and random.random() >= taxa:
+            with self._lock:
+                self.descartados['amostragem'] += 1
+            return False
+        if self.limite_por_segundo > 0:
+            segundo = int(record.created)
+            with self._lock:
+                janela = self._janelas.get(evento)
+                if janela is None or janela[0] != segundo:
+                    janela = self._janelas[evento] = [segundo, 0]
+                janela[1] += 1
+                if janela[1] > self.limite_por_segundo:
+                    self.descartados['limite'] += 1
+                    return False
+        return True
+
+class FilaLogHandler(logging.handlers.QueueHandler):
+    """
+    Enfileira os registros sem formatá-los: a mensagem é montada pela thread
+    do listener. Com a fila cheia, o registro é descartado em vez de bloquear
+    """
+
+    def __init__(self, fila):
+        super().__init__(fila)
+        self.descartados = 0
+
+    def prepare(self, record):
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.descartados += 1
+
+_log_listener = None
+_log_handler = None
+_log_filtro = None
+
+def iniciar_listener_log():
+    """Cria a fila e a thread que grava os logs (também no processo filho após um fork)"""
+    global _log_listener
+    fila = queue.Queue(LOG_FILA_CAPACIDADE)
+    _log_handler.queue = fila
+    saida = logging.StreamHandler()
+    if LOG_FORMATO == 'json':
+        saida.setFormatter(FormatadorJSON())
+    else:
+        saida.setFormatter(logging.Formatter('%(asctime)s %(levelname)s %(name)s: %(message)s'))
+    _log_listener = logging.handlers.QueueListener(fila, saida)
+    _log_listener.start()
+
+def parar_listener_log():
+    """Grava os logs pendentes e encerra a thread do listener"""
+    if _log_listener is not None and _log_listener._thread is not None:
+        _log_listener.stop()
+
+def configurar_logging():
+    """
+    Direciona o logging para uma fila consumida em segundo plano
+    Como o logging.basicConfig, não altera um logging já configurado
+    """
+    global _log_handler, _log_filtro
+    raiz = logging.getLogger()
+    if raiz.handlers:
+        return
+    _log_filtro = FiltroVolume(LOG_AMOSTRAGEM, LOG_LIMITE_POR_SEGUNDO)
+    _log_handler = FilaLogHandler(None)
+    _log_handler.addFilter(_log_filtro)
+    raiz.addHandler(_log_handler)
+    raiz.setLevel(LOG_NIVEL)
+    iniciar_listener_log()
+    # Registrado antes dos demais: o atexit executa na ordem inversa, então os logs
+    # do encerramento (gravadores, workers de envio) ainda são gravados
+    atexit.register(parar_listener_log)
+    if hasattr(os, 'register_at_fork'):
+        os.register_at_fork(after_in_child=iniciar_listener_log)
+
+configurar_logging()
+
+# Métricas no formato do Prometheus (/metrics): número de partições por coletor
+METRICAS_PARTICOES = int(os.getenv('METRICAS_PARTICOES', 16))
+# Com vários workers, cada processo grava as próprias amostras a cada METRICAS_INTERVALO
+# segundos em METRICAS_DIRETORIO (padrão: pasta temporária por processo mestre do gunicorn)
+METRICAS_DIRETORIO = os.getenv('METRICAS_DIRETORIO', '')
+METRICAS_INTERVALO = float(os.getenv('METRICAS_INTERVALO', 5))
+
+# Limites (segundos) dos histogramas de latência
+LIMITES_HTTP = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+LIMITES_SQLITE = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1)
+
+_particao_thread = threading.local()
+_proxima_particao = itertools.count()
+
+def particao_thread():
+    """Partição dos coletores usada pela thread atual (atribuída em rodízio)"""
+    try:
+        return _particao_thread.indice
+    except AttributeError:
+        indice = _particao_thread.indice = next(_proxima_particao) % METRICAS_PARTICOES
+        return indice
+
+def formatar_rotulos(nomes, valores):
+    """Rótulos no formato do Prometheus: {nome="valor",...}"""
+    pares = [
+        nome + '="' + str(valor).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') + '"'
+        for nome, valor in zip(nomes, valores)
+    ]
+    return '{' + ','.join(pares) + '}' if pares else ''
+
+class Coletor:
+    """
+    Base dos contadores e histogramas: os valores ficam divididos em partições,
+    cada uma com seu lock, e cada thread escreve sempre na mesma partição,
+    de modo que threads diferentes raramente disputam o mesmo lock
+    """
+
+    tipo = None
+
+    def __init__(self, nome, ajuda, rotulos=()):
+        self.nome = nome
+        self.ajuda = ajuda
+        self.rotulos = tuple(rotulos)
+        self._particoes = [({}, threading.Lock()) for _ in range(METRICAS_PARTICOES)]
+        REGISTRO_METRICAS.append(self)
+
+    def _series(self):
+        """Soma as partições: {valores dos rótulos: lista de valores}"""
+        series = {}
+        for dados, lock in self._particoes:
+            with lock:
+                itens = [(rotulos, list(valores)) for rotulos, valores in dados.items()]
+            for rotulos, valores in itens:
+                total = series.get(rotulos)
+                if total is None:
+                    series[rotulos] = valores
+                else:
+                    for indice, valor in enumerate(valores):
+                        total[indice] += valor
+        return series
+
+    compartilhado = False
+
+    def cabecalho(self):
+        return [f'# HELP {self.nome} {self.ajuda}', f'# TYPE {self.nome} {self.tipo}']
+
+    def amostras(self):
+        linhas = []
+        for rotulos, valores in sorted(self._series().items()):
+            linhas.extend(self._linhas(rotulos, valores))
+        return linhas
+
+class Contador(Coletor):
+    """Contador monotônico por combinação de rótulos"""
+
+    tipo = 'counter'
+
+    def incrementar(self, *rotulos, valor=1):
+        dados, lock = self._particoes[particao_thread()]
+        with lock:
+            serie = dados.get(rotulos)
+            if serie is None:
+                serie = dados[rotulos] = [0]
+            serie[0] += valor
+
+    def _linhas(self, rotulos, valores):
+        return [f'{self.nome}{formatar_rotulos(self.rotulos, rotulos)} {valores[0]}']
+
+class Histograma(Coletor):
+    """Histograma de durações (segundos) com limites fixos"""
+
+    tipo = 'histogram'
+
+    def __init__(self, nome, ajuda, rotulos=(), limites=LIMITES_HTTP):
+        super().__init__(nome, ajuda, rotulos)
+        self.limites = tuple(limites)
+
+    def observar(self, valor, *rotulos):
+        dados, lock = self._particoes[particao_thread()]
+        with lock:
+            serie = dados.get(rotulos)
+            if serie is None:
+                # Contagem por faixa (a última é +Inf) seguida da soma
+                serie = dados[rotulos] = [0] * (len(self.limites) + 1) + [0.0]
+            serie[bisect.bisect_left(self.limites, valor)] += 1
+            serie[-1] += valor
+
+    def _linhas(self, rotulos, valores):
+        linhas = []
+        acumulado = 0
+        for limite, quantidade in zip(self.limites + ('+Inf',), valores):
+            acumulado += quantidade
+            rotulos_faixa = formatar_rotulos(self.rotulos + ('le',), rotulos + (limite,))
+            linhas.append(f'{self.nome}_bucket{rotulos_faixa} {acumulado}')
+        linhas.append(f'{self.nome}_sum{formatar_rotulos(self.rotulos, rotulos)} {valores[-1]}')
+        linhas.append(f'{self.nome}_count{formatar_rotulos(self.rotulos, rotulos)} {acumulado}')
+        return linhas
+
+class Medidor:
+    """
+    Valores lidos no momento da coleta (ex.: tamanho de filas e caches)
+    `compartilhado` indica valores lidos do banco, iguais em todos os processos:
+    saem sem o rótulo pid e apenas do processo que atende o scrape
+    """
+
+    def __init__(self, nome, ajuda, rotulos, coletar, tipo='gauge', compartilhado=False):
+        self.nome = nome
+        self.ajuda = ajuda
+        self.rotulos = tuple(rotulos)
+        self.coletar = coletar
+        self.tipo = tipo
+        self.compartilhado = compartilhado
+        REGISTRO_METRICAS.append(self)
+
+    def cabecalho(self):
+        return [f'# HELP {self.nome} {self.ajuda}', f'# TYPE {self.nome} {self.tipo}']
+
+    def amostras(self):
+        linhas = []
+        for rotulos, valor in self.coletar():
+            if valor is not None:
+                linhas.append(f'{self.nome}{formatar_rotulos(self.rotulos, rotulos)} {valor}')
+        return linhas
+
+def rotular_processo(linha, pid):
+    """Acrescenta o rótulo pid a uma amostra"""
+    nome, separador, resto = linha.partition('{')
+    if separador:
+        return f'{nome}{{pid="{pid}",{resto}'
+    nome, _, valor = linha.partition(' ')
+    return f'{nome}{{pid="{pid}"}} {valor}'
+
+def amostras_processo():
+    """Amostras dos coletores deste processo, com o rótulo pid: {nome da métrica: linhas}"""
+    pid = os.getpid()
+    return {
+        coletor.nome: [rotular_processo(linha, pid) for linha in coletor.amostras()]
+        for coletor in REGISTRO_METRICAS if not coletor.compartilhado
+    }
+
+class PublicadorMetricas:
+    """
+    Com vários workers do gunicorn, cada scrape de /metrics chega a um processo
+    qualquer. Cada processo grava periodicamente as próprias amostras em um
+    arquivo do diretório compartilhado, e /metrics junta as dos demais processos
+    às suas. Arquivos sem atualização há mais de 3 intervalos (worker encerrado)
+    são ignorados e depois apagados
+    """
+
+    def __init__(self, diretorio, intervalo):
+        self.diretorio = diretorio
+        self.intervalo = intervalo
+        self.ativo = False
+        self._parar = threading.Event()
+        self._thread = None
+        self._pid = None
+
+    def _caminho(self, pid):
+        return os.path.join(self.diretorio, f'{pid}.json')
+
+    def iniciar(self):
+        """Inicia a gravação periódica (idempotente, reinicia após um fork)"""
+        if self._thread and self._thread.is_alive() and self._pid == os.getpid():
+            return
+        if not self.diretorio:
+            # Os workers de um mesmo gunicorn têm o mesmo processo pai
+            self.diretorio = os.path.join(tempfile.gettempdir(), f'webkolm-metricas-{os.getppid()}')
+        os.makedirs(self.diretorio, exist_ok=True)
+        self.ativo = True
+        self._parar.clear()
+        self._pid = os.getpid()
+        self._thread = threading.Thread(target=self._executar, name='metricas', daemon=True)
+        self._thread.start()
+
+    def gravar(self):
+        temporario = self._caminho(os.getpid()) + '.tmp'
+        with open(temporario, 'w', encoding='utf-8') as arquivo:
+            json.dump(amostras_processo(), arquivo)
+        os.replace(temporario, self._caminho(os.getpid()))
+
+    def _executar(self):
+        while not self._parar.is_set():
+            try:
+                self.gravar()
+            except OSError as e:
+                logger.warning("Erro ao gravar as métricas do processo: %s", e)
+            self._parar.wait(self.intervalo)
+
+    def ler_outros(self):
+        """Amostras gravadas pelos demais processos ativos"""
+        if not self.ativo:
+            return []
+        proprio = f'{os.getpid()}.json'
+        agora = time.time()
+        outros = []
+        for nome in os.listdir(self.diretorio):
+            if not nome.endswith('.json') or nome == proprio:
+                continue
+            caminho = os.path.join(self.diretorio, nome)
+            try:
+                idade = agora - os.path.getmtime(caminho)
+                if idade > 10 * self.intervalo:
+                    os.remove(caminho)
+                elif idade <= 3 * self.intervalo:
+                    with open(caminho, encoding='utf-8') as arquivo:
+                        outros.append(json.load(arquivo))
+            except (OSError, ValueError):
+                # Arquivo removido ou substituído durante a leitura
+                continue
+        return outros
+
+    def parar(self):
+        """Encerra a gravação e remove o arquivo do processo"""
+        self._parar.set()
+        if self._thread and self._pid == os.getpid():
+            self._thread.join(1)
+            try:
+                os.remove(self._caminho(self._pid))
+            except OSError:
+                pass
+
+REGISTRO_METRICAS = []
+publicador_metricas = PublicadorMetricas(METRICAS_DIRETORIO, METRICAS_INTERVALO)
+
+metrica_requisicoes = Histograma(
+    'webkolm_http_requisicao_segundos', 'Duração das requisições HTTP por rota e status',
+    ('metodo', 'rota', 'status')
+)
+metrica_sqlite = Histograma(
+    'webkolm_sqlite_segundos', 'Duração das chamadas ao SQLite por operação e comando',
+    ('operacao', 'comando'), LIMITES_SQLITE
+)
+metrica_postgres = Histograma(
+    'webkolm_postgres_segundos', 'Duração das chamadas ao PostgreSQL por operação e comando',
+    ('operacao', 'comando'), LIMITES_SQLITE
+)
+metrica_kolmeya = Histograma(
+    'webkolm_kolmeya_segundos', 'Latência das chamadas de envio à API Kolmeya por resultado',
+    ('resultado',)
+)
+metrica_cliques_bot = Contador(
+    'webkolm_cliques_bot_total', 'Acessos a /clique classificados como robô, por motivo',
+    ('motivo',)
+)
+metrica_kolmeya_recusas = Contador(
+    'webkolm_kolmeya_recusas_total', 'Envios não enviados à API Kolmeya por limite de taxa ou circuito aberto',
+    ('motivo',)
+)
+
+# Comandos SQL identificados nas métricas; os demais aparecem como 'outro'
+COMANDOS_SQL = {'select', 'insert', 'update', 'delete', 'with', 'begin', 'commit', 'rollback', 'pragma',
+                'create', 'alter', 'drop', 'copy', 'lock', 'explain', 'analyze'}
+
+@functools.lru_cache(maxsize=1024)
+def comando_sql(sql):
+    """Primeira palavra do comando SQL, em minúsculas"""
+    partes = sql.split(None, 1)
+    comando = partes[0].lower() if partes else ''
+    return comando if comando in COMANDOS_SQL else 'outro'
+
+class ConexaoMedida(sqlite3.Connection):
+    """Conexão SQLite que registra a duração de execute, executemany e commit"""
+
+    def execute(self, sql, parametros=()):
+        inicio = time.perf_counter()
+        try:
+            return super().execute(sql, parametros)
+        finally:
+            metrica_sqlite.observar(time.perf_counter() - inicio, 'execute', comando_sql(sql))
+
+    def executemany(self, sql, parametros):
+        inicio = time.perf_counter()
+        try:
+            return super().executemany(sql, parametros)
+        finally:
+            metrica_sqlite.observar(time.perf_counter() - inicio, 'executemany', comando_sql(sql))
+
+    def commit(self):
+        inicio = time.perf_counter()
+        try:
+            return super().commit()
+        finally:
+            metrica_sqlite.observar(time.perf_counter() - inicio, 'commit', 'commit')
+
+class PoolConexoes:
+    """
+    Pool de conexões SQLite reutilizadas entre requisições e threads
+    Cada conexão usa WAL, para que leituras não sejam bloqueadas por escritas,
+    e mantém o cache de comandos preparados do módulo sqlite3
+    No máximo `tamanho` conexões ficam abertas; as demais threads aguardam uma
+    devolução por até `espera` segundos
+    """
+
+    def __init__(self, caminho, tamanho, espera=DB_POOL_ESPERA):
+        self.caminho = caminho
+        self.tamanho = tamanho
+        self.espera = espera
+        self.pid = os.getpid()
+        self._livres = queue.LifoQueue()
+        self._vagas = threading.BoundedSemaphore(tamanho)
+        self._criadas = 0
+        self._lock = threading.Lock()
+
+    def criar_conexao(self):
+        conn = sqlite3.connect(
+            self.caminho,
+            timeout=DB_BUSY_TIMEOUT_MS / 1000,
+            check_same_thread=False,
+            cached_statements=DB_CACHE_STATEMENTS,
+            factory=ConexaoMedida
+        )
+        # Só tem efeito em bancos novos; os existentes são convertidos com `arquivar --converter-vacuum`
+        conn.execute('PRAGMA auto_vacuum=INCREMENTAL')
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        conn.execute(f'PRAGMA busy_timeout={DB_BUSY_TIMEOUT_MS}')
+        conn.execute(f'PRAGMA cache_size=-{DB_CACHE_KB}')
+        conn.execute('PRAGMA temp_store=MEMORY')
+        return conn
+
+    def obter(self):
+        """
+        Retorna uma conexão livre, criando uma nova se o pool não estiver cheio
+        Com `tamanho` conexões em uso, aguarda uma devolução
+        """
+        if not self._vagas.acquire(timeout=self.espera):
+            raise RuntimeError(
+                f'Pool de conexões esgotado: {self.tamanho} conexões em uso por mais de '
+                f'{self.espera:g}s (DB_POOL_TAMANHO, DB_POOL_ESPERA)'
+            )
+        try:
+            return self._livres.get_nowait()
+        except queue.Empty:
+            pass
+        try:
+            conn = self.criar_conexao()
+        except Exception:
+            self._vagas.release()
+            raise
+        with self._lock:
+            self._criadas += 1
+        return conn
+
+    def devolver(self, conn):
+        """Devolve a conexão ao pool, descartando transações não finalizadas"""
+        try:
+            if conn.in_transaction:
+                conn.rollback()
+        except Exception as e:
+            logger.warning("Conexão descartada na devolução ao pool: %s", e)
+            self.descartar(conn)
+            return
+        self._livres.put(conn)
+        self._vagas.release()
+
+    def descartar(self, conn):
+        """Fecha uma conexão emprestada que não pode voltar ao pool e libera a vaga"""
+        try:
+            conn.close()
+        except Exception:
+            pass
+        with self._lock:
+            self._criadas -= 1
+        self._vagas.release()
+
+    def fechar(self):
+        """Fecha todas as conexões livres"""
+        while True:
+            try:
+                self._livres.get_nowait().close()
+            except queue.Empty:
+                break
+        with self._lock:
+            self._criadas = 0
+
+
+@functools.lru_cache(maxsize=1024)
+def sql_postgres(sql):
+    """Converte os parâmetros '?' do SQLite para o formato '%s' do psycopg2"""
+    return sql.replace('%', '%%').replace('?', '%s')
+
+def valor_copy(valor):
+    """Valor no formato de texto do COPY: \\N para NULL e barras, tabs e quebras de linha escapados"""
+    if valor is None:
+        return '\\N'
+    return str(valor).replace('\\', '\\\\').replace('\t', '\\t').replace('\n', '\\n').replace('\r', '\\r')
+
+class ConexaoPostgres:
+    """
+    Conexão psycopg2 com a mesma interface usada nas conexões SQLite do pool
+    (execute e executemany retornam o cursor), registrando a duração das chamadas
+    Não é preciso BEGIN: a transação começa no primeiro comando e vai até o commit
+    """
+
+    def __init__(self, conn):
+        self._conn = conn
+
+    def execute(self, sql, parametros=()):
+        cursor = self._conn.cursor()
+        inicio = time.perf_counter()
+        try:
+            if parametros:
+                cursor.execute(sql_postgres(sql), tuple(parametros))
+            else:
+                cursor.execute(sql)
+            return cursor
+        finally:
+            metrica_postgres.observar(time.perf_counter() - inicio, 'execute', comando_sql(sql))
+
+    def executemany(self, sql, parametros):
+        cursor = self._conn.cursor()
+        inicio = time.perf_counter()
+        try:
+            cursor.executemany(sql_postgres(sql), parametros)
+            return cursor
+        finally:
+            metrica_postgres.observar(time.perf_counter() - inicio, 'executemany', comando_sql(sql))
+
+    def copiar(self, tabela, colunas, linhas):
+        """Insere as linhas com COPY ... FROM STDIN, bem mais rápido que INSERTs"""
+        buffer = io.StringIO()
+        for linha in linhas:
+            buffer.write('\t'.join(valor_copy(valor) for valor in linha))
+            buffer.write('\n')
+        buffer.seek(0)
+        inicio = time.perf_counter()
+        try:
+            self._conn.cursor().copy_expert(f"COPY {tabela} ({', '.join(colunas)}) FROM STDIN", buffer)
+        finally:
+            metrica_postgres.observar(time.perf_counter() - inicio, 'copy', 'copy')
+
+    def commit(self):
+        inicio = time.perf_counter()
+        try:
+            self._conn.commit()
+        finally:
+            metrica_postgres.observar(time.perf_counter() - inicio, 'commit', 'commit')
+
+    def rollback(self):
+        self._conn.rollback()
+
+    def close(self):
+        self._conn.close()
+
+    @property
+    def in_transaction(self):
+        return self._conn.info.transaction_status != psycopg2.extensions.TRANSACTION_STATUS_IDLE
+
+    @property
+    def fechada(self):
+        return bool(self._conn.closed)
+
+class PoolConexoesPostgres(PoolConexoes):
+    """
+    Pool de conexões PostgreSQL (o caminho é a URL de conexão)
+    Conexões perdidas (ex.: reinício do servidor) são descartadas na devolução
+    """
+
+    def criar_conexao(self):
+        conn = psycopg2.connect(
+            self.caminho,
+            application_name='webkolm',
+            # Equivalente ao busy_timeout do SQLite: não esperar indefinidamente por bloqueios
+            options=f'-c lock_timeout={DB_BUSY_TIMEOUT_MS}'
+        )
+        return ConexaoPostgres(conn)
+
+    def devolver(self, conn):
+        if conn.fechada:
+            self.descartar(conn)
+            return
+        super().devolver(conn)
+
+# Dados mais recentes do contato prevalecem; sem alteração, a linha não é reescrita
+SQL_ATUALIZAR_CONTATO = '''
+    ON CONFLICT (chave) DO UPDATE SET telefone = excluded.telefone, nome = excluded.nome, cpf = excluded.cpf
+    WHERE contatos.telefone <> excluded.telefone OR contatos.nome <> excluded.nome OR contatos.cpf <> excluded.cpf
+'''
+SQL_GRAVAR_CONTATO = 'INSERT INTO contatos (chave, telefone, nome, cpf) VALUES (?, ?, ?, ?)' + SQL_ATUALIZAR_CONTATO
+
+class RepositorioSQLite:
+    """
+    Armazenamento em um arquivo SQLite local (padrão)
+    Concentra o que depende do banco: pool de conexões, migrações, inserções em lote
+    de clientes, cliques e webhooks, bloqueios de escrita e expressões de data
+    O restante do SQL é comum aos dois bancos
+    """
+
+    nome = 'sqlite'
+    erro_integridade = sqlite3.IntegrityError
+    # Sufixo da consulta que reserva o próximo envio (o BEGIN IMMEDIATE já serializa)
+    sql_reservar = ''
+
+    def __init__(self, caminho):
+        self.caminho = caminho
+
+    def descricao(self):
+        return self.caminho
+
+    def criar_pool(self):
+        return PoolConexoes(self.caminho, DB_POOL_TAMANHO)
+
+    def migracoes(self):
+        return MIGRACOES
+
+    def existe_tabela(self, conn, tabela):
+        return conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (tabela,)
+        ).fetchone() is not None
+
+    def travar_migracoes(self, conn):
+        conn.execute('BEGIN IMMEDIATE')
+
+    def iniciar_escrita(self, conn, tabelas=()):
+        """Abre uma transação que bloqueia outras escritas até o commit"""
+        conn.execute('BEGIN IMMEDIATE')
+
+    def otimizar(self, conn):
+        conn.execute('PRAGMA optimize')
+
+    def plano(self, conn, consulta, parametros):
+        return [linha[-1] for linha in conn.execute(f'EXPLAIN QUERY PLAN {consulta}', parametros)]
+
+    def sql_periodo(self, granularidade, data):
+        """Expressão do início do período (minuto, hora ou dia) de uma data"""
+        return f"strftime('{GRANULARIDADES[granularidade]}', {data})"
+
+    def sql_segundos(self, fim, inicio):
+        """Expressão dos segundos entre duas datas"""
+        return f'(julianday({fim}) - julianday({inicio})) * 86400'
+
+    def inserir(self, conn, tabela, colunas, linhas):
+        """Insere várias linhas, sem commit"""
+        conn.executemany(
+            f"INSERT INTO {tabela} ({', '.join(colunas)}) VALUES ({', '.join('?' for _ in colunas)})",
+            linhas
+        )
+
+    def inserir_ignorando_duplicados(self, conn, tabela, colunas, linhas):
+        """Insere várias linhas, ignorando as que violam um índice único, sem commit"""
+        conn.executemany(
+            f"INSERT OR IGNORE INTO {tabela} ({', '.join(colunas)}) VALUES ({', '.join('?' for _ in colunas)})",
+            linhas
+        )
+
+    def gravar_contatos(self, conn, linhas):
+        """
+        Insere ou atualiza os contatos (chave, telefone, nome, cpf), sem commit
+        Em chaves repetidas prevalecem os últimos dados. Retorna {chave: id}
+        """
+        conn.executemany(SQL_GRAVAR_CONTATO, linhas)
+        chaves = list({linha[0] for linha in linhas})
+        ids = {}
+        for inicio in range(0, len(chaves), 500):
+            parte = chaves[inicio:inicio + 500]
+            ids.update(conn.execute(
+                f"SELECT chave, id FROM contatos WHERE chave IN ({', '.join('?' for _ in parte)})", parte
+            ))
+        return ids
+
+    def gravar_versoes_contatos(self, conn, linhas):
+        """
+        Registra as versões (contato_id, telefone, nome) que ainda não estão no histórico
+        dos contatos, sem commit. Retorna {(contato_id, telefone, nome): id}
+        """
+        versoes = list(dict.fromkeys(linhas))
+        self.inserir_ignorando_duplicados(conn, 'contatos_historico', ('contato_id', 'telefone', 'nome'), versoes)
+        contatos = list({versao[0] for versao in versoes})
+        ids = {}
+        for inicio in range(0, len(contatos), 500):
+            parte = contatos[inicio:inicio + 500]
+            for id_versao, *versao in conn.execute(
+                f"SELECT id, contato_id, telefone, nome FROM contatos_historico "
+                f"WHERE contato_id IN ({', '.join('?' for _ in parte)})", parte
+            ):
+                ids[tuple(versao)] = id_versao
+        return ids
+
+    def compactar(self):
+        return compactar_banco()
+
+class RepositorioPostgres(RepositorioSQLite):
+    """
+    Armazenamento em um servidor PostgreSQL compartilhado por várias instâncias
+    Inserções em lote usam COPY; datas ficam em colunas TEXT no mesmo formato do SQLite
+    ('YYYY-MM-DD HH:MM:SS', UTC), para que consultas e cursores sejam os mesmos nos dois bancos
+    """
+
+    nome = 'postgres'
+    # Cada worker reserva um envio diferente, sem esperar pelos demais
+    sql_reservar = ' FOR UPDATE SKIP LOCKED'
+
+    def __init__(self, url):
+        if psycopg2 is None:
+            raise RuntimeError('BANCO_BACKEND=postgres requer o pacote psycopg2 (pip install psycopg2-binary)')
+        if not url:
+            raise RuntimeError('BANCO_BACKEND=postgres requer DATABASE_URL')
+        super().__init__(url)
+        self.erro_integridade = psycopg2.IntegrityError
+
+    def descricao(self):
+        parametros = psycopg2.extensions.parse_dsn(self.caminho)
+        return f"PostgreSQL {parametros.get('host', 'localhost')}/{parametros.get('dbname', '')}"
+
+    def criar_pool(self):
+        return PoolConexoesPostgres(self.caminho, DB_POOL_TAMANHO)
+
+    def migracoes(self):
+        return MIGRACOES_POSTGRES
+
+    def existe_tabela(self, conn, tabela):
+        return conn.execute('SELECT to_regclass(?) IS NOT NULL', (tabela,)).fetchone()[0]
+
+    def travar_migracoes(self, conn):
+        # Bloqueio consultivo liberado no fim da transação: um processo migra por vez
+        conn.execute('SELECT pg_advisory_xact_lock(?)', (PG_BLOQUEIO_MIGRACOES,))
+
+    def iniciar_escrita(self, conn, tabelas=()):
+        # As leituras continuam liberadas; inserções nas tabelas aguardam o commit
+        for tabela in tabelas:
+            conn.execute(f'LOCK TABLE {tabela} IN EXCLUSIVE MODE')
+
+    def otimizar(self, conn):
+        conn.execute('ANALYZE')
+
+    def plano(self, conn, consulta, parametros):
+        # Com parâmetros nulos o planejador descarta a consulta inteira; o plano
+        # genérico da consulta preparada mostra os índices usados para quaisquer valores
+        partes = consulta.split('?')
+        preparada = ''.join(f'{parte}${numero}' for numero, parte in enumerate(partes[:-1], 1)) + partes[-1]
+        argumentos = f"({', '.join('NULL' for _ in parametros)})" if parametros else ''
+        try:
+            conn.execute('SET LOCAL plan_cache_mode = force_generic_plan')
+            conn.execute(f'PREPARE consulta_plano AS {preparada}')
+            # A consulta preparada sobrevive ao rollback: o savepoint mantém a transação
+            # utilizável para o DEALLOCATE mesmo se o EXPLAIN falhar
+            conn.execute('SAVEPOINT plano')
+            try:
+                return [linha[0] for linha in conn.execute(f'EXPLAIN EXECUTE consulta_plano{argumentos}')]
+            except Exception:
+                conn.execute('ROLLBACK TO SAVEPOINT plano')
+                raise
+            finally:
+                # Antes do rollback: depois dele, o DEALLOCATE abriria uma transação que ficaria ociosa
+                conn.execute('DEALLOCATE consulta_plano')
+        finally:
+            conn.rollback()
+
+    def sql_periodo(self, granularidade, data):
+        return f"to_char(({data})::timestamp, '{FORMATOS_PERIODO_POSTGRES[granularidade]}')"
+
+    def sql_segundos(self, fim, inicio):
+        return f'EXTRACT(EPOCH FROM ({fim})::timestamp - ({inicio})::timestamp)'
+
+    def inserir(self, conn, tabela, colunas, linhas):
+        conn.copiar(tabela, colunas, linhas)
+
+    def inserir_ignorando_duplicados(self, conn, tabela, colunas, linhas):
+        # COPY não aceita ON CONFLICT: as linhas passam por uma tabela temporária da conexão
+        temporaria = f'copia_{tabela}'
+        conn.execute(
+            f"CREATE TEMP TABLE IF NOT EXISTS {temporaria} ON COMMIT DELETE ROWS AS "
+            f"SELECT {', '.join(colunas)} FROM {tabela} WITH NO DATA"
+        )
+        conn.copiar(temporaria, colunas, linhas)
+        conn.execute(
+            f"INSERT INTO {tabela} ({', '.join(colunas)}) "
+            f"SELECT {', '.join(colunas)} FROM {temporaria} ON CONFLICT DO NOTHING"
+        )
+
+    def gravar_contatos(self, conn, linhas):
+        # Um único INSERT ... ON CONFLICT por lote, com as linhas enviadas por COPY
+        conn.execute(
+            'CREATE TEMP TABLE IF NOT EXISTS copia_contatos '
+            '(ordem INTEGER, chave TEXT, telefone TEXT, nome TEXT, cpf TEXT) ON COMMIT DELETE ROWS'
+        )
+        conn.copiar(
+            'copia_contatos', ('ordem', 'chave', 'telefone', 'nome', 'cpf'),
+            ((ordem,) + tuple(linha) for ordem, linha in enumerate(linhas))
+        )
+        conn.execute(f'''
+            INSERT INTO contatos (chave, telefone, nome, cpf)
+            SELECT DISTINCT ON (chave) chave, telefone, nome, cpf FROM copia_contatos
+            ORDER BY chave, ordem DESC
+            {SQL_ATUALIZAR_CONTATO}
+        ''')
+        ids = dict(conn.execute(
+            'SELECT c.chave, c.id FROM contatos c WHERE c.chave IN (SELECT chave FROM copia_contatos)'
+        ))
+        conn.execute('TRUNCATE copia_contatos')
+        return ids
+
+    def compactar(self):
+        logger.info("PostgreSQL: o espaço dos registros apagados é recuperado pelo autovacuum")
+        return 0
+
+repositorio = RepositorioPostgres(DATABASE_URL) if BANCO_BACKEND == 'postgres' else RepositorioSQLite(DATABASE_PATH)
+
+_pool_conexoes = None
+_pool_lock = threading.Lock()
+
+def obter_pool():
+    """Retorna o pool do processo atual (um novo pool é criado após um fork)"""
+    global _pool_conexoes
+    pool = _pool_conexoes
+    if pool is None or pool.pid != os.getpid():
+        with _pool_lock:
+            if _pool_conexoes is None or _pool_conexoes.pid != os.getpid():
+                _pool_conexoes = repositorio.criar_pool()
+            pool = _pool_conexoes
+    return pool
+
+@contextmanager
+def conexao_db():
+    """Empresta uma conexão do pool durante o bloco with"""
+    pool = obter_pool()
+    conn = pool.obter()
+    try:
+        yield conn
+    finally:
+        pool.devolver(conn)
+
+# Granularidades das agregações: nome -> formato strftime do início do período
+GRANULARIDADES = {
+    'minuto': '%Y-%m-%d %H:%M:00',
+    'hora': '%Y-%m-%d %H:00:00',
+    'dia': '%Y-%m-%d 00:00:00',
+}
+
+# Os mesmos formatos na sintaxe do to_char do PostgreSQL
+FORMATOS_PERIODO_POSTGRES = {
+    'minuto': 'YYYY-MM-DD HH24:MI:00',
+    'hora': 'YYYY-MM-DD HH24:00:00',
+    'dia': 'YYYY-MM-DD 00:00:00',
+}
+
+# Chave do bloqueio consultivo que serializa as migrações no PostgreSQL
+PG_BLOQUEIO_MIGRACOES = 7041920
+
+def sql_somar_agregado(metrica, data, valor='1', origem='WHERE 1'):
+    """
+    Comandos que somam `valor` a uma métrica em todas as granularidades
+    (usados nos triggers das tabelas de origem)
+    """
+    return ''.join(f'''
+            INSERT INTO agregados (granularidade, periodo, metrica, valor)
+            SELECT '{granularidade}', strftime('{formato}', {data}), {metrica}, {valor} {origem}
+            ON CONFLICT (granularidade, metrica, periodo) DO UPDATE SET valor = valor + excluded.valor;'''
+        for granularidade, formato in GRANULARIDADES.items()
+    )
+
+def sql_somar_contador(nome, valor):
+    """Comando dos triggers que soma `valor` ao contador `nome`, criando-o se preciso"""
+    return f'''
+            INSERT INTO contadores (nome, valor) VALUES ({nome}, {valor})
+            ON CONFLICT (nome) DO UPDATE SET valor = valor + excluded.valor;'''
+
+# Contadores 'fila:<status>' da fila de envios, lidos pelas métricas sem varrer a tabela
+SQL_CONTAR_FILA_ENVIOS = [
+    "DELETE FROM contadores WHERE nome LIKE 'fila:%'",
+    "INSERT INTO contadores (nome, valor) SELECT 'fila:' || status, COUNT(*) FROM fila_envios GROUP BY status",
+]
+
+# Evento informado no payload de um webhook (apenas para a migração 7;
+# a partir da migração 8 o evento fica na coluna webhooks.evento)
+SQL_EVENTO_WEBHOOK = (
+    "'evento:' || COALESCE(CASE WHEN json_valid(NEW.dados) "
+    "THEN json_extract(NEW.dados, '$.evento') END, 'desconhecido')"
+)
+
+# Preenche status_links a partir dos clientes, envios, cliques e webhooks já gravados
+SQL_RECALCULAR_STATUS_LINKS = [
+    '''
+    INSERT OR IGNORE INTO status_links (link_id, campanha, data_criacao)
+    SELECT link_id, campanha, COALESCE(data_criacao, CURRENT_TIMESTAMP) FROM clientes
+    ''',
+    '''
+    UPDATE status_links SET
+        enviado_em = COALESCE(
+            (SELECT MIN(data_recebimento) FROM webhooks w
+             WHERE w.link_id = status_links.link_id AND w.evento = 'sms_enviado'),
+            (SELECT MIN(data_atualizacao) FROM fila_envios f
+             WHERE f.link_id = status_links.link_id AND f.status = 'enviado')
+        ),
+        entregue_em = (SELECT MIN(data_recebimento) FROM webhooks w
+                       WHERE w.link_id = status_links.link_id AND w.evento = 'sms_entregue'),
+        clicado_em = COALESCE(
+            (SELECT MIN(data_clique) FROM cliques c WHERE c.link_id = status_links.link_id),
+            (SELECT MIN(data_recebimento) FROM webhooks w
+             WHERE w.link_id = status_links.link_id AND w.evento = 'sms_clicado')
+        ),
+        erro_em = COALESCE(
+            (SELECT MIN(data_recebimento) FROM webhooks w
+             WHERE w.link_id = status_links.link_id AND w.evento = 'sms_erro'),
+            (SELECT MIN(data_atualizacao) FROM fila_envios f
+             WHERE f.link_id = status_links.link_id AND f.status = 'morto')
+        )
+    ''',
+]
+
+# Contatos: um por CPF (ou por telefone, quando não há CPF), ignorando a pontuação
+CARACTERES_IGNORADOS_CHAVE = '.-/() +'
+_TABELA_CHAVE_CONTATO = {ord(caractere): None for caractere in CARACTERES_IGNORADOS_CHAVE}
+
+def chave_contato(telefone, cpf):
+    """Chave de deduplicação do contato (a mesma de sql_chave_contato)"""
+    cpf = str(cpf or '').translate(_TABELA_CHAVE_CONTATO)
+    if cpf:
+        return 'cpf:' + cpf
+    return 'tel:' + str(telefone or '').translate(_TABELA_CHAVE_CONTATO)
+
+def sql_chave_contato(telefone, cpf):
+    """Expressão SQL da chave de deduplicação do contato, usada ao migrar os clientes existentes"""
+    def limpar(coluna):
+        expressao = f"COALESCE({coluna}, '')"
+        for caractere in CARACTERES_IGNORADOS_CHAVE:
+            expressao = f"REPLACE({expressao}, '{caractere}', '')"
+        return expressao
+    return f"CASE WHEN {limpar(cpf)} <> '' THEN 'cpf:' || {limpar(cpf)} ELSE 'tel:' || {limpar(telefone)} END"
+
+# Copiam uma faixa de ids (id > ? AND id <= ?) dos clientes para contatos (dados do cadastro
+# mais recente de cada chave) e links; as faixas são copiadas em ordem, então a de ids maiores
+# atualiza o contato. Repetir uma faixa não duplica linhas
+SQL_MIGRAR_CONTATOS = [
+    f'''
+    INSERT INTO contatos (chave, telefone, nome, cpf, data_criacao)
+    SELECT chave, telefone, nome, cpf, primeiro FROM (
+        SELECT chave, telefone, nome, cpf,
+               MIN(data_criacao) OVER (PARTITION BY chave) AS primeiro,
+               ROW_NUMBER() OVER (PARTITION BY chave ORDER BY id DESC) AS ordem
+        FROM (SELECT id, {sql_chave_contato('telefone', 'cpf')} AS chave, telefone, nome, cpf, data_criacao
+              FROM clientes WHERE id > ? AND id <= ?) AS origem
+    ) AS ultimos
+    WHERE ordem = 1
+    ORDER BY primeiro, chave
+    {SQL_ATUALIZAR_CONTATO}
+    ''',
+    f'''
+    INSERT INTO links (id, link_id, contato_id, campanha, data_criacao)
+    SELECT cl.id, cl.link_id, ct.id, cl.campanha, cl.data_criacao
+    FROM clientes cl
+    JOIN contatos ct ON ct.chave = {sql_chave_contato('cl.telefone', 'cl.cpf')}
+    WHERE cl.id > ? AND cl.id <= ?
+    ORDER BY cl.id
+    ON CONFLICT DO NOTHING
+    ''',
+]
+
+def copiar_clientes(conn, em_lotes=True, lote=ARQUIVO_LOTE, pausa_ms=ARQUIVO_PAUSA_MS):
+    """
+    Passo da migração 10: copia os clientes para contatos e links a partir do maior id já
+    copiado (retoma uma cópia interrompida)
+    Com em_lotes, cada faixa de `lote` ids tem a própria transação curta, fora do bloqueio
+    das migrações, para que as gravações continuem durante a cópia; sem em_lotes, copia o
+    restante na transação atual (ver aplicar_migracoes)
+    """
+    inicio = conn.execute('SELECT COALESCE(MAX(id), 0) FROM links').fetchone()[0]
+    while True:
+        # Outro processo pode ter concluído a migração enquanto este copiava
+        if not repositorio.existe_tabela(conn, 'clientes'):
+            return
+        maior_id = conn.execute('SELECT COALESCE(MAX(id), 0) FROM clientes').fetchone()[0]
+        if inicio >= maior_id:
+            return
+        fim = inicio + lote if em_lotes else maior_id
+        if em_lotes:
+            repositorio.iniciar_escrita(conn)
+        for comando in SQL_MIGRAR_CONTATOS:
+            conn.execute(comando, (inicio, fim))
+        if em_lotes:
+            conn.commit()
+            logger.info("Migração 10: clientes copiados até o id %s de %s", min(fim, maior_id), maior_id)
+            time.sleep(pausa_ms / 1000)
+        inicio = fim
+
+# Os clientes continuam disponíveis para leitura (exportação, consultas avulsas) como uma visão
+SQL_VISAO_CLIENTES = '''
+    CREATE VIEW clientes AS
+    SELECT l.id, c.telefone, c.nome, c.cpf, l.link_id, l.campanha, l.data_criacao
+    FROM links l
+    JOIN contatos c ON c.id = l.contato_id
+'''
+
+# O contato guarda os dados do cadastro mais recente; cada combinação de telefone e nome já
+# usada fica uma vez em contatos_historico, e o link aponta para a versão com que foi criado.
+# Links anteriores à migração 12 não têm versão e mostram os dados atuais do contato
+SQL_VISAO_CLIENTES_VERSOES = [
+    'DROP VIEW clientes',
+    '''
+    CREATE VIEW clientes AS
+    SELECT l.id, COALESCE(h.telefone, c.telefone) AS telefone, COALESCE(h.nome, c.nome) AS nome,
+           c.cpf, l.link_id, l.campanha, l.data_criacao
+    FROM links l
+    JOIN contatos c ON c.id = l.contato_id
+    LEFT JOIN contatos_historico h ON h.id = l.versao_contato_id
+    ''',
+]
+
+# Migrações do esquema do banco: (versão, descrição, comandos SQL)
+# Novas alterações de esquema devem entrar sempre no fim da lista
+MIGRACOES = [
+    (1, 'Tabelas de clientes, cliques e webhooks', [
+        '''
+        CREATE TABLE IF NOT EXISTS clientes (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            telefone TEXT NOT NULL,
+            nome TEXT NOT NULL,
+            cpf TEXT NOT NULL,
+            link_id TEXT UNIQUE NOT NULL,
+            data_criacao TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS cliques (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            link_id TEXT NOT NULL,
+            telefone TEXT,
+            nome TEXT,
+            cpf TEXT,
+            ip_address TEXT,
+            user_agent TEXT,
+            data_clique TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (link_id) REFERENCES clientes (link_id)
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS webhooks (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            evento TEXT NOT NULL,
+            dados TEXT NOT NULL,
+            data_recebimento TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        ''',
+    ]),
+    (2, 'Fila persistente de envios de SMS', [
+        '''
+        CREATE TABLE IF NOT EXISTS fila_envios (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            link_id TEXT NOT NULL,
+            telefone TEXT NOT NULL,
+            mensagem TEXT NOT NULL,
+            status TEXT NOT NULL DEFAULT 'pendente',
+            tentativas INTEGER NOT NULL DEFAULT 0,
+            proxima_tentativa REAL NOT NULL,
+            ultimo_erro TEXT,
+            resposta TEXT,
+            data_criacao TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            data_atualizacao TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        ''',
+        'CREATE INDEX IF NOT EXISTS idx_fila_envios_status ON fila_envios (status, proxima_tentativa)',
+        'CREATE INDEX IF NOT EXISTS idx_fila_envios_link_id ON fila_envios (link_id)',
+    ]),
+    (3, 'Índices para consultas de cliques e webhooks', [
+        # Cobre os últimos cliques do dashboard sem acessar a tabela
+        'CREATE INDEX IF NOT EXISTS idx_cliques_data_clique ON cliques (data_clique, nome, cpf, telefone)',
+        'CREATE INDEX IF NOT EXISTS idx_cliques_link_id ON cliques (link_id, data_clique)',
+        'CREATE INDEX IF NOT EXISTS idx_webhooks_data_recebimento ON webhooks (data_recebimento)',
+        'CREATE INDEX IF NOT EXISTS idx_webhooks_evento ON webhooks (evento, data_recebimento)',
+    ]),
+    (4, 'Chave de deduplicação de webhooks', [
+        'ALTER TABLE webhooks ADD COLUMN chave_dedupe TEXT',
+        'CREATE UNIQUE INDEX IF NOT EXISTS idx_webhooks_chave_dedupe ON webhooks (chave_dedupe)',
+    ]),
+    (5, 'Contadores de registros mantidos por triggers', [
+        '''
+        CREATE TABLE IF NOT EXISTS contadores (
+            nome TEXT PRIMARY KEY,
+            valor INTEGER NOT NULL DEFAULT 0
+        )
+        ''',
+        "INSERT OR REPLACE INTO contadores (nome, valor) SELECT 'clientes', COUNT(*) FROM clientes",
+        "INSERT OR REPLACE INTO contadores (nome, valor) SELECT 'cliques', COUNT(*) FROM cliques",
+        "INSERT OR REPLACE INTO contadores (nome, valor) SELECT 'webhooks', COUNT(*) FROM webhooks",
+    ] + [
+        f'''
+        CREATE TRIGGER IF NOT EXISTS trg_{tabela}_contador_{operacao}
+        AFTER {evento} ON {tabela}
+        BEGIN
+            UPDATE contadores SET valor = valor {sinal} 1 WHERE nome = '{tabela}';
+        END
+        '''
+        for tabela in ('clientes', 'cliques', 'webhooks')
+        for operacao, evento, sinal in (('inclusao', 'INSERT', '+'), ('exclusao', 'DELETE', '-'))
+    ]),
+    (6, 'Índice para paginação de cliques por (data_clique, id)', [
+        'CREATE INDEX IF NOT EXISTS idx_cliques_data_clique_id ON cliques (data_clique, id)',
+    ]),
+    # O histórico anterior é carregado com `python webkolm.py agregados --reconstruir`
+    (7, 'Agregações por minuto, hora e dia', [
+        '''
+        CREATE TABLE IF NOT EXISTS agregados (
+            granularidade TEXT NOT NULL,
+            periodo TEXT NOT NULL,
+            metrica TEXT NOT NULL,
+            valor REAL NOT NULL DEFAULT 0,
+            PRIMARY KEY (granularidade, metrica, periodo)
+        ) WITHOUT ROWID
+        ''',
+        f'''
+        CREATE TRIGGER IF NOT EXISTS trg_clientes_agregados AFTER INSERT ON clientes
+        BEGIN {sql_somar_agregado("'envios'", 'NEW.data_criacao')}
+        END
+        ''',
+        f'''
+        CREATE TRIGGER IF NOT EXISTS trg_cliques_agregados AFTER INSERT ON cliques
+        BEGIN {sql_somar_agregado("'cliques'", 'NEW.data_clique')}
+        {sql_somar_agregado(
+            "'tempo_ate_clique_soma'", 'NEW.data_clique',
+            '(julianday(NEW.data_clique) - julianday(c.data_criacao)) * 86400',
+            'FROM clientes c WHERE c.link_id = NEW.link_id'
+        )}
+        {sql_somar_agregado(
+            "'tempo_ate_clique_qtd'", 'NEW.data_clique', '1',
+            'FROM clientes c WHERE c.link_id = NEW.link_id'
+        )}
+        END
+        ''',
+        f'''
+        CREATE TRIGGER IF NOT EXISTS trg_webhooks_agregados AFTER INSERT ON webhooks
+        BEGIN {sql_somar_agregado("'webhooks'", 'NEW.data_recebimento')}
+        {sql_somar_agregado(SQL_EVENTO_WEBHOOK, 'NEW.data_recebimento')}
+        END
+        ''',
+    ]),
+    (8, 'Colunas indexadas de webhooks e status por link', [
+        'ALTER TABLE webhooks ADD COLUMN telefone TEXT',
+        'ALTER TABLE webhooks ADD COLUMN link_id TEXT',
+        'ALTER TABLE clientes ADD COLUMN campanha TEXT',
+        # Webhooks antigos eram gravados como 'webhook_recebido', com os campos só no payload
+        '''
+        UPDATE webhooks SET
+            evento = COALESCE(json_extract(dados, '$.evento'), 'desconhecido'),
+            telefone = json_extract(dados, '$.telefone'),
+            link_id = json_extract(dados, '$.link_id')
+        WHERE evento = 'webhook_recebido' AND json_valid(dados)
+        ''',
+        'CREATE INDEX IF NOT EXISTS idx_webhooks_link_id ON webhooks (link_id, evento, data_recebimento)',
+        'CREATE INDEX IF NOT EXISTS idx_webhooks_telefone ON webhooks (telefone, data_recebimento)',
+        '''
+        CREATE TABLE IF NOT EXISTS status_links (
+            link_id TEXT PRIMARY KEY,
+            campanha TEXT,
+            data_criacao TIMESTAMP NOT NULL,
+            enviado_em TIMESTAMP,
+            entregue_em TIMESTAMP,
+            clicado_em TIMESTAMP,
+            erro_em TIMESTAMP
+        ) WITHOUT ROWID
+        ''',
+        'CREATE INDEX IF NOT EXISTS idx_status_links_data_criacao ON status_links (data_criacao)',
+        'CREATE INDEX IF NOT EXISTS idx_status_links_campanha ON status_links (campanha, data_criacao)',
+        *SQL_RECALCULAR_STATUS_LINKS,
+        '''
+        CREATE TRIGGER IF NOT EXISTS trg_clientes_status_link AFTER INSERT ON clientes
+        BEGIN
+            INSERT OR IGNORE INTO status_links (link_id, campanha, data_criacao)
+            VALUES (NEW.link_id, NEW.campanha, COALESCE(NEW.data_criacao, CURRENT_TIMESTAMP));
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS trg_fila_envios_status_link
+        AFTER UPDATE OF status ON fila_envios
+        WHEN NEW.status IN ('enviado', 'morto')
+        BEGIN
+            UPDATE status_links SET
+                enviado_em = CASE WHEN NEW.status = 'enviado'
+                    THEN COALESCE(enviado_em, CURRENT_TIMESTAMP) ELSE enviado_em END,
+                erro_em = CASE WHEN NEW.status = 'morto'
+                    THEN COALESCE(erro_em, CURRENT_TIMESTAMP) ELSE erro_em END
+            WHERE link_id = NEW.link_id;
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS trg_cliques_status_link AFTER INSERT ON cliques
+        BEGIN
+            UPDATE status_links SET clicado_em = COALESCE(clicado_em, NEW.data_clique)
+            WHERE link_id = NEW.link_id;
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS trg_webhooks_status_link AFTER INSERT ON webhooks
+        WHEN NEW.link_id IS NOT NULL
+        BEGIN
+            UPDATE status_links SET
+                enviado_em = CASE WHEN NEW.evento = 'sms_enviado'
+                    THEN COALESCE(enviado_em, NEW.data_recebimento) ELSE enviado_em END,
+                entregue_em = CASE WHEN NEW.evento = 'sms_entregue'
+                    THEN COALESCE(entregue_em, NEW.data_recebimento) ELSE entregue_em END,
+                clicado_em = CASE WHEN NEW.evento = 'sms_clicado'
+                    THEN COALESCE(clicado_em, NEW.data_recebimento) ELSE clicado_em END,
+                erro_em = CASE WHEN NEW.evento = 'sms_erro'
+                    THEN COALESCE(erro_em, NEW.data_recebimento) ELSE erro_em END
+            WHERE link_id = NEW.link_id;
+        END
+        ''',
+        # As agregações por evento passam a usar a coluna em vez do payload
+        'DROP TRIGGER IF EXISTS trg_webhooks_agregados',
+        f'''
+        CREATE TRIGGER IF NOT EXISTS trg_webhooks_agregados AFTER INSERT ON webhooks
+        BEGIN {sql_somar_agregado("'webhooks'", 'NEW.data_recebimento')}
+        {sql_somar_agregado("'evento:' || NEW.evento", 'NEW.data_recebimento')}
+        END
+        ''',
+    ]),
+    (9, 'Retenção de cliques e webhooks', [
+        "INSERT OR IGNORE INTO contadores (nome, valor) VALUES ('cliques_arquivados', 0)",
+        "INSERT OR IGNORE INTO contadores (nome, valor) VALUES ('webhooks_arquivados', 0)",
+    ]),
+    # Os dados pessoais ficam uma vez em contatos; clientes vira links (link_id, contato e
+    # campanha) e os cliques passam a referenciar apenas o link. As colunas telefone, nome e
+    # cpf de cliques ficam nulas nos novos registros e são limpas nos antigos, em lotes e
+    # com o servidor no ar, por `python webkolm.py migrar --limpar-cliques`
+    (10, 'Contatos normalizados e links', [
+        '''
+        CREATE TABLE IF NOT EXISTS contatos (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            chave TEXT UNIQUE NOT NULL,
+            telefone TEXT NOT NULL,
+            nome TEXT NOT NULL,
+            cpf TEXT NOT NULL,
+            data_criacao TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS links (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            link_id TEXT UNIQUE NOT NULL,
+            contato_id INTEGER NOT NULL REFERENCES contatos (id),
+            campanha TEXT,
+            data_criacao TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        ''',
+        copiar_clientes,
+        'CREATE INDEX IF NOT EXISTS idx_links_contato_id ON links (contato_id)',
+        # Remove também os triggers de clientes
+        'DROP TABLE clientes',
+        SQL_VISAO_CLIENTES,
+        "DELETE FROM contadores WHERE nome = 'clientes'",
+        "INSERT OR REPLACE INTO contadores (nome, valor) SELECT 'links', COUNT(*) FROM links",
+        "INSERT OR REPLACE INTO contadores (nome, valor) SELECT 'contatos', COUNT(*) FROM contatos",
+    ] + [
+        f'''
+        CREATE TRIGGER IF NOT EXISTS trg_{tabela}_contador_{operacao}
+        AFTER {evento} ON {tabela}
+        BEGIN
+            UPDATE contadores SET valor = valor {sinal} 1 WHERE nome = '{tabela}';
+        END
+        '''
+        for tabela in ('contatos', 'links')
+        for operacao, evento, sinal in (('inclusao', 'INSERT', '+'), ('exclusao', 'DELETE', '-'))
+    ] + [
+        f'''
+        CREATE TRIGGER IF NOT EXISTS trg_links_agregados AFTER INSERT ON links
+        BEGIN {sql_somar_agregado("'envios'", 'NEW.data_criacao')}
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS trg_links_status_link AFTER INSERT ON links
+        BEGIN
+            INSERT OR IGNORE INTO status_links (link_id, campanha, data_criacao)
+            VALUES (NEW.link_id, NEW.campanha, COALESCE(NEW.data_criacao, CURRENT_TIMESTAMP));
+        END
+        ''',
+        'DROP TRIGGER IF EXISTS trg_cliques_agregados',
+        f'''
+        CREATE TRIGGER IF NOT EXISTS trg_cliques_agregados AFTER INSERT ON cliques
+        BEGIN {sql_somar_agregado("'cliques'", 'NEW.data_clique')}
+        {sql_somar_agregado(
+            "'tempo_ate_clique_soma'", 'NEW.data_clique',
+            '(julianday(NEW.data_clique) - julianday(l.data_criacao)) * 86400',
+            'FROM links l WHERE l.link_id = NEW.link_id'
+        )}
+        {sql_somar_agregado(
+            "'tempo_ate_clique_qtd'", 'NEW.data_clique', '1',
+            'FROM links l WHERE l.link_id = NEW.link_id'
+        )}
+        END
+        ''',
+        # O índice dos últimos cliques cobria as colunas pessoais; agora basta o link
+        'DROP INDEX IF EXISTS idx_cliques_data_clique',
+        'CREATE INDEX IF NOT EXISTS idx_cliques_data_clique ON cliques (data_clique, link_id)',
+    ]),
+    (11, 'Contadores da fila de envios por status', [
+        *SQL_CONTAR_FILA_ENVIOS,
+        f'''
+        CREATE TRIGGER IF NOT EXISTS trg_fila_envios_contador_inclusao AFTER INSERT ON fila_envios
+        BEGIN {sql_somar_contador("'fila:' || NEW.status", '1')}
+        END
+        ''',
+        f'''
+        CREATE TRIGGER IF NOT EXISTS trg_fila_envios_contador_status
+        AFTER UPDATE OF status ON fila_envios
+        WHEN OLD.status IS NOT NEW.status
+        BEGIN {sql_somar_contador("'fila:' || OLD.status", '-1')}
+        {sql_somar_contador("'fila:' || NEW.status", '1')}
+        END
+        ''',
+        f'''
+        CREATE TRIGGER IF NOT EXISTS trg_fila_envios_contador_exclusao AFTER DELETE ON fila_envios
+        BEGIN {sql_somar_contador("'fila:' || OLD.status", '-1')}
+        END
+        ''',
+    ]),
+    (12, 'Versões dos contatos', [
+        '''
+        CREATE TABLE IF NOT EXISTS contatos_historico (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            contato_id INTEGER NOT NULL REFERENCES contatos (id),
+            telefone TEXT NOT NULL,
+            nome TEXT NOT NULL,
+            data_criacao TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            UNIQUE (contato_id, telefone, nome)
+        )
+        ''',
+        'ALTER TABLE links ADD COLUMN versao_contato_id INTEGER REFERENCES contatos_historico (id)',
+        *SQL_VISAO_CLIENTES_VERSOES,
+    ]),
+]
+
+def sql_agregar_postgres(selecoes):
+    """
+    Comando dos triggers do PostgreSQL que soma as métricas das linhas incluídas
+    em todas as granularidades; selecoes são consultas (data, metrica, valor)
+    sobre a tabela de transição `novos`
+    """
+    granularidades = ', '.join(f"('{nome}', '{formato}')" for nome, formato in FORMATOS_PERIODO_POSTGRES.items())
+    return f'''
+            INSERT INTO agregados (granularidade, periodo, metrica, valor)
+            SELECT g.granularidade, to_char(m.data::timestamp, g.formato), m.metrica, SUM(m.valor)
+            FROM ({' UNION ALL '.join(selecoes)}) AS m (data, metrica, valor)
+            CROSS JOIN (VALUES {granularidades}) AS g (granularidade, formato)
+            GROUP BY 1, 2, 3
+            ORDER BY 1, 3, 2
+            ON CONFLICT (granularidade, metrica, periodo) DO UPDATE SET valor = agregados.valor + excluded.valor;'''
+
+def sql_trigger_postgres(nome, tabela, evento, corpo, transicao=None):
+    """
+    Função PL/pgSQL e trigger por comando (FOR EACH STATEMENT): com a tabela de
+    transição, um COPY de milhares de linhas atualiza contadores e agregados uma única vez
+    Em UPDATE, `transicao` é o par (antigos, novos)
+    """
+    if isinstance(transicao, tuple):
+        referencia = f'REFERENCING OLD TABLE AS {transicao[0]} NEW TABLE AS {transicao[1]}'
+    else:
+        referencia = f"REFERENCING {'NEW' if evento == 'INSERT' else 'OLD'} TABLE AS {transicao}" if transicao else ''
+    return [
+        f'''
+        CREATE OR REPLACE FUNCTION {nome}() RETURNS trigger LANGUAGE plpgsql AS $$
+        BEGIN
+            {corpo}
+            RETURN NULL;
+        END
+        $$
+        ''',
+        f'''
+        CREATE OR REPLACE TRIGGER {nome} AFTER {evento} ON {tabela}
+        {referencia} FOR EACH STATEMENT EXECUTE FUNCTION {nome}()
+        ''',
+    ]
+
+# Esquema do PostgreSQL, equivalente ao da versão 9 do SQLite (mesmas tabelas, índices e
+# triggers); novas alterações de esquema entram nas duas listas com o mesmo número de versão
+# (a partir da 10, as colunas pessoais de cliques são removidas, não apenas esvaziadas)
+MIGRACOES_POSTGRES = [
+    (9, 'Esquema inicial no PostgreSQL', [
+        '''
+        CREATE OR REPLACE FUNCTION agora_utc() RETURNS TEXT LANGUAGE sql STABLE AS $$
+            SELECT to_char(statement_timestamp() AT TIME ZONE 'UTC', 'YYYY-MM-DD HH24:MI:SS')
+        $$
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS clientes (
+            id BIGINT GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY,
+            telefone TEXT NOT NULL,
+            nome TEXT NOT NULL,
+            cpf TEXT NOT NULL,
+            link_id TEXT UNIQUE NOT NULL,
+            data_criacao TEXT DEFAULT agora_utc(),
+            campanha TEXT
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS cliques (
+            id BIGINT GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY,
+            link_id TEXT NOT NULL,
+            telefone TEXT,
+            nome TEXT,
+            cpf TEXT,
+            ip_address TEXT,
+            user_agent TEXT,
+            data_clique TEXT DEFAULT agora_utc()
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS webhooks (
+            id BIGINT GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY,
+            evento TEXT NOT NULL,
+            dados TEXT NOT NULL,
+            data_recebimento TEXT DEFAULT agora_utc(),
+            chave_dedupe TEXT,
+            telefone TEXT,
+            link_id TEXT
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS fila_envios (
+            id BIGINT GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY,
+            link_id TEXT NOT NULL,
+            telefone TEXT NOT NULL,
+            mensagem TEXT NOT NULL,
+            status TEXT NOT NULL DEFAULT 'pendente',
+            tentativas INTEGER NOT NULL DEFAULT 0,
+            proxima_tentativa DOUBLE PRECISION NOT NULL,
+            ultimo_erro TEXT,
+            resposta TEXT,
+            data_criacao TEXT DEFAULT agora_utc(),
+            data_atualizacao TEXT DEFAULT agora_utc()
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS contadores (
+            nome TEXT PRIMARY KEY,
+            valor BIGINT NOT NULL DEFAULT 0
+        )
+        ''',
+        '''
+        INSERT INTO contadores (nome, valor) VALUES
+            ('clientes', 0), ('cliques', 0), ('webhooks', 0), ('cliques_arquivados', 0), ('webhooks_arquivados', 0)
+        ON CONFLICT DO NOTHING
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS agregados (
+            granularidade TEXT NOT NULL,
+            periodo TEXT NOT NULL,
+            metrica TEXT NOT NULL,
+            valor DOUBLE PRECISION NOT NULL DEFAULT 0,
+            PRIMARY KEY (granularidade, metrica, periodo)
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS status_links (
+            link_id TEXT PRIMARY KEY,
+            campanha TEXT,
+            data_criacao TEXT NOT NULL,
+            enviado_em TEXT,
+            entregue_em TEXT,
+            clicado_em TEXT,
+            erro_em TEXT
+        )
+        ''',
+        'CREATE INDEX IF NOT EXISTS idx_fila_envios_status ON fila_envios (status, proxima_tentativa)',
+        'CREATE INDEX IF NOT EXISTS idx_fila_envios_link_id ON fila_envios (link_id)',
+        'CREATE INDEX IF NOT EXISTS idx_cliques_data_clique ON cliques (data_clique, nome, cpf, telefone)',
+        'CREATE INDEX IF NOT EXISTS idx_cliques_link_id ON cliques (link_id, data_clique)',
+        'CREATE INDEX IF NOT EXISTS idx_cliques_data_clique_id ON cliques (data_clique, id)',
+        'CREATE INDEX IF NOT EXISTS idx_webhooks_data_recebimento ON webhooks (data_recebimento, id)',
+        'CREATE INDEX IF NOT EXISTS idx_webhooks_evento ON webhooks (evento, data_recebimento)',
+        'CREATE UNIQUE INDEX IF NOT EXISTS idx_webhooks_chave_dedupe ON webhooks (chave_dedupe)',
+        'CREATE INDEX IF NOT EXISTS idx_webhooks_link_id ON webhooks (link_id, evento, data_recebimento)',
+        'CREATE INDEX IF NOT EXISTS idx_webhooks_telefone ON webhooks (telefone, data_recebimento)',
+        'CREATE INDEX IF NOT EXISTS idx_status_links_data_criacao ON status_links (data_criacao)',
+        'CREATE INDEX IF NOT EXISTS idx_status_links_campanha ON status_links (campanha, data_criacao)',
+        *sql_trigger_postgres('trg_clientes_inclusao', 'clientes', 'INSERT', f'''
+            UPDATE contadores SET valor = valor + (SELECT COUNT(*) FROM novos) WHERE nome = 'clientes';
+            {sql_agregar_postgres(["SELECT data_criacao, 'envios', 1 FROM novos"])}
+            INSERT INTO status_links (link_id, campanha, data_criacao)
+            SELECT link_id, campanha, COALESCE(data_criacao, agora_utc()) FROM novos
+            ON CONFLICT DO NOTHING;''', 'novos'),
+        *sql_trigger_postgres('trg_cliques_inclusao', 'cliques', 'INSERT', f'''
+            UPDATE contadores SET valor = valor + (SELECT COUNT(*) FROM novos) WHERE nome = 'cliques';
+            {sql_agregar_postgres([
+                "SELECT data_clique, 'cliques', 1 FROM novos",
+                "SELECT n.data_clique, 'tempo_ate_clique_soma', "
+                "EXTRACT(EPOCH FROM n.data_clique::timestamp - c.data_criacao::timestamp) "
+                "FROM novos n JOIN clientes c ON c.link_id = n.link_id",
+                "SELECT n.data_clique, 'tempo_ate_clique_qtd', 1 FROM novos n JOIN clientes c ON c.link_id = n.link_id",
+            ])}
+            UPDATE status_links s SET clicado_em = COALESCE(s.clicado_em, n.primeiro)
+            FROM (SELECT link_id, MIN(data_clique) AS primeiro FROM novos GROUP BY link_id) n
+            WHERE s.link_id = n.link_id;''', 'novos'),
+        *sql_trigger_postgres('trg_webhooks_inclusao', 'webhooks', 'INSERT', f'''
+            UPDATE contadores SET valor = valor + (SELECT COUNT(*) FROM novos) WHERE nome = 'webhooks';
+            {sql_agregar_postgres([
+                "SELECT data_recebimento, 'webhooks', 1 FROM novos",
+                "SELECT data_recebimento, 'evento:' || evento, 1 FROM novos",
+            ])}
+            UPDATE status_links s SET
+                enviado_em = COALESCE(s.enviado_em, n.enviado),
+                entregue_em = COALESCE(s.entregue_em, n.entregue),
+                clicado_em = COALESCE(s.clicado_em, n.clicado),
+                erro_em = COALESCE(s.erro_em, n.erro)
+            FROM (
+                SELECT link_id,
+                       MIN(data_recebimento) FILTER (WHERE evento = 'sms_enviado') AS enviado,
+                       MIN(data_recebimento) FILTER (WHERE evento = 'sms_entregue') AS entregue,
+                       MIN(data_recebimento) FILTER (WHERE evento = 'sms_clicado') AS clicado,
+                       MIN(data_recebimento) FILTER (WHERE evento = 'sms_erro') AS erro
+                FROM novos WHERE link_id IS NOT NULL GROUP BY link_id
+            ) n
+            WHERE s.link_id = n.link_id;''', 'novos'),
+        *[
+            comando
+            for tabela in ('clientes', 'cliques', 'webhooks')
+            for comando in sql_trigger_postgres(f'trg_{tabela}_exclusao', tabela, 'DELETE', f'''
+            UPDATE contadores SET valor = valor - (SELECT COUNT(*) FROM antigos) WHERE nome = '{tabela}';''',
+                'antigos')
+        ],
+        '''
+        CREATE OR REPLACE FUNCTION trg_fila_envios_status_link() RETURNS trigger LANGUAGE plpgsql AS $$
+        BEGIN
+            UPDATE status_links SET
+                enviado_em = CASE WHEN NEW.status = 'enviado'
+                    THEN COALESCE(enviado_em, agora_utc()) ELSE enviado_em END,
+                erro_em = CASE WHEN NEW.status = 'morto'
+                    THEN COALESCE(erro_em, agora_utc()) ELSE erro_em END
+            WHERE link_id = NEW.link_id;
+            RETURN NULL;
+        END
+        $$
+        ''',
+        '''
+        CREATE OR REPLACE TRIGGER trg_fila_envios_status_link
+        AFTER UPDATE OF status ON fila_envios
+        FOR EACH ROW WHEN (NEW.status IN ('enviado', 'morto'))
+        EXECUTE FUNCTION trg_fila_envios_status_link()
+        ''',
+    ]),
+    (10, 'Contatos normalizados e links', [
+        '''
+        CREATE TABLE IF NOT EXISTS contatos (
+            id BIGINT GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY,
+            chave TEXT UNIQUE NOT NULL,
+            telefone TEXT NOT NULL,
+            nome TEXT NOT NULL,
+            cpf TEXT NOT NULL,
+            data_criacao TEXT DEFAULT agora_utc()
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS links (
+            id BIGINT GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY,
+            link_id TEXT UNIQUE NOT NULL,
+            contato_id BIGINT NOT NULL REFERENCES contatos (id),
+            campanha TEXT,
+            data_criacao TEXT DEFAULT agora_utc()
+        )
+        ''',
+        copiar_clientes,
+        # Os ids dos clientes foram mantidos: a sequência continua depois do maior
+        "SELECT setval(pg_get_serial_sequence('links', 'id'), COALESCE(MAX(id), 0) + 1, false) FROM links",
+        'CREATE INDEX IF NOT EXISTS idx_links_contato_id ON links (contato_id)',
+        'DROP TABLE clientes',
+        'DROP FUNCTION IF EXISTS trg_clientes_inclusao()',
+        'DROP FUNCTION IF EXISTS trg_clientes_exclusao()',
+        SQL_VISAO_CLIENTES,
+        "DELETE FROM contadores WHERE nome = 'clientes'",
+        '''
+        INSERT INTO contadores (nome, valor)
+        SELECT 'links', COUNT(*) FROM links UNION ALL SELECT 'contatos', COUNT(*) FROM contatos
+        ON CONFLICT (nome) DO UPDATE SET valor = excluded.valor
+        ''',
+        *sql_trigger_postgres('trg_links_inclusao', 'links', 'INSERT', f'''
+            UPDATE contadores SET valor = valor + (SELECT COUNT(*) FROM novos) WHERE nome = 'links';
+            {sql_agregar_postgres(["SELECT data_criacao, 'envios', 1 FROM novos"])}
+            INSERT INTO status_links (link_id, campanha, data_criacao)
+            SELECT link_id, campanha, COALESCE(data_criacao, agora_utc()) FROM novos
+            ON CONFLICT DO NOTHING;''', 'novos'),
+        *sql_trigger_postgres('trg_contatos_inclusao', 'contatos', 'INSERT', '''
+            UPDATE contadores SET valor = valor + (SELECT COUNT(*) FROM novos) WHERE nome = 'contatos';''',
+            'novos'),
+        *[
+            comando
+            for tabela in ('contatos', 'links')
+            for comando in sql_trigger_postgres(f'trg_{tabela}_exclusao', tabela, 'DELETE', f'''
+            UPDATE contadores SET valor = valor - (SELECT COUNT(*) FROM antigos) WHERE nome = '{tabela}';''',
+                'antigos')
+        ],
+        *sql_trigger_postgres('trg_cliques_inclusao', 'cliques', 'INSERT', f'''
+            UPDATE contadores SET valor = valor + (SELECT COUNT(*) FROM novos) WHERE nome = 'cliques';
+            {sql_agregar_postgres([
+                "SELECT data_clique, 'cliques', 1 FROM novos",
+                "SELECT n.data_clique, 'tempo_ate_clique_soma', "
+                "EXTRACT(EPOCH FROM n.data_clique::timestamp - l.data_criacao::timestamp) "
+                "FROM novos n JOIN links l ON l.link_id = n.link_id",
+                "SELECT n.data_clique, 'tempo_ate_clique_qtd', 1 FROM novos n JOIN links l ON l.link_id = n.link_id",
+            ])}
+            UPDATE status_links s SET clicado_em = COALESCE(s.clicado_em, n.primeiro)
+            FROM (SELECT link_id, MIN(data_clique) AS primeiro FROM novos GROUP BY link_id) n
+            WHERE s.link_id = n.link_id;''', 'novos'),
+        # Sem reescrever a tabela: o espaço das colunas é liberado à medida que as linhas
+        # são atualizadas ou apagadas (o índice com as colunas pessoais cai junto)
+        'ALTER TABLE cliques DROP COLUMN telefone, DROP COLUMN nome, DROP COLUMN cpf',
+        'CREATE INDEX IF NOT EXISTS idx_cliques_data_clique ON cliques (data_clique, link_id)',
+    ]),
+    (11, 'Contadores da fila de envios por status', [
+        *SQL_CONTAR_FILA_ENVIOS,
+        *[
+            comando
+            for evento, transicao in (('INSERT', 'novos'), ('UPDATE', ('antigos', 'novos')), ('DELETE', 'antigos'))
+            for comando in sql_trigger_postgres(
+                f'trg_fila_envios_contador_{evento.lower()}', 'fila_envios', evento, f'''
+            INSERT INTO contadores (nome, valor)
+            SELECT 'fila:' || status, SUM(delta) FROM (
+                {' UNION ALL '.join(
+                    f"SELECT status, {sinal}1 AS delta FROM {tabela}"
+                    for sinal, tabela in (('', 'novos'), ('-', 'antigos'))
+                    if tabela in transicao
+                )}
+            ) d
+            GROUP BY status HAVING SUM(delta) <> 0
+            ORDER BY 1
+            ON CONFLICT (nome) DO UPDATE SET valor = contadores.valor + excluded.valor;''', transicao)
+        ],
+    ]),
+    (12, 'Versões dos contatos', [
+        '''
+        CREATE TABLE IF NOT EXISTS contatos_historico (
+            id BIGINT GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY,
+            contato_id BIGINT NOT NULL REFERENCES contatos (id),
+            telefone TEXT NOT NULL,
+            nome TEXT NOT NULL,
+            data_criacao TEXT DEFAULT agora_utc(),
+            UNIQUE (contato_id, telefone, nome)
+        )
+        ''',
+        'ALTER TABLE links ADD COLUMN versao_contato_id BIGINT REFERENCES contatos_historico (id)',
+        *SQL_VISAO_CLIENTES_VERSOES,
+    ]),
+]
+
+def sql_lote_arquivo(tabela):
+    """Próximo lote de registros anteriores à data limite, na ordem de arquivamento"""
+    coluna = COLUNAS_DATA_ARQUIVO[tabela]
+    return f'''
+        SELECT {', '.join(TABELAS_EXPORTACAO[tabela])} FROM {tabela}
+        WHERE {coluna} < ? ORDER BY {coluna}, id LIMIT ?
+    '''
+
+# Consultas mais frequentes, usadas por `migrar --check` para exibir o plano de execução
+CONSULTAS_QUENTES = {
+    'clique: busca do link': '''
+        SELECT contato_id FROM links WHERE link_id = ?
+    ''',
+    'dashboard: contadores': '''
+        SELECT nome, valor FROM contadores
+    ''',
+    'dashboard: últimos cliques': '''
+        SELECT COALESCE(h.nome, c.nome) AS nome, c.cpf, COALESCE(h.telefone, c.telefone) AS telefone, cl.data_clique
+        FROM (SELECT link_id, data_clique FROM cliques ORDER BY data_clique DESC LIMIT 10) cl
+        LEFT JOIN links l ON l.link_id = cl.link_id
+        LEFT JOIN contatos c ON c.id = l.contato_id
+        LEFT JOIN contatos_historico h ON h.id = l.versao_contato_id
+        ORDER BY cl.data_clique DESC
+    ''',
+    'cliques: página': '''
+        SELECT cl.id, cl.link_id, COALESCE(h.nome, c.nome) AS nome, c.cpf, COALESCE(h.telefone, c.telefone) AS telefone, cl.data_clique, cl.ip_address, cl.user_agent
+        FROM cliques cl
+        JOIN links l ON l.link_id = cl.link_id
+        JOIN contatos c ON c.id = l.contato_id
+        LEFT JOIN contatos_historico h ON h.id = l.versao_contato_id
+        WHERE cl.data_clique <= ? AND (cl.data_clique < ? OR cl.id < ?)
+        ORDER BY cl.data_clique DESC, cl.id DESC
+        LIMIT ?
+    ''',
+    'cliques: página por link': '''
+        SELECT cl.id, cl.link_id, COALESCE(h.nome, c.nome) AS nome, c.cpf, COALESCE(h.telefone, c.telefone) AS telefone, cl.data_clique, cl.ip_address, cl.user_agent
+        FROM cliques cl
+        JOIN links l ON l.link_id = cl.link_id
+        JOIN contatos c ON c.id = l.contato_id
+        LEFT JOIN contatos_historico h ON h.id = l.versao_contato_id
+        WHERE cl.link_id = ? AND cl.data_clique <= ? AND (cl.data_clique < ? OR cl.id < ?)
+        ORDER BY cl.data_clique DESC, cl.id DESC
+        LIMIT ?
+    ''',
+    'estatísticas: série': '''
+        SELECT metrica, periodo, valor FROM agregados
+        WHERE granularidade = ? AND metrica IN (?, ?) AND periodo >= ? AND periodo < ?
+        ORDER BY metrica, periodo
+    ''',
+    'funil: por dia': '''
+        SELECT substr(data_criacao, 1, 10), COUNT(*), COUNT(COALESCE(enviado_em, entregue_em, clicado_em)),
+               COUNT(COALESCE(entregue_em, clicado_em)), COUNT(clicado_em), COUNT(erro_em)
+        FROM status_links
+        WHERE data_criacao >= ? AND data_criacao < ?
+        GROUP BY 1
+    ''',
+    'funil: por campanha': '''
+        SELECT campanha, COUNT(*), COUNT(COALESCE(enviado_em, entregue_em, clicado_em)),
+               COUNT(COALESCE(entregue_em, clicado_em)), COUNT(clicado_em), COUNT(erro_em)
+        FROM status_links
+        WHERE campanha = ? AND data_criacao >= ? AND data_criacao < ?
+        GROUP BY 1
+    ''',
+    'webhooks: por link': '''
+        SELECT evento, data_recebimento FROM webhooks WHERE link_id = ? ORDER BY evento, data_recebimento
+    ''',
+    'fila: próximo envio': '''
+        SELECT id, link_id, telefone, mensagem, tentativas FROM fila_envios
+        WHERE status IN ('pendente', 'enviando') AND proxima_tentativa <= ?
+        ORDER BY proxima_tentativa LIMIT 1
+    ''',
+    'envios: status por link': '''
+        SELECT status FROM fila_envios WHERE link_id = ? ORDER BY id DESC LIMIT 1
+    ''',
+    'retenção: lote de cliques': sql_lote_arquivo('cliques'),
+    'retenção: lote de webhooks': sql_lote_arquivo('webhooks'),
+}
+
+def versao_esquema(conn):
+    """Retorna a versão atual do esquema (0 para um banco sem migrações)"""
+    if not repositorio.existe_tabela(conn, 'schema_migracoes'):
+        return 0
+    return conn.execute('SELECT COALESCE(MAX(versao), 0) FROM schema_migracoes').fetchone()[0]
+
+def aplicar_migracoes(conn):
+    """
+    Aplica, em ordem, as migrações ainda não registradas no banco
+    O bloqueio do repositório garante que apenas um processo migra por vez
+    Retorna: lista das versões aplicadas
+    """
+    repositorio.travar_migracoes(conn)
+    try:
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS schema_migracoes (
+                versao INTEGER PRIMARY KEY,
+                descricao TEXT NOT NULL,
+                data_aplicacao TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+        atual = versao_esquema(conn)
+        aplicadas = []
+        for versao, descricao, comandos in repositorio.migracoes():
+            if versao <= atual:
+                continue
+            for comando in comandos:
+                if not callable(comando):
+                    conn.execute(comando)
+                    continue
+                # Passo de cópia de dados: roda em lotes, cada um com a própria transação,
+                # sem bloquear as gravações; depois, com o bloqueio de volta, copia o que foi
+                # gravado nesse meio-tempo e segue com o restante da migração
+                conn.commit()
+                comando(conn)
+                repositorio.travar_migracoes(conn)
+                if versao_esquema(conn) >= versao:
+                    break
+                comando(conn, em_lotes=False)
+            else:
+                conn.execute(
+                    'INSERT INTO schema_migracoes (versao, descricao) VALUES (?, ?)',
+                    (versao, descricao)
+                )
+                aplicadas.append(versao)
+                logger.info("Migração %s aplicada: %s", versao, descricao)
+                continue
+            # Outro processo aplicou a migração durante a cópia: segue da versão atual
+            atual = versao_esquema(conn)
+            logger.info("Migração %s aplicada por outro processo", versao)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    if aplicadas:
+        repositorio.otimizar(conn)
+        conn.commit()
+    return aplicadas
+
+def verificar_banco():
+    """Exibe a versão do esquema e o plano de execução das consultas mais frequentes"""
+    with conexao_db() as conn:
+        atual = versao_esquema(conn)
+        migracoes = repositorio.migracoes()
+        pendentes = [versao for versao, _, _ in migracoes if versao > atual]
+        print(f"Banco: {repositorio.descricao()}")
+        print(f"Versão do esquema: {atual} (mais recente: {migracoes[-1][0]})")
+        if pendentes:
+            print(f"Migrações pendentes: {', '.join(map(str, pendentes))}")
+
+        for nome, consulta in CONSULTAS_QUENTES.items():
+            print(f"\n== {nome}")
+            parametros = (None,) * consulta.count('?')
+            try:
+                for linha in repositorio.plano(conn, consulta, parametros):
+                    print(f"  {linha}")
+            except Exception as e:
+                print(f"  indisponível: {e}")
+
+# Inicialização do banco de dados
+def init_database():
+    """Inicializa o banco de dados SQLite aplicando as migrações pendentes"""
+    with conexao_db() as conn:
+        aplicar_migracoes(conn)
+    logger.info("Banco de dados inicializado com sucesso")
+
+class CacheLRU:
+    """
+    Cache LRU limitado e seguro entre threads, com expiração por TTL
+    Mantém contadores de acertos e falhas para as métricas
+    """
+
+    def __init__(self, capacidade, ttl=None):
+        self.capacidade = capacidade
+        self.ttl = ttl
+        self.acertos = 0
+        self.falhas = 0
+        self._dados = OrderedDict()
+        self._lock = threading.Lock()
+
+    def obter(self, chave):
+        """Retorna o valor em cache ou None"""
+        with self._lock:
+            item = self._dados.get(chave)
+            if item is not None:
+                valor, expira_em = item
+                if expira_em is None or expira_em > time.monotonic():
+                    self._dados.move_to_end(chave)
+                    self.acertos += 1
+                    return valor
+                del self._dados[chave]
+            self.falhas += 1
+            return None
+
+    def definir(self, chave, valor):
+        self.definir_varios([(chave, valor)])
+
+    def definir_varios(self, itens):
+        """Insere vários itens com uma única aquisição do lock"""
+        expira_em = time.monotonic() + self.ttl if self.ttl else None
+        with self._lock:
+            for chave, valor in itens:
+                self._dados[chave] = (valor, expira_em)
+                self._dados.move_to_end(chave)
+            while len(self._dados) > self.capacidade:
+                self._dados.popitem(last=False)
+
+    def remover(self, chave):
+        with self._lock:
+            self._dados.pop(chave, None)
+
+    def limpar(self):
+        with self._lock:
+            self._dados.clear()
+
+    def estatisticas(self):
+        with self._lock:
+            consultas = self.acertos + self.falhas
+            return {
+                'itens': len(self._dados),
+                'capacidade': self.capacidade,
+                'acertos': self.acertos,
+                'falhas': self.falhas,
+                'taxa_acerto': round(self.acertos / consultas, 4) if consultas else None
+            }
+
+
+# Contato de cada link_id já confirmado, usado no redirecionamento de /clique
+cache_links = CacheLRU(CACHE_LINKS_TAMANHO, CACHE_LINKS_TTL)
+
+class GravadorLote:
+    """
+    Buffer em memória com gravação em segundo plano (write-behind)
+    Os itens são gravados em lote quando o buffer atinge `tamanho_lote`
+    itens ou `intervalo` segundos após o primeiro item, o que ocorrer antes
+
+    Com o buffer cheio, a política 'bloquear' aguarda até `timeout_bloqueio`
+    e então grava o item na própria thread; 'descartar' descarta o item
+    """
+
+    def __init__(self, nome, gravar, tamanho_lote=500, intervalo=0.2,
+                 capacidade=50000, politica='bloquear', timeout_bloqueio=1.0):
+        self.nome = nome
+        self.gravar = gravar
+        self.tamanho_lote = tamanho_lote
+        self.intervalo = intervalo
+        self.politica = politica
+        self.timeout_bloqueio = timeout_bloqueio
+        self.gravados = 0
+        self.lotes = 0
+        self.descartados = 0
+        self.sincronos = 0
+        self.erros = 0
+        self._fila = queue.Queue(maxsize=capacidade)
+        self._parar = threading.Event()
+        self._thread = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def iniciar(self):
+        """Inicia a thread de gravação (idempotente, reinicia após um fork)"""
+        with self._lock:
+            if self._thread and self._thread.is_alive() and self._pid == os.getpid():
+                return
+            self._parar.clear()
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._executar, name=f'gravador-{self.nome}', daemon=True)
+            self._thread.start()
+
+    def adicionar(self, item):
+        """
+        Adiciona um item ao buffer
+        Retorna False se o item foi descartado (buffer cheio com a política
+        'descartar' ou falha na gravação síncrona)
+        """
+        if self._thread is None or self._pid != os.getpid():
+            self.iniciar()
+        try:
+            self._fila.put_nowait(item)
+            return True
+        except queue.Full:
+            pass
+
+        if self.politica == 'descartar':
+            self.descartados += 1
+            return False
+
+        try:
+            self._fila.put(item, timeout=self.timeout_bloqueio)
+        except queue.Full:
+            # Buffer continua cheio: grava na thread da requisição
+            self.sincronos += 1
+            return self._gravar_lote([item])
+        return True
+
+    def _proximo_lote(self):
+        """Aguarda o primeiro item e junta os seguintes até o tamanho ou prazo do lote"""
+        try:
+            lote = [self._fila.get(timeout=self.intervalo)]
+        except queue.Empty:
+            return []
+        prazo = time.monotonic() + self.intervalo
+        while len(lote) < self.tamanho_lote:
+            restante = prazo - time.monotonic()
+            try:
+                if restante <= 0:
+                    lote.append(self._fila.get_nowait())
+                else:
+                    lote.append(self._fila.get(timeout=restante))
+            except queue.Empty:
+                break
+        return lote
+
+    def _gravar_lote(self, lote, tentativas=3):
+        for tentativa in range(1, tentativas + 1):
+            try:
+                self.gravar(lote)
+                self.gravados += len(lote)
+                self.lotes += 1
+                return True
+            except Exception as e:
+                self.erros += 1
+                logger.error("Erro ao gravar lote de %s (tentativa %s): %s", self.nome, tentativa, e)
+                time.sleep(0.1 * tentativa)
+        self.descartados += len(lote)
+        return False
+
+    def _executar(self):
+        while not self._parar.is_set() or not self._fila.empty():
+            lote = self._proximo_lote()
+            if lote:
+                self._gravar_lote(lote)
+
+    def parar(self, timeout=10):
+        """Grava o que estiver no buffer e encerra a thread"""
+        self._parar.set()
+        if self._thread and self._pid == os.getpid():
+            self._thread.join(timeout)
+
+    def estatisticas(self):
+        return {
+            'pendentes': self._fila.qsize(),
+            'capacidade': self._fila.maxsize,
+            'politica': self.politica,
+            'gravados': self.gravados,
+            'lotes': self.lotes,
+            'gravacoes_sincronas': self.sincronos,
+            'descartados': self.descartados,
+            'erros': self.erros
+        }
+
+
+def gravar_cliques(cliques):
+    """Grava um lote de cliques em uma única transação"""
+    with conexao_db() as conn:
+        repositorio.inserir(conn, 'cliques', ('link_id', 'ip_address', 'user_agent', 'data_clique'), cliques)
+        conn.commit()
+    seguidor_eventos.notificar()
+
+gravador_cliques = GravadorLote(
+    'cliques',
+    gravar_cliques,
+    tamanho_lote=CLIQUES_LOTE_TAMANHO,
+    intervalo=CLIQUES_LOTE_INTERVALO_MS / 1000,
+    capacidade=CLIQUES_BUFFER_CAPACIDADE,
+    politica=CLIQUES_BUFFER_POLITICA
+)
+atexit.register(gravador_cliques.parar)
+
+def chave_dedupe_webhook(data, dados_json):
+    """
+    Chave que identifica uma entrega de webhook para descartar reenvios
+    Usa o ID do evento informado pelo Kolmeya ou, na falta dele, o hash do payload
+    """
+    for campo in WEBHOOK_CAMPOS_ID:
+        valor = data.get(campo)
+        if valor not in (None, ''):
+            return f"{data.get('evento', '')}:{valor}"
+    return 'hash:' + hashlib.blake2b(dados_json.encode('utf-8'), digest_size=16).hexdigest()
+
+def campos_webhook(data):
+    """
+    Campos do payload gravados em colunas indexadas
+    Retorna: (evento, telefone, link_id)
+    """
+    def texto(campo):
+        valor = data.get(campo)
+        return None if valor in (None, '') else str(valor)
+
+    return texto('evento') or 'desconhecido', texto('telefone'), texto('link_id')
+
+def gravar_webhooks(webhooks):
+    """
+    Grava um lote de webhooks, ignorando chaves já gravadas
+    As chaves só entram no cache de reenvios depois da gravação: se o lote
+    se perder, um reenvio do Kolmeya ainda é aceito
+    """
+    with conexao_db() as conn:
+        repositorio.inserir_ignorando_duplicados(
+            conn, 'webhooks',
+            ('evento', 'telefone', 'link_id', 'dados', 'chave_dedupe', 'data_recebimento'),
+            webhooks
+        )
+        conn.commit()
+    webhooks_recentes.definir_varios((webhook[4], True) for webhook in webhooks)
+    seguidor_eventos.notificar()
+
+gravador_webhooks = GravadorLote(
+    'webhooks',
+    gravar_webhooks,
+    tamanho_lote=WEBHOOKS_LOTE_TAMANHO,
+    intervalo=WEBHOOKS_LOTE_INTERVALO_MS / 1000,
+    capacidade=WEBHOOKS_BUFFER_CAPACIDADE,
+    politica=WEBHOOKS_BUFFER_POLITICA
+)
+atexit.register(gravador_webhooks.parar)
+
+# Chaves dos webhooks recebidos recentemente; o índice único cobre o restante
+webhooks_recentes = CacheLRU(WEBHOOK_DEDUPE_CACHE, WEBHOOK_DEDUPE_TTL)
+
+def agora_utc():
+    """Data/hora atual em UTC no mesmo formato do CURRENT_TIMESTAMP do SQLite"""
+    return time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime())
+
+class FiltroBloom:
+    """
+    Conjunto probabilístico compacto: `in` pode dar falso positivo
+    (na taxa configurada), mas nunca falso negativo
+    """
+
+    def __init__(self, capacidade, taxa_falso_positivo=0.001):
+        self.capacidade = capacidade
+        self.taxa_falso_positivo = taxa_falso_positivo
+        self.num_bits = max(8, int(-capacidade * math.log(taxa_falso_positivo) / (math.log(2) ** 2)))
+        self.num_hashes = max(1, round(self.num_bits / capacidade * math.log(2)))
+        self.itens = 0
+        self._bits = bytearray((self.num_bits + 7) // 8)
+        self._lock = threading.Lock()
+
+    def _posicoes(self, chave):
+        # Double hashing (Kirsch-Mitzenmacher) a partir de um único blake2b
+        digest = hashlib.blake2b(chave.encode('utf-8'), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+        return [(h1 + i * h2) % self.num_bits for i in range(self.num_hashes)]
+
+    def adicionar_varios(self, chaves):
+        posicoes = [self._posicoes(chave) for chave in chaves]
+        with self._lock:
+            for lista in posicoes:
+                for posicao in lista:
+                    self._bits[posicao >> 3] |= 1 << (posicao & 7)
+            self.itens += len(posicoes)
+
+    def __contains__(self, chave):
+        bits = self._bits
+        return all(bits[posicao >> 3] & (1 << (posicao & 7)) for posicao in self._posicoes(chave))
+
+    def taxa_estimada(self):
+        """Taxa de falso positivo estimada para o número atual de itens"""
+        return (1 - math.exp(-self.num_hashes * self.itens / self.num_bits)) ** self.num_hashes
+
+
+class IndiceLinks:
+    """
+    Filtro de Bloom de todos os link_ids da tabela links
+    É construído na inicialização, atualizado nas inserções deste processo e
+    sincronizado incrementalmente (id > último id lido) para enxergar links
+    criados por outros processos. Um link ausente do filtro é confirmado no banco
+    antes de ser recusado. Enquanto não estiver pronto, não rejeita nada
+    """
+
+    def __init__(self, capacidade, taxa_falso_positivo, intervalo_sincronizacao):
+        self.capacidade = capacidade
+        self.taxa_falso_positivo = taxa_falso_positivo
+        self.intervalo_sincronizacao = intervalo_sincronizacao
+        self.filtro = None
+        self.rejeitados = 0
+        self.confirmados_no_banco = 0
+        self.sincronizacoes = 0
+        self._ultimo_id = 0
+        self._ultima_sincronizacao = 0
+        self._lock = threading.Lock()
+
+    def construir(self):
+        """
+        (Re)constrói o filtro a partir da tabela links, com capacidade para pelo
+        menos o dobro dos links existentes (folga até a próxima reconstrução)
+        """
+        with self._lock:
+            with conexao_db() as conn:
+                total = conn.execute("SELECT valor FROM contadores WHERE nome = 'links'").fetchone()
+            capacidade = self.capacidade
+            while total and total[0] > capacidade / 2:
+                capacidade *= 2
+            self.capacidade = capacidade
+            self._ultimo_id = 0
+            filtro = FiltroBloom(capacidade, self.taxa_falso_positivo)
+            self._carregar_novos(filtro)
+            self.filtro = filtro
+        logger.info("Filtro de links construído com %s links (%s KB)", filtro.itens, len(filtro._bits) // 1024)
+
+    def _carregar_novos(self, filtro, tamanho_pagina=50000):
+        # Os ids já lidos da sobreposição só entram no filtro se ainda não estiverem nele
+        lidos_ate = self._ultimo_id
+        posicao = max(0, lidos_ate - FILTRO_LINKS_SOBREPOSICAO)
+        while True:
+            with conexao_db() as conn:
+                pagina = conn.execute(
+                    'SELECT id, link_id FROM links WHERE id > ? ORDER BY id LIMIT ?',
+                    (posicao, tamanho_pagina)
+                ).fetchall()
+            if pagina:
+                filtro.adicionar_varios([
+                    link_id for id_link, link_id in pagina
+                    if id_link > lidos_ate or link_id not in filtro
+                ])
+                posicao = pagina[-1][0]
+                self._ultimo_id = max(self._ultimo_id, posicao)
+            if len(pagina) < tamanho_pagina:
+                break
+        self._ultima_sincronizacao = time.monotonic()
+        self.sincronizacoes += 1
+
+    def adicionar(self, link_ids):
+        """Registra links recém-criados por este processo"""
+        filtro = self.filtro
+        if filtro is not None:
+            filtro.adicionar_varios(link_ids)
+            if filtro.itens > filtro.capacidade:
+                threading.Thread(target=self.construir, name='filtro-links', daemon=True).start()
+
+    def pode_existir(self, link_id):
+        """False somente se o link_id certamente não existe"""
+        filtro = self.filtro
+        if filtro is None or link_id in filtro:
+            return True
+        # Pode ser um link criado por outro processo: sincroniza no máximo
+        # uma vez por intervalo, para que IDs inválidos não gerem consultas
+        if time.monotonic() - self._ultima_sincronizacao >= self.intervalo_sincronizacao:
+            with self._lock:
+                if time.monotonic() - self._ultima_sincronizacao >= self.intervalo_sincronizacao:
+                    self._carregar_novos(self.filtro)
+            if link_id in self.filtro:
+                return True
+        # Entre duas sincronizações, o link pode ter sido criado em outro processo
+        with conexao_db() as conn:
+            existe = conn.execute('SELECT 1 FROM links WHERE link_id = ?', (link_id,)).fetchone()
+        if existe:
+            self.confirmados_no_banco += 1
+            self.filtro.adicionar_varios([link_id])
+            return True
+        self.rejeitados += 1
+        return False
+
+    def estatisticas(self):
+        filtro = self.filtro
+        if filtro is None:
+            return {'pronto': False}
+        return {
+            'pronto': True,
+            'itens': filtro.itens,
+            'capacidade': filtro.capacidade,
+            'bytes': len(filtro._bits),
+            'hashes': filtro.num_hashes,
+            'taxa_falso_positivo_estimada': round(filtro.taxa_estimada(), 6),
+            'rejeitados': self.rejeitados,
+            'confirmados_no_banco': self.confirmados_no_banco,
+            'sincronizacoes': self.sincronizacoes
+        }
+
+
+indice_links = IndiceLinks(FILTRO_LINKS_CAPACIDADE, FILTRO_LINKS_TAXA_FP, FILTRO_LINKS_SINCRONIZACAO)
+
+# Métrica dos agregados que soma os acessos de robôs (não vem de nenhuma tabela de origem)
+METRICA_CLIQUES_BOT = 'cliques_bot'
+
+PADRAO_BOT_UA = re.compile('|'.join(BOT_PADROES_UA), re.IGNORECASE)
+
+@functools.lru_cache(maxsize=BOT_CACHE_UA)
+def classificar_user_agent(user_agent):
+    """
+    Motivo pelo qual o User-Agent indica um robô ('sem_user_agent' ou 'user_agent') ou None
+    Memorizado por User-Agent: poucos valores distintos respondem pela maior parte dos acessos
+    """
+    if not user_agent.strip():
+        return 'sem_user_agent'
+    return 'user_agent' if PADRAO_BOT_UA.search(user_agent) else None
+
+class RedesIP:
+    """
+    Conjunto de faixas de IP consultado por busca binária
+    As faixas são unidas na criação, então basta olhar o intervalo anterior ao endereço
+    """
+
+    def __init__(self, faixas):
+        redes = [ipaddress.ip_network(faixa.strip(), strict=False) for faixa in faixas.split(',') if faixa.strip()]
+        self._inicios = {}
+        self._fins = {}
+        for versao in (4, 6):
+            unidas = list(ipaddress.collapse_addresses(rede for rede in redes if rede.version == versao))
+            self._inicios[versao] = [int(rede.network_address) for rede in unidas]
+            self._fins[versao] = [int(rede.broadcast_address) for rede in unidas]
+        self.total = len(redes)
+
+    def contem(self, ip):
+        try:
+            endereco = ipaddress.ip_address(ip)
+        except ValueError:
+            return False
+        numero = int(endereco)
+        posicao = bisect.bisect_right(self._inicios[endereco.version], numero) - 1
+        return posicao >= 0 and numero <= self._fins[endereco.version][posicao]
+
+class DetectorRajadas:
+    """
+    Conta os acessos por link_id em janelas fixas de `janela` segundos
+    Acessos além de `limite` na mesma janela indicam vários scanners abrindo o link ao
+    mesmo tempo. As janelas ficam em memória (por processo), limitadas a `capacidade` links
+    """
+
+    def __init__(self, janela, limite, capacidade=100000):
+        self.janela = janela
+        self.limite = limite
+        self.capacidade = capacidade
+        self._janelas = OrderedDict()
+        self._lock = threading.Lock()
+
+    def registrar(self, link_id):
+        """Conta um acesso e retorna True se ele excede o limite da janela"""
+        agora = time.monotonic()
+        with self._lock:
+            inicio, acessos = self._janelas.get(link_id, (0, 0))
+            if agora - inicio >= self.janela:
+                inicio, acessos = agora, 0
+            acessos += 1
+            self._janelas[link_id] = (inicio, acessos)
+            self._janelas.move_to_end(link_id)
+            while len(self._janelas) > self.capacidade:
+                self._janelas.popitem(last=False)
+        return acessos > self.limite
+
+    def estatisticas(self):
+        with self._lock:
+            return {'links': len(self._janelas), 'janela': self.janela, 'limite': self.limite}
+
+
+redes_bot = RedesIP(BOT_REDES_IP)
+detector_rajadas = DetectorRajadas(BOT_RAJADA_JANELA, BOT_RAJADA_LIMITE)
+
+def classificar_acesso(link_id, metodo, user_agent, ip, idioma=''):
+    """
+    Classifica um acesso a /clique sem consultar o banco
+    Retorna o motivo ('head', 'sem_user_agent', 'user_agent', 'ip' ou 'rajada')
+    quando o acesso vem de um robô, ou None
+    A rajada sozinha não basta: todos os acessos são contados, mas só os sem
+    Accept-Language (`idioma`) além do limite são tratados como robôs
+    """
+    if metodo == 'HEAD':
+        return 'head'
+    motivo = classificar_user_agent(user_agent)
+    if motivo:
+        return motivo
+    if redes_bot.contem(ip):
+        return 'ip'
+    if detector_rajadas.limite and detector_rajadas.registrar(link_id) and not idioma:
+        return 'rajada'
+    return None
+
+def gravar_cliques_bot(datas):
+    """
+    Soma um lote de acessos de robôs à métrica 'cliques_bot' dos agregados
+    (uma linha por granularidade e período, em vez de uma linha por acesso em cliques)
+    """
+    totais = Counter()
+    for data in datas:
+        momento = datetime.strptime(data, '%Y-%m-%d %H:%M:%S')
+        for granularidade, formato in GRANULARIDADES.items():
+            totais[(granularidade, momento.strftime(formato))] += 1
+    with conexao_db() as conn:
+        conn.executemany('''
+            INSERT INTO agregados (granularidade, periodo, metrica, valor) VALUES (?, ?, ?, ?)
+            ON CONFLICT (granularidade, metrica, periodo) DO UPDATE SET valor = agregados.valor + excluded.valor
+        ''', [
+            (granularidade, periodo, METRICA_CLIQUES_BOT, total)
+            for (granularidade, periodo), total in sorted(totais.items())
+        ])
+        conn.commit()
 
-# Inicialização do banco de dados
-def init_database():
-    """Inicializa o banco de dados SQLite"""
-    conn = sqlite3.connect('kolmeya_webhook.db')
-    cursor = conn.cursor()
-    
-    # Tabela para armazenar dados dos clientes
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS clientes (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            telefone TEXT NOT NULL,
-            nome TEXT NOT NULL,
-            cpf TEXT NOT NULL,
-            link_id TEXT UNIQUE NOT NULL,
-            data_criacao TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        )
-    ''')
-    
-    # Tabela para armazenar cliques
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS cliques (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            link_id TEXT NOT NULL,
-            telefone TEXT,
-            nome TEXT,
-            cpf TEXT,
-            ip_address TEXT,
-            user_agent TEXT,
-            data_clique TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            FOREIGN KEY (link_id) REFERENCES clientes (link_id)
-        )
-    ''')
-    
-    # Tabela para armazenar webhooks recebidos
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS webhooks (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            evento TEXT NOT NULL,
-            dados TEXT NOT NULL,
-            data_recebimento TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        )
-    ''')
-    
-    conn.commit()
-    conn.close()
-    logger.info("Banco de dados inicializado com sucesso")
+gravador_bots = GravadorLote(
+    'bots',
+    gravar_cliques_bot,
+    tamanho_lote=CLIQUES_LOTE_TAMANHO,
+    intervalo=1.0,
+    capacidade=CLIQUES_BUFFER_CAPACIDADE,
+    politica='descartar'
+)
+atexit.register(gravador_bots.parar)
+
+def gerar_link_id():
+    """
+    Gera um identificador curto (base62) para o link rastreável
+    Colisões com links existentes são tratadas na inserção (ver inserir_clientes_lote)
+    """
+    numero = secrets.randbelow(62 ** LINK_ID_TAMANHO)
+    digitos = []
+    for _ in range(LINK_ID_TAMANHO):
+        numero, resto = divmod(numero, 62)
+        digitos.append(ALFABETO_BASE62[resto])
+    return ''.join(digitos)
 
 def gerar_link_rastreavel(link_id):
     """Gera um link rastreável único"""
+    if LINK_FORMATO == 'caminho':
+        return f"{WEBHOOK_BASE_URL}/c/{link_id}"
     return f"{WEBHOOK_BASE_URL}/clique?id={link_id}"
 
-def enviar_sms_kolmeya(telefone, mensagem):
+def montar_mensagem_com_link(mensagem, link_rastreavel):
+    """Adiciona o link rastreável ao final da mensagem"""
+    return f"{mensagem}\n\nAcesse: {link_rastreavel}"
+
+def validar_contato(dados):
     """
-    Envia SMS via API do Kolmeya
-    Retorna: (sucesso, resposta)
+    Valida um registro de contato (a mesma regra em /enviar-sms e no lote)
+    Retorna: mensagem de erro ou None se o registro for válido
     """
-    try:
+    if not isinstance(dados, dict):
+        return 'Registro deve ser um objeto com telefone, nome, cpf e mensagem'
+    for campo in CAMPOS_OBRIGATORIOS:
+        if campo not in dados:
+            return f'Campo obrigatório não encontrado: {campo}'
+        valor = dados[campo]
+        if campo not in CAMPOS_OPCIONAIS_VAZIOS and (valor is None or str(valor).strip() == ''):
+            return f'Campo obrigatório não encontrado: {campo}'
+    return None
+
+def iterar_json_array(texto, tamanho_bloco=65536):
+    """
+    Lê um array JSON de forma incremental, elemento por elemento,
+    sem carregar o corpo inteiro em memória
+    """
+    decoder = json.JSONDecoder()
+    buffer = ''
+    fim = False
+    inicio_array = False
+
+    while True:
+        buffer = buffer.lstrip()
+        if not inicio_array:
+            if not buffer and not fim:
+                bloco = texto.read(tamanho_bloco)
+                fim = not bloco
+                buffer += bloco
+                continue
+            if not buffer.startswith('['):
+                raise ValueError('Corpo JSON deve ser uma lista de contatos')
+            buffer = buffer[1:]
+            inicio_array = True
+            continue
+
+        if buffer.startswith(','):
+            buffer = buffer[1:]
+            continue
+        if buffer.startswith(']'):
+            return
+
+        try:
+            elemento, posicao = decoder.raw_decode(buffer)
+            # Um elemento no fim do buffer pode estar incompleto
+            if posicao < len(buffer) or fim:
+                yield elemento
+                buffer = buffer[posicao:]
+                continue
+        except json.JSONDecodeError:
+            if fim:
+                raise ValueError('JSON inválido ou truncado')
+
+        bloco = texto.read(tamanho_bloco)
+        if not bloco:
+            if fim:
+                raise ValueError('JSON inválido ou truncado')
+            fim = True
+        buffer += bloco
+
+def iterar_registros_lote(texto, formato):
+    """
+    Itera (numero_linha, registro) a partir de um fluxo de texto
+    Formatos suportados: json (lista), ndjson e csv
+    """
+    if formato == 'csv':
+        leitor = csv.DictReader(texto)
+        for numero, linha in enumerate(leitor, start=1):
+            yield numero, linha
+    elif formato == 'ndjson':
+        for numero, linha in enumerate(texto, start=1):
+            linha = linha.strip()
+            if not linha:
+                continue
+            try:
+                yield numero, json.loads(linha)
+            except json.JSONDecodeError as e:
+                yield numero, ValueError(f'JSON inválido: {e.msg}')
+    else:
+        for numero, registro in enumerate(iterar_json_array(texto), start=1):
+            yield numero, registro
+
+class FluxoBinario(io.RawIOBase):
+    """
+    Adapta um fluxo que só implementa read() (como o corpo da requisição
+    no gunicorn) à interface de io, para leitura com TextIOWrapper
+    """
+
+    def __init__(self, fluxo):
+        self.fluxo = fluxo
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        dados = self.fluxo.read(len(buffer))
+        buffer[:len(dados)] = dados
+        return len(dados)
+
+def abrir_texto(fluxo):
+    """Leitor de texto UTF-8 (com ou sem BOM) sobre um fluxo binário"""
+    return io.TextIOWrapper(io.BufferedReader(FluxoBinario(fluxo)), encoding='utf-8-sig', newline='')
+
+def detectar_formato_lote(nome_arquivo, mimetype):
+    """Detecta o formato do lote pelo parâmetro, extensão ou Content-Type"""
+    formato = request.args.get('formato')
+    if formato:
+        return formato.lower()
+    nome_arquivo = (nome_arquivo or '').lower()
+    if nome_arquivo.endswith('.csv') or mimetype == 'text/csv':
+        return 'csv'
+    if nome_arquivo.endswith(('.ndjson', '.jsonl')) or mimetype in ('application/x-ndjson', 'application/jsonl'):
+        return 'ndjson'
+    return 'json'
+
+def inserir_clientes_lote(conn, contatos, enviar=True, tentativas=5):
+    """
+    Insere um bloco de contatos em uma única transação, gerando o link de cada um
+    Contatos já cadastrados (mesmo CPF ou, sem CPF, mesmo telefone) são reaproveitados
+    Se enviar for True, os SMS são enfileirados na mesma transação
+    Cada contato é um dict com telefone, nome, cpf, mensagem e, opcionalmente, campanha;
+    link_id e link_rastreavel são preenchidos no próprio dict
+    """
+    chaves = [chave_contato(contato['telefone'], contato['cpf']) for contato in contatos]
+    for tentativa in range(1, tentativas + 1):
+        links = []
+        envios = []
+        for contato, chave in zip(contatos, chaves):
+            link_id = gerar_link_id()
+            link_rastreavel = gerar_link_rastreavel(link_id)
+            contato['link_id'] = link_id
+            contato['link_rastreavel'] = link_rastreavel
+            links.append((link_id, chave, contato['telefone'], contato['nome'], contato.get('campanha')))
+            if enviar:
+                envios.append((
+                    link_id,
+                    contato['telefone'],
+                    montar_mensagem_com_link(contato['mensagem'], link_rastreavel)
+                ))
+        try:
+            ids_contatos = repositorio.gravar_contatos(conn, [
+                (chave, contato['telefone'], contato['nome'], contato['cpf'])
+                for contato, chave in zip(contatos, chaves)
+            ])
+            ids_versoes = repositorio.gravar_versoes_contatos(conn, [
+                (ids_contatos[chave], telefone, nome) for _, chave, telefone, nome, _ in links
+            ])
+            links = [
+                (link_id, ids_contatos[chave], ids_versoes[(ids_contatos[chave], telefone, nome)], campanha)
+                for link_id, chave, telefone, nome, campanha in links
+            ]
+            repositorio.inserir(conn, 'links', ('link_id', 'contato_id', 'versao_contato_id', 'campanha'), links)
+            if envios:
+                enfileirar_envios(conn, envios)
+            conn.commit()
+            break
+        except repositorio.erro_integridade as e:
+            # Colisão de link_id (rara): gera novos IDs para o bloco e tenta de novo
+            conn.rollback()
+            if 'link_id' not in str(e) or tentativa == tentativas:
+                raise
+            logger.warning("Colisão de link_id ao inserir bloco de %s contatos, gerando novos IDs", len(contatos))
+
+    cache_links.definir_varios((link[0], link[1]) for link in links)
+    indice_links.adicionar([link[0] for link in links])
+
+class LimitadorTaxa:
+    """
+    Token bucket: libera até `taxa` requisições por segundo,
+    com rajadas de até `capacidade` requisições
+    """
+
+    def __init__(self, taxa, capacidade=None):
+        self.taxa = taxa
+        self.capacidade = capacidade or max(1, int(taxa))
+        self._tokens = float(self.capacidade)
+        self._ultima_reposicao = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _tempo_ate_token(self):
+        """Repõe os tokens e retorna quanto falta para o próximo (0 se consumiu um)"""
+        agora = time.monotonic()
+        self._tokens = min(self.capacidade, self._tokens + (agora - self._ultima_reposicao) * self.taxa)
+        self._ultima_reposicao = agora
+        if self._tokens >= 1:
+            self._tokens -= 1
+            return 0
+        return (1 - self._tokens) / self.taxa
+
+    def adquirir(self, timeout=None):
+        """Aguarda um token. Retorna False se o timeout expirar antes"""
+        if self.taxa <= 0:
+            return True
+        limite = None if timeout is None else time.monotonic() + timeout
+        while True:
+            with self._lock:
+                espera = self._tempo_ate_token()
+            if espera == 0:
+                return True
+            if limite is not None and time.monotonic() + espera > limite:
+                return False
+            time.sleep(espera)
+
+
+class DisjuntorCircuito:
+    """
+    Circuit breaker por taxa de erro em uma janela deslizante
+    fechado: requisições passam normalmente
+    aberto: requisições falham imediatamente até o fim de `tempo_aberto`
+    meio_aberto: uma requisição de teste decide se o circuito fecha ou reabre
+    """
+
+    def __init__(self, limite_erro=0.5, volume_minimo=20, janela=60, tempo_aberto=30):
+        self.limite_erro = limite_erro
+        self.volume_minimo = volume_minimo
+        self.janela = janela
+        self.tempo_aberto = tempo_aberto
+        self.estado = 'fechado'
+        self._resultados = deque()
+        self._falhas = 0
+        self._aberto_em = 0
+        self._teste_em_andamento = False
+        self._lock = threading.Lock()
+
+    def _descartar_antigos(self, agora):
+        while self._resultados and self._resultados[0][0] < agora - self.janela:
+            _, sucesso = self._resultados.popleft()
+            if not sucesso:
+                self._falhas -= 1
+
+    def aberto(self):
+        """Indica se o circuito está aberto e ainda dentro do tempo de espera"""
+        with self._lock:
+            return self.estado == 'aberto' and time.monotonic() - self._aberto_em < self.tempo_aberto
+
+    def permitir(self):
+        """Indica se uma requisição pode ser feita agora"""
+        with self._lock:
+            if self.estado == 'fechado':
+                return True
+            if self.estado == 'aberto' and time.monotonic() - self._aberto_em >= self.tempo_aberto:
+                self.estado = 'meio_aberto'
+                self._teste_em_andamento = False
+            if self.estado == 'meio_aberto' and not self._teste_em_andamento:
+                self._teste_em_andamento = True
+                return True
+            return False
+
+    def disponivel(self):
+        """Indica, sem reservar a requisição de teste, se permitir() aceitaria agora"""
+        with self._lock:
+            if self.estado == 'aberto':
+                return time.monotonic() - self._aberto_em >= self.tempo_aberto
+            return self.estado == 'fechado' or not self._teste_em_andamento
+
+    def liberar(self):
+        """Devolve a requisição de teste reservada por permitir() que não chegou a ser feita"""
+        with self._lock:
+            if self.estado == 'meio_aberto':
+                self._teste_em_andamento = False
+
+    def registrar(self, sucesso):
+        """Registra o resultado de uma requisição"""
+        with self._lock:
+            agora = time.monotonic()
+            if self.estado == 'meio_aberto':
+                if sucesso:
+                    self.estado = 'fechado'
+                    self._resultados.clear()
+                    self._falhas = 0
+                    logger.info("Circuito da API Kolmeya fechado")
+                else:
+                    self.estado = 'aberto'
+                    self._aberto_em = agora
+                self._teste_em_andamento = False
+                return
+
+            self._resultados.append((agora, sucesso))
+            if not sucesso:
+                self._falhas += 1
+            self._descartar_antigos(agora)
+
+            total = len(self._resultados)
+            if total >= self.volume_minimo and self._falhas / total >= self.limite_erro:
+                self.estado = 'aberto'
+                self._aberto_em = agora
+                logger.error(
+                    "Circuito da API Kolmeya aberto: %s/%s falhas nos últimos %ss",
+                    self._falhas, total, self.janela
+                )
+
+
+class ClienteKolmeya:
+    """
+    Cliente da API do Kolmeya com sessão HTTP persistente (keep-alive),
+    limite de taxa e circuit breaker
+    """
+
+    def __init__(self, api_url, api_key, pool_conexoes=10, timeout=30,
+                 limitador=None, disjuntor=None, espera_maxima_taxa=30):
+        self.api_url = api_url
+        self.api_key = api_key
+        self.timeout = timeout
+        self.limitador = limitador or LimitadorTaxa(0)
+        self.disjuntor = disjuntor or DisjuntorCircuito()
+        self.espera_maxima_taxa = espera_maxima_taxa
+
+        self.sessao = requests.Session()
+        self.sessao.headers.update({
+            'Authorization': f'Bearer {api_key}',
+            'Content-Type': 'application/json'
+        })
+        adaptador = HTTPAdapter(pool_connections=1, pool_maxsize=pool_conexoes, pool_block=True)
+        self.sessao.mount('https://', adaptador)
+        self.sessao.mount('http://', adaptador)
+
+    @property
+    def modo_teste(self):
+        return self.api_key == 'sua_api_key_aqui'
+
+    def enviar_sms(self, telefone, mensagem):
+        """
+        Envia SMS via API do Kolmeya
+        Retorna: (sucesso, resposta); sucesso é None quando o envio foi recusado
+        localmente (circuito aberto ou limite de taxa), sem chegar à API
+        """
         # Verificar se a API key está configurada
-        if KOLMEYA_API_KEY == 'sua_api_key_aqui':
+        if self.modo_teste:
             logger.warning("API key do Kolmeya não configurada - modo de teste")
             return True, {
                 'status': 'teste',
                 'mensagem': 'SMS simulado (modo de teste)',
                 'telefone': telefone
             }
-        
-        headers = {
-            'Authorization': f'Bearer {KOLMEYA_API_KEY}',
-            'Content-Type': 'application/json'
-        }
-        
-        payload = {
+
+        # O disjuntor vem antes do limite de taxa: com o circuito aberto a falha é
+        # imediata, sem esperar nem consumir fichas do balde
+        if not self.disjuntor.permitir():
+            metrica_kolmeya_recusas.incrementar('circuito_aberto')
+            return None, "Circuito aberto: API Kolmeya indisponível"
+
+        if not self.limitador.adquirir(self.espera_maxima_taxa):
+            self.disjuntor.liberar()
+            metrica_kolmeya_recusas.incrementar('limite_taxa')
+            return None, "Limite de taxa da API Kolmeya excedido"
+
+        sucesso = False
+        resultado = 'excecao'
+        inicio = time.perf_counter()
+        try:
+            payload = {
+                'telefone': telefone,
+                'mensagem': mensagem
+            }
+
+            # Log da tentativa
+            logger.debug("Enviando SMS via %s", self.api_url)
+
+            response = self.sessao.post(
+                f"{self.api_url}/sms/enviar",
+                json=payload,
+                timeout=self.timeout
+            )
+
+            if response.status_code == 200:
+                sucesso = True
+                resultado = 'sucesso'
+                logger.debug("SMS enviado com sucesso")
+                return True, response.json()
+            else:
+                # Erros do cliente (4xx) não indicam instabilidade da API
+                sucesso = response.status_code < 500 and response.status_code != 429
+                resultado = f'http_{response.status_code // 100}xx'
+                logger.error("Erro ao enviar SMS: %s - %s", response.status_code, response.text)
+                return False, response.text
+
+        except requests.exceptions.ConnectionError as e:
+            resultado = 'erro_conexao'
+            logger.error("Erro de conexão com API Kolmeya: %s", e)
+            return False, f"Erro de conexão: {str(e)}"
+        except requests.exceptions.Timeout as e:
+            resultado = 'timeout'
+            logger.error("Timeout na API Kolmeya: %s", e)
+            return False, f"Timeout: {str(e)}"
+        except Exception as e:
+            logger.error("Exceção ao enviar SMS: %s", e)
+            return False, str(e)
+        finally:
+            metrica_kolmeya.observar(time.perf_counter() - inicio, resultado)
+            self.disjuntor.registrar(sucesso)
+
+
+cliente_kolmeya = ClienteKolmeya(
+    KOLMEYA_API_URL,
+    KOLMEYA_API_KEY,
+    pool_conexoes=KOLMEYA_POOL_CONEXOES,
+    timeout=KOLMEYA_TIMEOUT,
+    limitador=LimitadorTaxa(KOLMEYA_TAXA_MAXIMA / WEB_WORKERS, KOLMEYA_TAXA_RAJADA),
+    disjuntor=DisjuntorCircuito(
+        limite_erro=KOLMEYA_DISJUNTOR_LIMITE_ERRO,
+        volume_minimo=KOLMEYA_DISJUNTOR_VOLUME_MINIMO,
+        janela=KOLMEYA_DISJUNTOR_JANELA,
+        tempo_aberto=KOLMEYA_DISJUNTOR_TEMPO_ABERTO
+    )
+)
+
+def enviar_sms_kolmeya(telefone, mensagem):
+    """
+    Envia SMS via API do Kolmeya
+    Retorna: (sucesso, resposta); sucesso None indica envio recusado sem chamar a API
+    """
+    return cliente_kolmeya.enviar_sms(telefone, mensagem)
+
+# Fila de envio de SMS
+_evento_fila = threading.Event()
+_parar_workers = threading.Event()
+_workers_envio = []
+_workers_lock = threading.Lock()
+
+def enfileirar_envios(conn, envios):
+    """
+    Adiciona envios (link_id, telefone, mensagem) à fila persistente
+    Não faz commit: o envio entra na mesma transação do cadastro do cliente
+    """
+    agora = time.time()
+    repositorio.inserir(
+        conn, 'fila_envios', ('link_id', 'telefone', 'mensagem', 'proxima_tentativa'),
+        [(link_id, telefone, mensagem, agora) for link_id, telefone, mensagem in envios]
+    )
+
+def notificar_workers_envio():
+    """Acorda os workers após novos envios serem gravados"""
+    iniciar_workers_envio()
+    _evento_fila.set()
+
+def calcular_backoff(tentativas):
+    """Espera exponencial com jitter antes da próxima tentativa"""
+    espera = min(ENVIO_BACKOFF_MAXIMO, ENVIO_BACKOFF_BASE * (2 ** (tentativas - 1)))
+    return espera * random.uniform(0.5, 1.0)
+
+def reservar_proximo_envio():
+    """
+    Reserva o próximo envio disponível da fila
+    A reserva expira após ENVIO_TEMPO_RESERVA segundos, permitindo que
+    envios presos por um worker interrompido voltem a ser processados
+    """
+    with conexao_db() as conn:
+        agora = time.time()
+        repositorio.iniciar_escrita(conn)
+        envio = conn.execute(f'''
+            SELECT id, link_id, telefone, mensagem, tentativas, proxima_tentativa
+            FROM fila_envios
+            WHERE status IN ('pendente', 'enviando') AND proxima_tentativa <= ?
+            ORDER BY proxima_tentativa
+            LIMIT 1{repositorio.sql_reservar}
+        ''', (agora,)).fetchone()
+
+        if not envio:
+            conn.rollback()
+            return None
+
+        conn.execute('''
+            UPDATE fila_envios
+            SET status = 'enviando', tentativas = tentativas + 1,
+                proxima_tentativa = ?, data_atualizacao = ?
+            WHERE id = ?
+        ''', (agora + ENVIO_TEMPO_RESERVA, agora_utc(), envio[0]))
+        conn.commit()
+
+        envio_id, link_id, telefone, mensagem, tentativas, proxima_tentativa = envio
+        return {
+            'id': envio_id,
+            'link_id': link_id,
             'telefone': telefone,
-            'mensagem': mensagem
+            'mensagem': mensagem,
+            'tentativas': tentativas + 1,
+            'proxima_tentativa': proxima_tentativa
         }
-        
-        # Log da tentativa
-        logger.info(f"Tentando enviar SMS para {telefone} via {KOLMEYA_API_URL}")
-        
-        response = requests.post(
-            f"{KOLMEYA_API_URL}/sms/enviar",
-            headers=headers,
-            json=payload,
-            timeout=30
-        )
-        
-        if response.status_code == 200:
-            logger.info(f"SMS enviado com sucesso para {telefone}")
-            return True, response.json()
+
+def processar_envio(envio):
+    """Envia um SMS reservado e registra o resultado na fila"""
+    sucesso, resposta = enviar_sms_kolmeya(envio['telefone'], envio['mensagem'])
+
+    with conexao_db() as conn:
+        if sucesso:
+            conn.execute('''
+                UPDATE fila_envios
+                SET status = 'enviado', resposta = ?, ultimo_erro = NULL,
+                    data_atualizacao = ?
+                WHERE id = ?
+            ''', (json.dumps(resposta), agora_utc(), envio['id']))
+        elif sucesso is None:
+            # Recusado antes de chegar à API: devolve a reserva sem gastar a tentativa
+            # nem alterar o backoff
+            conn.execute('''
+                UPDATE fila_envios
+                SET status = 'pendente', tentativas = tentativas - 1, proxima_tentativa = ?,
+                    data_atualizacao = ?
+                WHERE id = ?
+            ''', (envio['proxima_tentativa'], agora_utc(), envio['id']))
+        elif envio['tentativas'] >= ENVIO_MAX_TENTATIVAS:
+            conn.execute('''
+                UPDATE fila_envios
+                SET status = 'morto', ultimo_erro = ?, data_atualizacao = ?
+                WHERE id = ?
+            ''', (str(resposta), agora_utc(), envio['id']))
+            logger.error("Envio %s movido para fila morta após %s tentativas", envio['link_id'], envio['tentativas'])
         else:
-            logger.error(f"Erro ao enviar SMS: {response.status_code} - {response.text}")
-            return False, response.text
-            
-    except requests.exceptions.ConnectionError as e:
-        logger.error(f"Erro de conexão com API Kolmeya: {str(e)}")
-        return False, f"Erro de conexão: {str(e)}"
-    except requests.exceptions.Timeout as e:
-        logger.error(f"Timeout na API Kolmeya: {str(e)}")
-        return False, f"Timeout: {str(e)}"
-    except Exception as e:
-        logger.error(f"Exceção ao enviar SMS: {str(e)}")
-        return False, str(e)
+            conn.execute('''
+                UPDATE fila_envios
+                SET status = 'pendente', ultimo_erro = ?, proxima_tentativa = ?,
+                    data_atualizacao = ?
+                WHERE id = ?
+            ''', (str(resposta), time.time() + calcular_backoff(envio['tentativas']), agora_utc(), envio['id']))
+        conn.commit()
+
+def worker_envio():
+    """Loop de um worker: consome a fila até o encerramento"""
+    while not _parar_workers.is_set():
+        # Com o circuito aberto ou com a requisição de teste já em andamento, não
+        # reservar envios que seriam recusados
+        if not cliente_kolmeya.disjuntor.disponivel():
+            _parar_workers.wait(ENVIO_INTERVALO_CONSULTA)
+            continue
+
+        try:
+            envio = reservar_proximo_envio()
+        except Exception as e:
+            logger.error("Erro ao reservar envio da fila: %s", e)
+            envio = None
+
+        if not envio:
+            _evento_fila.wait(ENVIO_INTERVALO_CONSULTA)
+            _evento_fila.clear()
+            continue
+
+        try:
+            processar_envio(envio)
+        except Exception as e:
+            logger.error("Erro ao processar envio %s: %s", envio['link_id'], e)
+
+def iniciar_workers_envio():
+    """Inicia o pool de workers da fila (idempotente)"""
+    with _workers_lock:
+        if _workers_envio:
+            return
+        _parar_workers.clear()
+        for numero in range(ENVIO_WORKERS):
+            worker = threading.Thread(target=worker_envio, name=f'envio-sms-{numero}', daemon=True)
+            worker.start()
+            _workers_envio.append(worker)
+        logger.info("%s workers de envio iniciados", ENVIO_WORKERS)
+
+def parar_workers_envio(timeout=5):
+    """Sinaliza o encerramento dos workers e aguarda o envio em andamento"""
+    with _workers_lock:
+        _parar_workers.set()
+        _evento_fila.set()
+        for worker in _workers_envio:
+            worker.join(timeout)
+        _workers_envio.clear()
+
+atexit.register(parar_workers_envio)
 
 @app.route('/enviar-sms', methods=['POST'])
 def enviar_sms():
@@ -151,148 +3213,568 @@ def enviar_sms():
             data = request.form.to_dict()
         
         # Validação dos dados
-        required_fields = ['telefone', 'nome', 'cpf', 'mensagem']
-        for field in required_fields:
-            if field not in data:
-                return jsonify({'erro': f'Campo obrigatório não encontrado: {field}'}), 400
-        
-        # Gerar ID único para o link
-        link_id = str(uuid.uuid4())
-        
-        # Salvar dados do cliente no banco
-        conn = sqlite3.connect('kolmeya_webhook.db')
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-            INSERT INTO clientes (telefone, nome, cpf, link_id)
-            VALUES (?, ?, ?, ?)
-        ''', (data['telefone'], data['nome'], data['cpf'], link_id))
-        
-        conn.commit()
-        conn.close()
-        
-        # Gerar link rastreável
-        link_rastreavel = gerar_link_rastreavel(link_id)
+        erro = validar_contato(data)
+        if erro:
+            return jsonify({'erro': erro}), 400
         
-        # Adicionar link à mensagem
-        mensagem_com_link = f"{data['mensagem']}\n\nAcesse: {link_rastreavel}"
+        # Salvar cliente, gerar o link e enfileirar o SMS na mesma transação
+        contato = {campo: data[campo] for campo in CAMPOS_OBRIGATORIOS}
+        contato['cpf'] = contato['cpf'] or ''
+        contato['campanha'] = data.get('campanha') or None
+        with conexao_db() as conn:
+            inserir_clientes_lote(conn, [contato])
+        link_id = contato['link_id']
+        link_rastreavel = contato['link_rastreavel']
         
-        # Enviar SMS via Kolmeya
-        sucesso, resposta = enviar_sms_kolmeya(data['telefone'], mensagem_com_link)
+        # O envio via Kolmeya é feito pelos workers da fila
+        notificar_workers_envio()
         
-        if sucesso:
-            return jsonify({
-                'status': 'sucesso',
-                'mensagem': 'SMS enviado com sucesso',
-                'link_id': link_id,
-                'link_rastreavel': link_rastreavel,
-                'resposta_kolmeya': resposta
-            })
+        return jsonify({
+            'status': 'enfileirado',
+            'mensagem': 'SMS enfileirado para envio',
+            'link_id': link_id,
+            'link_rastreavel': link_rastreavel,
+            'status_envio': f'/envios/{link_id}'
+        }), 202
+            
+    except Exception as e:
+        logger.error("Erro no endpoint enviar-sms: %s", e)
+        return jsonify({'erro': str(e)}), 500
+
+def gravar_pendentes_lote(pendentes, enviar):
+    """
+    Grava os contatos pendentes do lote e completa seus resultados com o link gerado
+    Cada bloco usa sua própria conexão do pool, liberada enquanto o restante do upload é lido
+    """
+    with conexao_db() as conn:
+        inserir_clientes_lote(conn, [contato for _, contato in pendentes], enviar)
+    for resultado, contato in pendentes:
+        resultado['link_id'] = contato['link_id']
+        resultado['link_rastreavel'] = contato['link_rastreavel']
+
+@app.route('/enviar-sms/lote', methods=['POST'])
+def enviar_sms_lote():
+    """
+    Endpoint para cadastro em lote de contatos de uma campanha
+    Aceita uma lista JSON, NDJSON ou um arquivo CSV/NDJSON enviado em 'arquivo'
+    Com enviar=false os contatos são apenas cadastrados, sem enfileirar SMS
+    A campanha pode vir em cada registro ou, para todo o lote, em ?campanha=
+    """
+    try:
+        enviar = request.args.get('enviar', 'true').lower() != 'false'
+        campanha_lote = request.args.get('campanha') or None
+        arquivo = request.files.get('arquivo')
+        if arquivo:
+            formato = detectar_formato_lote(arquivo.filename, arquivo.mimetype)
+            texto = abrir_texto(arquivo.stream)
         else:
+            formato = detectar_formato_lote(None, request.mimetype)
+            texto = abrir_texto(request.stream)
+
+        if formato not in ('json', 'ndjson', 'csv'):
+            return jsonify({'erro': f'Formato não suportado: {formato}'}), 400
+
+        resultados = []
+        pendentes = []
+        total_inseridos = 0
+        total_rejeitados = 0
+
+        try:
+            for numero, registro in iterar_registros_lote(texto, formato):
+                erro = str(registro) if isinstance(registro, ValueError) else validar_contato(registro)
+                if erro:
+                    total_rejeitados += 1
+                    resultados.append({'linha': numero, 'status': 'erro', 'erro': erro})
+                    continue
+
+                contato = {
+                    'telefone': str(registro['telefone']).strip(),
+                    'nome': str(registro['nome']).strip(),
+                    'cpf': str(registro['cpf'] or '').strip(),
+                    'mensagem': registro['mensagem'],
+                    'campanha': str(registro.get('campanha') or '').strip() or campanha_lote
+                }
+                resultado = {'linha': numero, 'status': 'sucesso'}
+                resultados.append(resultado)
+                pendentes.append((resultado, contato))
+
+                if len(pendentes) >= TAMANHO_LOTE_INSERCAO:
+                    gravar_pendentes_lote(pendentes, enviar)
+                    total_inseridos += len(pendentes)
+                    pendentes = []
+                    if enviar:
+                        notificar_workers_envio()
+
+            if pendentes:
+                gravar_pendentes_lote(pendentes, enviar)
+                total_inseridos += len(pendentes)
+                if enviar:
+                    notificar_workers_envio()
+        except ValueError as e:
+            # Contatos já gravados em blocos anteriores permanecem no banco; os do bloco
+            # ainda não gravado são descartados e ficam fora dos resultados
+            descartados = {id(resultado) for resultado, _ in pendentes}
             return jsonify({
                 'status': 'erro',
-                'mensagem': 'Erro ao enviar SMS',
-                'erro': resposta
-            }), 500
-            
+                'erro': str(e),
+                'total_inseridos': total_inseridos,
+                'total_rejeitados': total_rejeitados,
+                'resultados': [resultado for resultado in resultados if id(resultado) not in descartados]
+            }), 400
+
+        logger.info("Lote processado: %s contatos inseridos, %s rejeitados", total_inseridos, total_rejeitados)
+
+        return jsonify({
+            'status': 'enfileirado' if enviar else 'sucesso',
+            'total_inseridos': total_inseridos,
+            'total_rejeitados': total_rejeitados,
+            'resultados': resultados
+        }), 202 if enviar else 200
+
+    except Exception as e:
+        logger.error("Erro no endpoint enviar-sms/lote: %s", e)
+        return jsonify({'erro': str(e)}), 500
+
+@app.route('/envios/<link_id>')
+def status_envio(link_id):
+    """Consulta o status de envio do SMS de um link"""
+    try:
+        with conexao_db() as conn:
+            envio = conn.execute('''
+                SELECT status, tentativas, proxima_tentativa, ultimo_erro, resposta,
+                       data_criacao, data_atualizacao
+                FROM fila_envios
+                WHERE link_id = ?
+                ORDER BY id DESC
+                LIMIT 1
+            ''', (link_id,)).fetchone()
+            etapas = conn.execute(
+                f"SELECT {', '.join(COLUNAS_STATUS_LINK)} FROM status_links WHERE link_id = ?",
+                (link_id,)
+            ).fetchone()
+
+        if not envio:
+            return jsonify({'erro': 'Envio não encontrado'}), 404
+
+        status, tentativas, proxima_tentativa, ultimo_erro, resposta, data_criacao, data_atualizacao = envio
+
+        return jsonify({
+            'link_id': link_id,
+            'status': status,
+            'tentativas': tentativas,
+            'proxima_tentativa': (
+                datetime.fromtimestamp(proxima_tentativa).isoformat()
+                if status == 'pendente' else None
+            ),
+            'ultimo_erro': ultimo_erro,
+            'resposta_kolmeya': json.loads(resposta) if resposta else None,
+            'data_criacao': data_criacao,
+            'data_atualizacao': data_atualizacao,
+            'etapas': dict(zip(COLUNAS_STATUS_LINK, etapas)) if etapas else None
+        })
+
+    except Exception as e:
+        logger.error("Erro ao consultar envio: %s", e)
+        return jsonify({'erro': str(e)}), 500
+
+@app.route('/envios/<link_id>/reenviar', methods=['POST'])
+def reenviar_envio(link_id):
+    """Devolve à fila um envio que esgotou as tentativas"""
+    try:
+        with conexao_db() as conn:
+            cursor = conn.execute('''
+                UPDATE fila_envios
+                SET status = 'pendente', tentativas = 0, proxima_tentativa = ?,
+                    data_atualizacao = ?
+                WHERE link_id = ? AND status = 'morto'
+            ''', (time.time(), agora_utc(), link_id))
+
+            reenfileirados = cursor.rowcount
+            conn.commit()
+
+        if not reenfileirados:
+            return jsonify({'erro': 'Nenhum envio na fila morta para este link'}), 404
+
+        notificar_workers_envio()
+        return jsonify({'status': 'enfileirado', 'link_id': link_id}), 202
+
     except Exception as e:
-        logger.error(f"Erro no endpoint enviar-sms: {str(e)}")
+        logger.error("Erro ao reenviar envio: %s", e)
         return jsonify({'erro': str(e)}), 500
 
 @app.route('/clique')
-def rastrear_clique():
+@app.route('/c/<link_id>')
+def rastrear_clique(link_id=None):
     """
     Endpoint para rastrear cliques nos links
+    Aceita /clique?id=<id> e o formato curto /c/<id>
     """
     try:
-        link_id = request.args.get('id')
+        link_id = link_id or request.args.get('id')
         if not link_id:
             return jsonify({'erro': 'ID do link não fornecido'}), 400
         
-        # Buscar dados do cliente
-        conn = sqlite3.connect('kolmeya_webhook.db')
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-            SELECT telefone, nome, cpf FROM clientes 
-            WHERE link_id = ?
-        ''', (link_id,))
-        
-        cliente = cursor.fetchone()
+        # Robôs e pré-visualizações são redirecionados sem consultar o banco nem gravar o clique
+        if BOT_FILTRO_ATIVO:
+            motivo = classificar_acesso(
+                link_id,
+                request.method,
+                request.headers.get('User-Agent', ''),
+                request.remote_addr or '',
+                request.headers.get('Accept-Language', '')
+            )
+            if motivo:
+                metrica_cliques_bot.incrementar(motivo)
+                if BOT_CONTAR:
+                    gravador_bots.adicionar(agora_utc())
+                return redirect(DESTINO_URL)
         
-        if not cliente:
-            return jsonify({'erro': 'Cliente não encontrado'}), 404
-        
-        telefone, nome, cpf = cliente
+        # Confirmar que o link existe (primeiro no cache); o clique guarda apenas o link_id
+        contato_id = cache_links.obter(link_id)
+        if contato_id is None:
+            # IDs que certamente não existem são recusados sem acessar o banco
+            if not indice_links.pode_existir(link_id):
+                return jsonify({'erro': 'Cliente não encontrado'}), 404
+            
+            with conexao_db() as conn:
+                link = conn.execute('''
+                    SELECT contato_id FROM links 
+                    WHERE link_id = ?
+                ''', (link_id,)).fetchone()
+            
+            if not link:
+                return jsonify({'erro': 'Cliente não encontrado'}), 404
+            
+            cache_links.definir(link_id, link[0])
         
-        # Registrar o clique
-        cursor.execute('''
-            INSERT INTO cliques (link_id, telefone, nome, cpf, ip_address, user_agent)
-            VALUES (?, ?, ?, ?, ?, ?)
-        ''', (
-            link_id, 
-            telefone, 
-            nome, 
-            cpf,
+        # Registrar o clique (gravado em lote pelo gravador em segundo plano)
+        gravador_cliques.adicionar((
+            link_id,
             request.remote_addr,
-            request.headers.get('User-Agent', '')
+            request.headers.get('User-Agent', ''),
+            agora_utc()
         ))
         
-        conn.commit()
-        conn.close()
-        
-        logger.info(f"Clique registrado - Cliente: {nome} ({cpf}) - Link ID: {link_id}")
+        logger.info("Clique registrado", extra={'evento': 'clique', 'campos': {'link_id': link_id}})
         
         # Redirecionar para a página de destino configurável
         return redirect(DESTINO_URL)
         
     except Exception as e:
-        logger.error(f"Erro no endpoint clique: {str(e)}")
+        logger.error("Erro no endpoint clique: %s", e)
+        return jsonify({'erro': str(e)}), 500
+
+@app.route('/webhook-kolmeya', methods=['POST'])
+def receber_webhook():
+    """
+    Endpoint para receber webhooks do Kolmeya
+    """
+    try:
+        # Aceitar tanto JSON quanto form data
+        if request.is_json:
+            data = request.get_json()
+        else:
+            data = request.form.to_dict()
+        
+        # Descartar reenvios do mesmo evento
+        dados_json = json.dumps(data, sort_keys=True)
+        chave = chave_dedupe_webhook(data, dados_json)
+        if webhooks_recentes.obter(chave) is not None:
+            return jsonify({
+                'status': 'ok',
+                'mensagem': 'Webhook já recebido anteriormente',
+                'duplicado': True
+            })
+        
+        # Salvar webhook no banco (gravado em lote em segundo plano); reenvios que
+        # chegarem antes da gravação são descartados pelo índice único de chave_dedupe
+        evento, telefone, link_id = campos_webhook(data)
+        if not gravador_webhooks.adicionar((evento, telefone, link_id, dados_json, chave, agora_utc())):
+            # Sem 200 o Kolmeya reenvia o webhook mais tarde
+            return jsonify({'erro': 'Webhook não registrado: buffer de gravação cheio'}), 503
+        
+        # O payload completo fica gravado na tabela webhooks
+        logger.info("Webhook recebido", extra={
+            'evento': 'webhook', 'campos': {'tipo': evento, 'link_id': link_id}
+        })
+        
+        if evento == 'sms_erro':
+            logger.warning("Erro no envio do SMS: %s", data.get('erro', 'Erro desconhecido'), extra={
+                'campos': {'tipo': evento, 'link_id': link_id}
+            })
+        
+        return jsonify({'status': 'ok', 'mensagem': 'Webhook processado com sucesso', 'duplicado': False})
+        
+    except Exception as e:
+        logger.error("Erro no endpoint webhook: %s", e)
         return jsonify({'erro': str(e)}), 500
 
-@app.route('/webhook-kolmeya', methods=['POST'])
-def receber_webhook():
+TEMPLATE_DASHBOARD = """
+<!DOCTYPE html>
+<html>
+<head>
+    <title>Dashboard Kolmeya Webhook</title>
+    <meta charset="utf-8">
+    <style>
+        body { font-family: Arial, sans-serif; margin: 20px; background-color: #f5f5f5; }
+        .container { max-width: 1200px; margin: 0 auto; }
+        .card { background: white; padding: 20px; margin: 10px 0; border-radius: 8px; box-shadow: 0 2px 4px rgba(0,0,0,0.1); }
+        .stats { display: flex; gap: 20px; margin-bottom: 20px; }
+        .stat-card { flex: 1; text-align: center; padding: 20px; background: #007bff; color: white; border-radius: 8px; }
+        .stat-number { font-size: 2em; font-weight: bold; }
+        .stat-label { font-size: 0.9em; opacity: 0.9; }
+        table { width: 100%; border-collapse: collapse; }
+        th, td { padding: 12px; text-align: left; border-bottom: 1px solid #ddd; }
+        th { background-color: #f8f9fa; font-weight: bold; }
+        .status { font-size: 0.6em; font-weight: normal; color: #666; }
+        .btn { background: #007bff; color: white; padding: 10px 20px; text-decoration: none; border-radius: 5px; display: inline-block; margin: 5px; }
+    </style>
+</head>
+<body>
+    <div class="container">
+        <h1>📊 Dashboard Kolmeya Webhook</h1>
+
+        <div class="stats">
+            <div class="stat-card">
+                <div class="stat-number" id="total_clientes">{{ total_clientes }}</div>
+                <div class="stat-label">Total de Clientes</div>
+            </div>
+            <div class="stat-card">
+                <div class="stat-number" id="total_cliques">{{ total_cliques }}</div>
+                <div class="stat-label">Total de Cliques</div>
+            </div>
+            <div class="stat-card">
+                <div class="stat-number" id="total_webhooks">{{ total_webhooks }}</div>
+                <div class="stat-label">Webhooks Recebidos</div>
+            </div>
+        </div>
+
+        <div class="card">
+            <h2>🔗 Testar Envio de SMS</h2>
+            <form action="/enviar-sms" method="post" style="display: flex; gap: 10px; flex-wrap: wrap;">
+                <input type="text" name="telefone" placeholder="Telefone (5511999999999)" required style="padding: 8px; border: 1px solid #ddd; border-radius: 4px;">
+                <input type="text" name="nome" placeholder="Nome" required style="padding: 8px; border: 1px solid #ddd; border-radius: 4px;">
+                <input type="text" name="cpf" placeholder="CPF" required style="padding: 8px; border: 1px solid #ddd; border-radius: 4px;">
+                <input type="text" name="mensagem" placeholder="Mensagem" required style="padding: 8px; border: 1px solid #ddd; border-radius: 4px; flex: 1;">
+                <button type="submit" class="btn">Enviar SMS</button>
+            </form>
+            <div style="margin-top: 15px; padding: 10px; background: #f8f9fa; border-radius: 4px;">
+                <strong>💡 Dica:</strong> Este formulário usa form data. Para usar JSON, envie uma requisição POST com Content-Type: application/json
+            </div>
+        </div>
+
+        <div class="card">
+            <h2>📈 Últimos Cliques <span class="status" id="status-eventos"></span></h2>
+            <table>
+                <thead>
+                    <tr>
+                        <th>Nome</th>
+                        <th>CPF</th>
+                        <th>Telefone</th>
+                        <th>Data do Clique</th>
+                    </tr>
+                </thead>
+                <tbody id="ultimos-cliques">
+                    {% for clique in ultimos_cliques %}
+                    <tr>
+                        <td>{{ clique[0] }}</td>
+                        <td>{{ clique[1] }}</td>
+                        <td>{{ clique[2] }}</td>
+                        <td>{{ clique[3] }}</td>
+                    </tr>
+                    {% endfor %}
+                </tbody>
+            </table>
+        </div>
+
+        <div class="card">
+            <h2>📨 Últimos Webhooks</h2>
+            <table>
+                <thead>
+                    <tr>
+                        <th>Evento</th>
+                        <th>Telefone</th>
+                        <th>Link</th>
+                        <th>Data de Recebimento</th>
+                    </tr>
+                </thead>
+                <tbody id="ultimos-webhooks"></tbody>
+            </table>
+        </div>
+
+        <div class="card">
+            <h2>🔧 Endpoints Disponíveis</h2>
+            <p><strong>POST /enviar-sms</strong> - Enviar SMS com link rastreável</p>
+            <p><strong>POST /enviar-sms/lote</strong> - Cadastrar contatos em lote (JSON, NDJSON ou CSV)</p>
+            <p><strong>GET /envios/&lt;link_id&gt;</strong> - Status do envio do SMS</p>
+            <p><strong>GET /clique?id=...</strong> - Rastrear cliques</p>
+            <p><strong>POST /webhook-kolmeya</strong> - Receber webhooks do Kolmeya</p>
+            <p><strong>GET /dashboard</strong> - Dashboard de estatísticas</p>
+            <p><strong>GET /eventos</strong> - Cliques, webhooks e totais ao vivo (Server-Sent Events)</p>
+        </div>
+    </div>
+    <script>
+        // Atualização ao vivo: /eventos envia cliques, webhooks e totais assim que são gravados
+        (function () {
+            var MAXIMO_LINHAS = 10;
+            var VERSAO = '"{{ versao[0] }}"';
+            var status = document.getElementById('status-eventos');
+
+            // Sem eventos (desativados ou limite de assinantes): revalida a página com o ETag
+            // (304 enquanto nada mudar) e recarrega quando houver dados novos
+            function consultar() {
+                status.textContent = '🔄 atualização a cada {{ intervalo_atualizacao|int }} s';
+                if (!window.fetch) { return; }
+                setInterval(function () {
+                    fetch(location.href, {cache: 'no-cache'}).then(function (resposta) {
+                        var etag = resposta.headers.get('ETag');
+                        if (resposta.ok && etag && etag !== VERSAO) { location.reload(); }
+                    }).catch(function () {});
+                }, {{ (intervalo_atualizacao * 1000)|int }});
+            }
+
+            function adicionarLinha(id, valores) {
+                var corpo = document.getElementById(id);
+                var linha = corpo.insertRow(0);
+                valores.forEach(function (valor) {
+                    linha.insertCell().textContent = valor == null ? '' : valor;
+                });
+                while (corpo.rows.length > MAXIMO_LINHAS) {
+                    corpo.deleteRow(-1);
+                }
+            }
+
+            function conectar() {
+                var fonte = new EventSource('/eventos');
+                fonte.onopen = function () { status.textContent = '🟢 ao vivo'; };
+                fonte.onerror = function () {
+                    status.textContent = '⚪ desconectado';
+                    // Conexão recusada (limite de assinantes): passa a consultar a página
+                    if (fonte.readyState === EventSource.CLOSED) {
+                        consultar();
+                    }
+                };
+                fonte.addEventListener('clique', function (e) {
+                    var c = JSON.parse(e.data);
+                    adicionarLinha('ultimos-cliques', [c.nome, c.cpf, c.telefone, c.data_clique]);
+                });
+                fonte.addEventListener('webhook', function (e) {
+                    var w = JSON.parse(e.data);
+                    adicionarLinha('ultimos-webhooks', [w.evento, w.telefone, w.link_id, w.data_recebimento]);
+                });
+                fonte.addEventListener('totais', function (e) {
+                    var totais = JSON.parse(e.data);
+                    Object.keys(totais).forEach(function (nome) {
+                        var elemento = document.getElementById(nome);
+                        if (elemento) { elemento.textContent = totais[nome]; }
+                    });
+                });
+                // Eventos perdidos (conexão lenta): recarrega a página inteira
+                fonte.addEventListener('resincronizar', function () { location.reload(); });
+            }
+
+            if (window.EventSource && {{ 'true' if eventos_ativos else 'false' }}) { conectar(); } else { consultar(); }
+        })();
+    </script>
+</body>
+</html>
+"""
+
+# Templates nomeados: compilados pelo Jinja uma única vez e reutilizados
+# (ver criar_app), em vez de reprocessar o HTML a cada requisição
+app.jinja_loader = DictLoader({'dashboard.html': TEMPLATE_DASHBOARD})
+
+# Resumo do dashboard, recalculado no máximo a cada DASHBOARD_CACHE_TTL segundos
+cache_dashboard = CacheLRU(1, DASHBOARD_CACHE_TTL)
+
+def obter_resumo_dashboard():
+    """
+    Totais e últimos cliques do dashboard
+    Os totais vêm da tabela contadores, mantida por triggers, em vez de COUNT(*),
+    e incluem os registros já arquivados
+    """
+    dados = cache_dashboard.obter('resumo')
+    if dados is not None:
+        return dados
+
+    with conexao_db() as conn:
+        contadores = dict(conn.execute('SELECT nome, valor FROM contadores'))
+        # Data da alteração mais recente: cada consulta lê uma única entrada de índice
+        datas = conn.execute('''
+            SELECT
+                (SELECT MAX(data_clique) FROM cliques),
+                (SELECT MAX(data_recebimento) FROM webhooks),
+                (SELECT data_criacao FROM links ORDER BY id DESC LIMIT 1)
+        ''').fetchone()
+        
+        # Últimos cliques
+        ultimos_cliques = conn.execute('''
+            SELECT COALESCE(h.nome, c.nome) AS nome, c.cpf, COALESCE(h.telefone, c.telefone) AS telefone, cl.data_clique
+            FROM (SELECT link_id, data_clique FROM cliques ORDER BY data_clique DESC LIMIT 10) cl
+            LEFT JOIN links l ON l.link_id = cl.link_id
+            LEFT JOIN contatos c ON c.id = l.contato_id
+            LEFT JOIN contatos_historico h ON h.id = l.versao_contato_id
+            ORDER BY cl.data_clique DESC
+        ''').fetchall()
+
+    dados = totais_dashboard(contadores)
+    dados['ultimos_cliques'] = ultimos_cliques
+    dados['versao'] = calcular_versao(contadores, datas)
+    cache_dashboard.definir('resumo', dados)
+    return dados
+
+def totais_dashboard(contadores):
+    """Totais exibidos no dashboard, incluindo os registros arquivados"""
+    return {
+        # Um cliente por SMS enviado, como antes da migração 10 (os contatos distintos são 'contatos')
+        'total_clientes': contadores.get('links', 0),
+        'total_cliques': contadores.get('cliques', 0) + contadores.get('cliques_arquivados', 0),
+        'total_webhooks': contadores.get('webhooks', 0) + contadores.get('webhooks_arquivados', 0)
+    }
+
+def calcular_versao(contadores, datas):
     """
-    Endpoint para receber webhooks do Kolmeya
+    Versão dos dados para respostas condicionais: (etag, última modificação)
+    Toda inclusão ou exclusão altera a tabela contadores (triggers), e a
+    atualização de um contato sempre acompanha a criação de um link, então
+    o ETag é o hash dos contadores
     """
-    try:
-        # Aceitar tanto JSON quanto form data
-        if request.is_json:
-            data = request.get_json()
-        else:
-            data = request.form.to_dict()
-        
-        # Salvar webhook no banco
-        conn = sqlite3.connect('kolmeya_webhook.db')
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-            INSERT INTO webhooks (evento, dados)
-            VALUES (?, ?)
-        ''', ('webhook_recebido', json.dumps(data)))
-        
-        conn.commit()
-        conn.close()
-        
-        logger.info(f"Webhook recebido: {json.dumps(data, indent=2)}")
-        
-        # Processar diferentes tipos de eventos
-        evento = data.get('evento', 'desconhecido')
-        
-        if evento == 'sms_enviado':
-            logger.info("SMS enviado com sucesso")
-        elif evento == 'sms_entregue':
-            logger.info("SMS entregue ao destinatário")
-        elif evento == 'sms_clicado':
-            logger.info("Link no SMS foi clicado")
-        elif evento == 'sms_erro':
-            logger.error(f"Erro no envio do SMS: {data.get('erro', 'Erro desconhecido')}")
-        
-        return jsonify({'status': 'ok', 'mensagem': 'Webhook processado com sucesso'})
-        
-    except Exception as e:
-        logger.error(f"Erro no endpoint webhook: {str(e)}")
-        return jsonify({'erro': str(e)}), 500
+    # Os contadores da fila de envios não aparecem no dashboard nem em /cliques
+    etag = hashlib.sha1(repr(sorted(
+        item for item in contadores.items() if not item[0].startswith('fila:')
+    )).encode()).hexdigest()[:20]
+    datas = [data for data in datas if data]
+    ultima_modificacao = None
+    if datas:
+        ultima_modificacao = datetime.strptime(str(max(datas))[:19], '%Y-%m-%d %H:%M:%S').replace(tzinfo=timezone.utc)
+    return etag, ultima_modificacao
+
+def versao_dados():
+    """Versão atual dos dados, com o mesmo TTL do resumo do dashboard"""
+    return obter_resumo_dashboard()['versao']
+
+def resposta_condicional(versao, gerar, variante=''):
+    """
+    Responde 304 quando o cliente já tem a versão atual (If-None-Match ou
+    If-Modified-Since); caso contrário chama gerar() e marca a resposta com
+    ETag e Last-Modified. `variante` diferencia respostas da mesma versão
+    (ex.: filtros da URL)
+    """
+    etag, ultima_modificacao = versao
+    if variante:
+        etag = hashlib.sha1(f'{etag}:{variante}'.encode()).hexdigest()[:20]
+    if not is_resource_modified(request.environ, etag=etag, last_modified=ultima_modificacao):
+        resposta = Response(status=304)
+    else:
+        resposta = app.make_response(gerar())
+        if resposta.status_code != 200:
+            return resposta
+    resposta.set_etag(etag)
+    if ultima_modificacao:
+        resposta.last_modified = ultima_modificacao
+    # Sempre revalidar: o navegador repete a requisição e recebe 304 enquanto nada mudar
+    resposta.cache_control.no_cache = True
+    return resposta
 
 @app.route('/dashboard')
 def dashboard():
@@ -300,148 +3782,669 @@ def dashboard():
     Dashboard para visualizar estatísticas
     """
     try:
-        conn = sqlite3.connect('kolmeya_webhook.db')
-        cursor = conn.cursor()
-        
-        # Estatísticas gerais
-        cursor.execute('SELECT COUNT(*) FROM clientes')
-        total_clientes = cursor.fetchone()[0]
-        
-        cursor.execute('SELECT COUNT(*) FROM cliques')
-        total_cliques = cursor.fetchone()[0]
-        
-        cursor.execute('SELECT COUNT(*) FROM webhooks')
-        total_webhooks = cursor.fetchone()[0]
-        
-        # Últimos cliques
-        cursor.execute('''
-            SELECT nome, cpf, telefone, data_clique 
-            FROM cliques 
-            ORDER BY data_clique DESC 
-            LIMIT 10
-        ''')
-        ultimos_cliques = cursor.fetchall()
-        
-        conn.close()
-        
-        html_template = """
-        <!DOCTYPE html>
-        <html>
-        <head>
-            <title>Dashboard Kolmeya Webhook</title>
-            <meta charset="utf-8">
-            <style>
-                body { font-family: Arial, sans-serif; margin: 20px; background-color: #f5f5f5; }
-                .container { max-width: 1200px; margin: 0 auto; }
-                .card { background: white; padding: 20px; margin: 10px 0; border-radius: 8px; box-shadow: 0 2px 4px rgba(0,0,0,0.1); }
-                .stats { display: flex; gap: 20px; margin-bottom: 20px; }
-                .stat-card { flex: 1; text-align: center; padding: 20px; background: #007bff; color: white; border-radius: 8px; }
-                .stat-number { font-size: 2em; font-weight: bold; }
-                .stat-label { font-size: 0.9em; opacity: 0.9; }
-                table { width: 100%; border-collapse: collapse; }
-                th, td { padding: 12px; text-align: left; border-bottom: 1px solid #ddd; }
-                th { background-color: #f8f9fa; font-weight: bold; }
-                .btn { background: #007bff; color: white; padding: 10px 20px; text-decoration: none; border-radius: 5px; display: inline-block; margin: 5px; }
-            </style>
-        </head>
-        <body>
-            <div class="container">
-                <h1>📊 Dashboard Kolmeya Webhook</h1>
-                
-                <div class="stats">
-                    <div class="stat-card">
-                        <div class="stat-number">{{ total_clientes }}</div>
-                        <div class="stat-label">Total de Clientes</div>
-                    </div>
-                    <div class="stat-card">
-                        <div class="stat-number">{{ total_cliques }}</div>
-                        <div class="stat-label">Total de Cliques</div>
-                    </div>
-                    <div class="stat-card">
-                        <div class="stat-number">{{ total_webhooks }}</div>
-                        <div class="stat-label">Webhooks Recebidos</div>
-                    </div>
-                </div>
-                
-                <div class="card">
-                    <h2>🔗 Testar Envio de SMS</h2>
-                    <form action="/enviar-sms" method="post" style="display: flex; gap: 10px; flex-wrap: wrap;">
-                        <input type="text" name="telefone" placeholder="Telefone (5511999999999)" required style="padding: 8px; border: 1px solid #ddd; border-radius: 4px;">
-                        <input type="text" name="nome" placeholder="Nome" required style="padding: 8px; border: 1px solid #ddd; border-radius: 4px;">
-                        <input type="text" name="cpf" placeholder="CPF" required style="padding: 8px; border: 1px solid #ddd; border-radius: 4px;">
-                        <input type="text" name="mensagem" placeholder="Mensagem" required style="padding: 8px; border: 1px solid #ddd; border-radius: 4px; flex: 1;">
-                        <button type="submit" class="btn">Enviar SMS</button>
-                    </form>
-                    <div style="margin-top: 15px; padding: 10px; background: #f8f9fa; border-radius: 4px;">
-                        <strong>💡 Dica:</strong> Este formulário usa form data. Para usar JSON, envie uma requisição POST com Content-Type: application/json
-                    </div>
-                </div>
-                
-                <div class="card">
-                    <h2>📈 Últimos Cliques</h2>
-                    <table>
-                        <thead>
-                            <tr>
-                                <th>Nome</th>
-                                <th>CPF</th>
-                                <th>Telefone</th>
-                                <th>Data do Clique</th>
-                            </tr>
-                        </thead>
-                        <tbody>
-                            {% for clique in ultimos_cliques %}
-                            <tr>
-                                <td>{{ clique[0] }}</td>
-                                <td>{{ clique[1] }}</td>
-                                <td>{{ clique[2] }}</td>
-                                <td>{{ clique[3] }}</td>
-                            </tr>
-                            {% endfor %}
-                        </tbody>
-                    </table>
-                </div>
-                
-                <div class="card">
-                    <h2>🔧 Endpoints Disponíveis</h2>
-                    <p><strong>POST /enviar-sms</strong> - Enviar SMS com link rastreável</p>
-                    <p><strong>GET /clique?id=...</strong> - Rastrear cliques</p>
-                    <p><strong>POST /webhook-kolmeya</strong> - Receber webhooks do Kolmeya</p>
-                    <p><strong>GET /dashboard</strong> - Dashboard de estatísticas</p>
-                </div>
-            </div>
-        </body>
-        </html>
-        """
-        
-        return render_template_string(html_template, 
-                                   total_clientes=total_clientes,
-                                   total_cliques=total_cliques,
-                                   total_webhooks=total_webhooks,
-                                   ultimos_cliques=ultimos_cliques)
+        dados = obter_resumo_dashboard()
+        return resposta_condicional(dados['versao'], lambda: render_template(
+            'dashboard.html',
+            eventos_ativos=difusor_eventos.max_assinantes > 0,
+            intervalo_atualizacao=DASHBOARD_ATUALIZACAO,
+            **dados
+        ))
         
     except Exception as e:
-        logger.error(f"Erro no dashboard: {str(e)}")
+        logger.error("Erro no dashboard: %s", e)
         return jsonify({'erro': str(e)}), 500
 
+def formatar_evento(evento, dados):
+    """Mensagem no formato text/event-stream"""
+    return f'event: {evento}\ndata: {json.dumps(dados, ensure_ascii=False, default=str)}\n\n'
+
+class AssinanteEventos:
+    """Fila limitada de um cliente de /eventos"""
+
+    def __init__(self, capacidade):
+        self.atrasado = False
+        self._fila = queue.Queue(maxsize=capacidade)
+
+    def entregar(self, mensagem):
+        """Enfileira sem bloquear. Retorna False se a fila estava cheia"""
+        try:
+            self._fila.put_nowait(mensagem)
+            return True
+        except queue.Full:
+            self.atrasado = True
+            return False
+
+    def proxima(self, timeout):
+        """
+        Próxima mensagem, ou None se nada chegou em `timeout` segundos
+        Depois de eventos descartados, descarta também os pendentes e pede
+        ao cliente que recarregue os dados
+        """
+        if self.atrasado:
+            self.atrasado = False
+            with self._fila.mutex:
+                self._fila.queue.clear()
+            return formatar_evento('resincronizar', {})
+        try:
+            return self._fila.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+class DifusorEventos:
+    """
+    Distribui os eventos do processo entre os assinantes de /eventos (fan-out)
+    Cada evento é serializado uma vez e enfileirado sem bloqueio para cada
+    assinante; um cliente lento perde eventos em vez de atrasar os demais
+    """
+
+    def __init__(self, capacidade_fila, max_assinantes):
+        self.capacidade_fila = capacidade_fila
+        self.max_assinantes = max_assinantes
+        self.encerrado = False
+        self.publicados = 0
+        self.descartados = 0
+        self.recusados = 0
+        self._assinantes = set()
+        self._lock = threading.Lock()
+
+    def assinar(self):
+        """Registra um assinante. Retorna None se o limite foi atingido"""
+        with self._lock:
+            if len(self._assinantes) >= self.max_assinantes:
+                self.recusados += 1
+                return None
+            assinante = AssinanteEventos(self.capacidade_fila)
+            self._assinantes.add(assinante)
+        # Acorda o seguidor para marcar o ponto de partida do novo assinante
+        seguidor_eventos.iniciar()
+        seguidor_eventos.notificar()
+        return assinante
+
+    def cancelar(self, assinante):
+        with self._lock:
+            self._assinantes.discard(assinante)
+
+    def total_assinantes(self):
+        return len(self._assinantes)
+
+    def publicar(self, evento, dados):
+        mensagem = formatar_evento(evento, dados)
+        with self._lock:
+            assinantes = list(self._assinantes)
+            self.publicados += 1
+        for assinante in assinantes:
+            if not assinante.entregar(mensagem):
+                self.descartados += 1
+
+    def encerrar(self):
+        """Encerra os fluxos abertos (encerramento do processo)"""
+        self.encerrado = True
+        with self._lock:
+            assinantes = list(self._assinantes)
+        for assinante in assinantes:
+            assinante.entregar(':\n\n')
+
+    def estatisticas(self):
+        return {
+            'assinantes': self.total_assinantes(),
+            'max_assinantes': self.max_assinantes,
+            'publicados': self.publicados,
+            'descartados': self.descartados,
+            'recusados': self.recusados
+        }
+
+class SeguidorEventos:
+    """
+    Thread que lê os cliques e webhooks gravados desde a última leitura e os
+    publica no difusor, junto com os totais quando mudam
+    Uma consulta por intervalo e por processo, independente do número de
+    assinantes, e só enquanto houver algum. Lê do banco, e não do buffer local,
+    para incluir o que os outros workers gravaram; os lotes gravados pelo
+    próprio processo acordam a thread na hora (notificar)
+    """
+
+    def __init__(self, difusor, intervalo, lote, sobreposicao=0):
+        self.difusor = difusor
+        self.intervalo = intervalo
+        self.lote = lote
+        self.sobreposicao = sobreposicao
+        self._ultimos = None
+        self._publicados = None
+        self._totais = None
+        self._acordar = threading.Event()
+        self._parar = threading.Event()
+        self._thread = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def iniciar(self):
+        """Inicia a thread (idempotente, reinicia após um fork)"""
+        with self._lock:
+            if self._thread and self._thread.is_alive() and self._pid == os.getpid():
+                return
+            self._parar.clear()
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._executar, name='seguidor-eventos', daemon=True)
+            self._thread.start()
+
+    def notificar(self):
+        self._acordar.set()
+
+    def _executar(self):
+        while not self._parar.is_set():
+            self._acordar.wait(self.intervalo)
+            self._acordar.clear()
+            if not self.difusor.total_assinantes():
+                # Sem assinantes: volta a seguir a partir do fim quando alguém se conectar
+                self._ultimos = None
+                self._publicados = None
+                self._totais = None
+                continue
+            try:
+                if self._publicar_novos():
+                    self._acordar.set()
+            except Exception as e:
+                logger.error("Erro ao ler eventos novos: %s", e)
+
+    def _ids_pendentes(self, conn, tabela):
+        """
+        Ids ainda não publicados de `tabela`, em ordem. Relê os últimos `sobreposicao`
+        ids e pula os já publicados, como o IndiceLinks: no PostgreSQL um lote pode
+        ficar visível depois de outro com ids maiores
+        """
+        if self._ultimos is None:
+            # Ponto de partida: o que já existe no banco conta como publicado
+            self._ultimos, self._publicados = {}, {}
+            for nome in ('cliques', 'webhooks'):
+                ultimo = conn.execute(f'SELECT COALESCE(MAX(id), 0) FROM {nome}').fetchone()[0]
+                self._ultimos[nome] = ultimo
+                self._publicados[nome] = {linha[0] for linha in conn.execute(
+                    f'SELECT id FROM {nome} WHERE id > ?', (max(0, ultimo - self.sobreposicao),)
+                )}
+        inicio = max(0, self._ultimos[tabela] - self.sobreposicao)
+        publicados = self._publicados[tabela] = {i for i in self._publicados[tabela] if i > inicio}
+        ids = conn.execute(
+            f'SELECT id FROM {tabela} WHERE id > ? ORDER BY id LIMIT ?',
+            (inicio, len(publicados) + self.lote)
+        ).fetchall()
+        return [linha[0] for linha in ids if linha[0] not in publicados][:self.lote]
+
+    def _publicar_novos(self):
+        """Publica os registros novos. Retorna True se ainda há registros a ler"""
+        with conexao_db() as conn:
+            ids_cliques = self._ids_pendentes(conn, 'cliques')
+            ids_webhooks = self._ids_pendentes(conn, 'webhooks')
+            cliques = conn.execute(f'''
+                SELECT cl.id, cl.link_id, COALESCE(h.nome, c.nome) AS nome, c.cpf, COALESCE(h.telefone, c.telefone) AS telefone, cl.data_clique
+                FROM cliques cl
+                LEFT JOIN links l ON l.link_id = cl.link_id
+                LEFT JOIN contatos c ON c.id = l.contato_id
+                LEFT JOIN contatos_historico h ON h.id = l.versao_contato_id
+                WHERE cl.id IN ({', '.join('?' for _ in ids_cliques)}) ORDER BY cl.id
+            ''', ids_cliques).fetchall() if ids_cliques else []
+            webhooks = conn.execute(f'''
+                SELECT id, evento, telefone, link_id, data_recebimento
+                FROM webhooks WHERE id IN ({', '.join('?' for _ in ids_webhooks)}) ORDER BY id
+            ''', ids_webhooks).fetchall() if ids_webhooks else []
+            totais = totais_dashboard(dict(conn.execute('SELECT nome, valor FROM contadores')))
+
+        for clique in cliques:
+            self.difusor.publicar('clique', {
+                'link_id': clique[1], 'nome': clique[2], 'cpf': clique[3],
+                'telefone': clique[4], 'data_clique': clique[5]
+            })
+        for webhook in webhooks:
+            self.difusor.publicar('webhook', {
+                'evento': webhook[1], 'telefone': webhook[2],
+                'link_id': webhook[3], 'data_recebimento': webhook[4]
+            })
+        for tabela, ids in (('cliques', ids_cliques), ('webhooks', ids_webhooks)):
+            if ids:
+                self._publicados[tabela].update(ids)
+                self._ultimos[tabela] = max(self._ultimos[tabela], ids[-1])
+        if totais != self._totais:
+            self._totais = totais
+            self.difusor.publicar('totais', totais)
+        return len(ids_cliques) == self.lote or len(ids_webhooks) == self.lote
+
+    def parar(self, timeout=5):
+        self._parar.set()
+        self._acordar.set()
+        if self._thread and self._pid == os.getpid():
+            self._thread.join(timeout)
+
+difusor_eventos = DifusorEventos(EVENTOS_FILA_ASSINANTE, EVENTOS_MAX_ASSINANTES)
+seguidor_eventos = SeguidorEventos(difusor_eventos, EVENTOS_INTERVALO, EVENTOS_LOTE, EVENTOS_SOBREPOSICAO)
+
+def gerar_eventos(assinante):
+    """
+    Fluxo de um assinante, com comentários de keepalive para detectar clientes
+    desconectados. A conexão é encerrada após EVENTOS_DURACAO_MAXIMA segundos
+    e o navegador reconecta sozinho (retry), liberando a thread periodicamente
+    """
+    try:
+        yield 'retry: 3000\n\n'
+        fim = time.monotonic() + EVENTOS_DURACAO_MAXIMA
+        while not difusor_eventos.encerrado and time.monotonic() < fim:
+            mensagem = assinante.proxima(min(EVENTOS_KEEPALIVE, max(0, fim - time.monotonic())))
+            yield ':\n\n' if mensagem is None else mensagem
+    finally:
+        difusor_eventos.cancelar(assinante)
+
+@app.route('/eventos')
+def eventos():
+    """
+    Cliques, webhooks e totais ao vivo (Server-Sent Events) para o dashboard
+    Eventos: clique, webhook, totais e resincronizar (eventos perdidos)
+    """
+    assinante = difusor_eventos.assinar()
+    if assinante is None:
+        if difusor_eventos.max_assinantes <= 0:
+            return jsonify({'erro': 'Eventos ao vivo desativados'}), 503
+        resposta = jsonify({'erro': 'Limite de assinantes de eventos atingido'})
+        resposta.status_code = 503
+        resposta.headers['Retry-After'] = '30'
+        return resposta
+    return Response(gerar_eventos(assinante), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        # Proxies como o nginx não devem acumular o fluxo
+        'X-Accel-Buffering': 'no'
+    })
+
 @app.route('/')
 def home():
-    """Página inicial"""
-    return jsonify({
+    """
+    Página inicial
+    O conteúdo só muda com a configuração, então o ETag é o hash do próprio corpo
+    """
+    resposta = jsonify({
         'mensagem': 'Sistema de Webhook Kolmeya',
         'endpoints': {
             'POST /enviar-sms': 'Enviar SMS com link rastreável',
+            'POST /enviar-sms/lote': 'Cadastrar contatos em lote (JSON, NDJSON ou CSV)',
+            'GET /envios/<link_id>': 'Status do envio do SMS',
+            'POST /envios/<link_id>/reenviar': 'Reenfileirar envio da fila morta',
             'GET /clique?id=...': 'Rastrear cliques',
+            'GET /c/<id>': 'Rastrear cliques (link curto)',
             'POST /webhook-kolmeya': 'Receber webhooks do Kolmeya',
-            'GET /dashboard': 'Dashboard de estatísticas'
+            'GET /dashboard': 'Dashboard de estatísticas',
+            'GET /eventos': 'Cliques, webhooks e totais ao vivo (Server-Sent Events)',
+            'GET /cliques': 'Listar cliques (paginação por cursor ou streaming NDJSON)',
+            'GET /exportar/<tabela>': 'Exportar clientes, contatos, links, cliques ou webhooks (CSV/NDJSON, gzip)',
+            'GET /arquivo/<tabela>': 'Consultar cliques ou webhooks arquivados pela retenção',
+            'GET /estatisticas': 'Séries de envios, cliques, CTR e eventos por minuto, hora ou dia',
+            'GET /funil': 'Funil enviados → entregues → clicados por dia ou campanha',
+            'GET /metrics': 'Métricas no formato do Prometheus',
+            'GET /metricas': 'Métricas internas (caches e filas)'
         },
         'configuracoes': {
             'api_url': KOLMEYA_API_URL,
             'webhook_url': WEBHOOK_BASE_URL,
             'destino_url': DESTINO_URL,
-            'api_key_configurada': KOLMEYA_API_KEY != 'sua_api_key_aqui'
+            'api_key_configurada': KOLMEYA_API_KEY != 'sua_api_key_aqui',
+            'banco': repositorio.nome
+        }
+    })
+    resposta.add_etag()
+    resposta.cache_control.no_cache = True
+    return resposta.make_conditional(request)
+
+# Consultas de recálculo das agregações: (métrica, data, valor, origem e filtro)
+# A origem deve filtrar pelo intervalo [?, ?) da data; {segundos_ate_clique} é
+# substituído pela expressão do banco em uso
+RECALCULO_AGREGADOS = [
+    ("'envios'", 'data_criacao', 'COUNT(*)', 'FROM links WHERE data_criacao >= ? AND data_criacao < ?'),
+    ("'cliques'", 'data_clique', 'COUNT(*)', 'FROM cliques WHERE data_clique >= ? AND data_clique < ?'),
+    (
+        "'tempo_ate_clique_soma'", 'cl.data_clique',
+        'SUM({segundos_ate_clique})',
+        'FROM cliques cl JOIN links l ON l.link_id = cl.link_id '
+        'WHERE cl.data_clique >= ? AND cl.data_clique < ?'
+    ),
+    (
+        "'tempo_ate_clique_qtd'", 'cl.data_clique', 'COUNT(*)',
+        'FROM cliques cl JOIN links l ON l.link_id = cl.link_id '
+        'WHERE cl.data_clique >= ? AND cl.data_clique < ?'
+    ),
+    ("'webhooks'", 'data_recebimento', 'COUNT(*)', 'FROM webhooks WHERE data_recebimento >= ? AND data_recebimento < ?'),
+    (
+        "'evento:' || evento", 'data_recebimento', 'COUNT(*)',
+        'FROM webhooks WHERE data_recebimento >= ? AND data_recebimento < ?'
+    ),
+]
+
+def reconstruir_agregados(desde=None, ate=None):
+    """
+    Recalcula as agregações a partir das tabelas de origem, um dia por transação,
+    para não bloquear as gravações por muito tempo
+    desde e ate são datas 'YYYY-MM-DD' (ate exclusivo); por padrão, todo o histórico
+    """
+    with conexao_db() as conn:
+        return recalcular_agregados(conn, desde, ate)
+
+def primeiro_dia_completo(conn):
+    """
+    Depois de um arquivamento, primeiro dia cujos cliques e webhooks ainda estão todos no banco
+    (recalcular dias anteriores apagaria as agregações dos registros arquivados)
+    Retorna None se nada foi arquivado
+    """
+    arquivados = conn.execute(
+        "SELECT COALESCE(SUM(valor), 0) FROM contadores WHERE nome IN ('cliques_arquivados', 'webhooks_arquivados')"
+    ).fetchone()[0]
+    if not arquivados:
+        return None
+    inicios = [
+        conn.execute(f'SELECT MIN({coluna}) FROM {tabela}').fetchone()[0]
+        for tabela, coluna in COLUNAS_DATA_ARQUIVO.items()
+    ]
+    inicio = max((valor for valor in inicios if valor), default=agora_utc())
+    # O dia do registro mais antigo pode ter sido arquivado em parte
+    return (datetime.strptime(inicio[:10], '%Y-%m-%d') + timedelta(days=1)).strftime('%Y-%m-%d')
+
+def recalcular_agregados(conn, desde=None, ate=None):
+    """Recalcula as agregações usando a conexão informada (ver reconstruir_agregados)"""
+    if not desde or not ate:
+        limites = conn.execute('''
+            SELECT MIN(inicio), MAX(fim) FROM (
+                SELECT MIN(data_criacao) AS inicio, MAX(data_criacao) AS fim FROM links
+                UNION ALL SELECT MIN(data_clique), MAX(data_clique) FROM cliques
+                UNION ALL SELECT MIN(data_recebimento), MAX(data_recebimento) FROM webhooks
+            ) AS limites
+        ''').fetchone()
+        if limites[0] is None:
+            return 0
+        desde = desde or primeiro_dia_completo(conn) or limites[0][:10]
+        ate = ate or (datetime.strptime(limites[1][:10], '%Y-%m-%d') + timedelta(days=1)).strftime('%Y-%m-%d')
+
+    dia = datetime.strptime(desde, '%Y-%m-%d')
+    fim = datetime.strptime(ate, '%Y-%m-%d')
+    segundos_ate_clique = repositorio.sql_segundos('cl.data_clique', 'l.data_criacao')
+    dias = 0
+    while dia < fim:
+        inicio_dia = dia.strftime('%Y-%m-%d 00:00:00')
+        proximo = dia + timedelta(days=1)
+        fim_dia = proximo.strftime('%Y-%m-%d 00:00:00')
+
+        repositorio.iniciar_escrita(conn, ('agregados',))
+        try:
+            # 'cliques_bot' não tem tabela de origem e é mantida
+            conn.execute(
+                'DELETE FROM agregados WHERE periodo >= ? AND periodo < ? AND metrica <> ?',
+                (inicio_dia, fim_dia, METRICA_CLIQUES_BOT)
+            )
+            for metrica, data, valor, origem in RECALCULO_AGREGADOS:
+                valor = valor.format(segundos_ate_clique=segundos_ate_clique)
+                for granularidade in GRANULARIDADES:
+                    conn.execute(f'''
+                        INSERT INTO agregados (granularidade, periodo, metrica, valor)
+                        SELECT '{granularidade}', {repositorio.sql_periodo(granularidade, data)} AS periodo_agregado,
+                               {metrica} AS metrica_agregada, {valor}
+                        {origem}
+                        GROUP BY periodo_agregado, metrica_agregada
+                        ON CONFLICT (granularidade, metrica, periodo) DO UPDATE SET valor = agregados.valor + excluded.valor
+                    ''', (inicio_dia, fim_dia))
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        dia = proximo
+        dias += 1
+    logger.info("Agregações reconstruídas para %s dia(s) a partir de %s", dias, desde)
+    return dias
+
+def consultar_estatisticas(granularidade, metricas, desde, ate):
+    """Séries das métricas no intervalo [desde, ate), lidas da tabela agregados"""
+    marcadores = ', '.join('?' for _ in metricas)
+    with conexao_db() as conn:
+        linhas = conn.execute(f'''
+            SELECT metrica, periodo, valor FROM agregados
+            WHERE granularidade = ? AND metrica IN ({marcadores}) AND periodo >= ? AND periodo < ?
+            ORDER BY metrica, periodo
+        ''', [granularidade] + list(metricas) + [desde, ate]).fetchall()
+
+    series = {metrica: {} for metrica in metricas}
+    for metrica, periodo, valor in linhas:
+        series[metrica][periodo] = valor
+    return series
+
+@app.route('/estatisticas')
+def estatisticas():
+    """
+    Séries temporais de envios, cliques e eventos de webhook
+    Parâmetros: granularidade (minuto, hora ou dia), desde e ate (UTC, ate exclusivo)
+    e metricas (lista separada por vírgulas; ex.: cliques,envios,evento:sms_entregue)
+    Inclui as séries derivadas ctr (cliques/envios) e tempo_medio_ate_clique (segundos)
+    """
+    try:
+        granularidade = request.args.get('granularidade', 'hora')
+        if granularidade not in GRANULARIDADES:
+            return jsonify({'erro': f'Granularidade inválida: {granularidade}'}), 400
+
+        janela_padrao = {'minuto': timedelta(hours=1), 'hora': timedelta(days=1), 'dia': timedelta(days=30)}
+        agora = datetime.utcnow()
+        ate = request.args.get('ate') or (agora + timedelta(seconds=1)).strftime('%Y-%m-%d %H:%M:%S')
+        desde = request.args.get('desde') or (agora - janela_padrao[granularidade]).strftime('%Y-%m-%d %H:%M:%S')
+
+        metricas = [m for m in request.args.get('metricas', 'envios,cliques,webhooks').split(',') if m]
+        consultar = set(metricas) | {'envios', 'cliques', 'tempo_ate_clique_soma', 'tempo_ate_clique_qtd'}
+        series = consultar_estatisticas(granularidade, sorted(consultar), desde, ate)
+
+        periodos = sorted(set().union(*(serie.keys() for serie in series.values())))
+        if len(periodos) > ESTATISTICAS_MAXIMO_PERIODOS:
+            return jsonify({'erro': 'Intervalo muito grande para a granularidade escolhida'}), 400
+
+        resposta = {
+            metrica: [{'periodo': p, 'valor': series[metrica].get(p, 0)} for p in periodos]
+            for metrica in metricas
         }
+        resposta['ctr'] = [
+            {
+                'periodo': p,
+                'valor': round(series['cliques'].get(p, 0) / series['envios'][p], 4)
+                if series['envios'].get(p) else None
+            }
+            for p in periodos
+        ]
+        resposta['tempo_medio_ate_clique'] = [
+            {
+                'periodo': p,
+                'valor': round(series['tempo_ate_clique_soma'].get(p, 0) / series['tempo_ate_clique_qtd'][p], 1)
+                if series['tempo_ate_clique_qtd'].get(p) else None
+            }
+            for p in periodos
+        ]
+
+        return jsonify({
+            'status': 'sucesso',
+            'granularidade': granularidade,
+            'desde': desde,
+            'ate': ate,
+            'series': resposta
+        })
+
+    except Exception as e:
+        logger.error("Erro ao consultar estatísticas: %s", e)
+        return jsonify({'erro': str(e)}), 500
+
+# Datas de cada etapa registradas em status_links
+COLUNAS_STATUS_LINK = ('enviado_em', 'entregue_em', 'clicado_em', 'erro_em')
+
+# Etapas do funil, na ordem: um link conta nas etapas anteriores à que alcançou,
+# mesmo sem o webhook delas (ex.: clique sem confirmação de entrega)
+ETAPAS_FUNIL = (
+    ('enviados', 'COALESCE(enviado_em, entregue_em, clicado_em)'),
+    ('entregues', 'COALESCE(entregue_em, clicado_em)'),
+    ('clicados', 'clicado_em'),
+    ('erros', 'erro_em'),
+)
+
+@app.route('/funil')
+def funil():
+    """
+    Funil de envio (cadastrados → enviados → entregues → clicados) por dia ou por campanha
+    Parâmetros: agrupar (dia ou campanha), desde e ate (data de cadastro, UTC, ate
+    exclusivo) e campanha (filtra uma campanha)
+    """
+    try:
+        agrupar = request.args.get('agrupar', 'dia')
+        if agrupar not in ('dia', 'campanha'):
+            return jsonify({'erro': f'Agrupamento inválido: {agrupar}'}), 400
+
+        agora = datetime.utcnow()
+        desde = request.args.get('desde') or (agora - timedelta(days=30)).strftime('%Y-%m-%d')
+        ate = request.args.get('ate') or (agora + timedelta(days=1)).strftime('%Y-%m-%d')
+        campanha = request.args.get('campanha')
+
+        grupo = 'substr(data_criacao, 1, 10)' if agrupar == 'dia' else 'campanha'
+        contagens = ', '.join(f'COUNT({expressao})' for _, expressao in ETAPAS_FUNIL)
+        filtros = ['data_criacao >= ?', 'data_criacao < ?']
+        parametros = [desde, ate]
+        if campanha:
+            filtros.insert(0, 'campanha = ?')
+            parametros.insert(0, campanha)
+
+        with conexao_db() as conn:
+            linhas = conn.execute(f'''
+                SELECT {grupo} AS grupo, COUNT(*), {contagens}
+                FROM status_links
+                WHERE {' AND '.join(filtros)}
+                GROUP BY grupo
+                ORDER BY grupo
+            ''', parametros).fetchall()
+
+        resultado = []
+        for linha in linhas:
+            item = {agrupar: linha[0], 'cadastrados': linha[1]}
+            item.update({etapa: total for (etapa, _), total in zip(ETAPAS_FUNIL, linha[2:])})
+            item['taxa_entrega'] = round(item['entregues'] / item['enviados'], 4) if item['enviados'] else None
+            item['taxa_clique'] = round(item['clicados'] / item['entregues'], 4) if item['entregues'] else None
+            resultado.append(item)
+
+        return jsonify({
+            'status': 'sucesso',
+            'agrupar': agrupar,
+            'desde': desde,
+            'ate': ate,
+            'funil': resultado
+        })
+
+    except Exception as e:
+        logger.error("Erro ao consultar funil: %s", e)
+        return jsonify({'erro': str(e)}), 500
+
+@app.route('/metricas')
+def metricas():
+    """Métricas internas do processo (caches e filas)"""
+    return jsonify({
+        'cache_links': cache_links.estatisticas(),
+        'gravador_cliques': gravador_cliques.estatisticas(),
+        'gravador_webhooks': gravador_webhooks.estatisticas(),
+        'webhooks_recentes': webhooks_recentes.estatisticas(),
+        'filtro_links': indice_links.estatisticas(),
+        'classificador_bots': {
+            'ativo': BOT_FILTRO_ATIVO,
+            'cache_user_agent': classificar_user_agent.cache_info()._asdict(),
+            'redes_ip': redes_bot.total,
+            'rajadas': detector_rajadas.estatisticas(),
+            'gravador': gravador_bots.estatisticas()
+        },
+        'eventos': difusor_eventos.estatisticas()
     })
 
+def contar_fila_envios():
+    """Envios na fila por status (contadores mantidos por triggers, sem varrer a fila)"""
+    with conexao_db() as conn:
+        return [((nome[len('fila:'):],), total) for nome, total in conn.execute(
+            "SELECT nome, valor FROM contadores WHERE nome LIKE 'fila:%'"
+        )]
+
+Medidor(
+    'webkolm_cache_links_itens', 'Links no cache LRU de /clique', (),
+    lambda: [((), cache_links.estatisticas()['itens'])]
+)
+Medidor(
+    'webkolm_cache_links_consultas_total', 'Consultas ao cache de links por resultado', ('resultado',),
+    lambda: [(('acerto',), cache_links.acertos), (('falha',), cache_links.falhas)],
+    tipo='counter'
+)
+Medidor(
+    'webkolm_gravador_pendentes', 'Itens aguardando gravação em lote', ('gravador',),
+    lambda: [((gravador.nome,), gravador.estatisticas()['pendentes']) for gravador in (gravador_cliques, gravador_webhooks, gravador_bots)]
+)
+Medidor(
+    'webkolm_gravador_itens_total', 'Itens processados pelos gravadores em lote por resultado', ('gravador', 'resultado'),
+    lambda: [
+        ((gravador.nome, resultado), gravador.estatisticas()[campo])
+        for gravador in (gravador_cliques, gravador_webhooks, gravador_bots)
+        for resultado, campo in (('gravado', 'gravados'), ('descartado', 'descartados'), ('erro', 'erros'))
+    ],
+    tipo='counter'
+)
+Medidor(
+    'webkolm_filtro_links_itens', 'Links no filtro de Bloom de /clique', (),
+    lambda: [((), indice_links.estatisticas().get('itens'))]
+)
+Medidor(
+    'webkolm_kolmeya_circuito_aberto', 'Estado do disjuntor da API Kolmeya (1 = aberto)', (),
+    lambda: [((), 1 if cliente_kolmeya.disjuntor.aberto() else 0)]
+)
+Medidor('webkolm_fila_envios', 'Envios na fila por status', ('status',), contar_fila_envios, compartilhado=True)
+Medidor(
+    'webkolm_eventos_assinantes', 'Conexões abertas em /eventos', (),
+    lambda: [((), difusor_eventos.total_assinantes())]
+)
+Medidor(
+    'webkolm_eventos_total', 'Eventos ao vivo por resultado (publicado, descartado por fila cheia, conexão recusada)',
+    ('resultado',),
+    lambda: [
+        (('publicado',), difusor_eventos.publicados),
+        (('descartado',), difusor_eventos.descartados),
+        (('recusado',), difusor_eventos.recusados)
+    ],
+    tipo='counter'
+)
+Medidor(
+    'webkolm_logs_descartados_total', 'Registros de log descartados por motivo', ('motivo',),
+    lambda: ([((motivo,), total) for motivo, total in _log_filtro.descartados.items()]
+             + [(('fila_cheia',), _log_handler.descartados)]) if _log_handler else [],
+    tipo='counter'
+)
+
+@app.before_request
+def iniciar_medicao():
+    g.inicio_requisicao = time.perf_counter()
+
+@app.after_request
+def registrar_medicao(response):
+    """Registra a duração da requisição por método, rota e status"""
+    inicio = g.pop('inicio_requisicao', None)
+    if inicio is not None:
+        rota = request.url_rule.rule if request.url_rule else 'nao_encontrada'
+        metrica_requisicoes.observar(
+            time.perf_counter() - inicio, request.method, rota, response.status_code
+        )
+    return response
+
+@app.route('/metrics')
+def metrics():
+    """
+    Métricas no formato de texto do Prometheus
+    As métricas de cada processo levam o rótulo pid; com vários workers,
+    incluem as amostras gravadas pelos demais (PublicadorMetricas)
+    """
+    outros = publicador_metricas.ler_outros()
+    amostras = amostras_processo()
+    linhas = []
+    for coletor in REGISTRO_METRICAS:
+        linhas.extend(coletor.cabecalho())
+        if coletor.compartilhado:
+            linhas.extend(coletor.amostras())
+            continue
+        linhas.extend(amostras[coletor.nome])
+        for processo in outros:
+            linhas.extend(processo.get(coletor.nome, ()))
+    return Response('\n'.join(linhas) + '\n', mimetype='text/plain; version=0.0.4')
+
 @app.route('/testar-api')
 def testar_api():
     """Testa a conectividade com a API do Kolmeya"""
@@ -474,52 +4477,598 @@ def testar_api():
             'erro': str(e)
         }), 500
 
+def codificar_cursor(data_clique, clique_id):
+    """Cursor opaco de paginação a partir do último clique da página"""
+    return base64.urlsafe_b64encode(json.dumps([data_clique, clique_id]).encode()).decode()
+
+def decodificar_cursor(cursor):
+    """Retorna (data_clique, id) do cursor ou levanta ValueError"""
+    try:
+        data_clique, clique_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        return str(data_clique), int(clique_id)
+    except Exception:
+        raise ValueError('Cursor inválido')
+
+def consultar_pagina_cliques(filtros, posicao, limite):
+    """
+    Busca uma página de cliques em ordem decrescente de (data_clique, id)
+    A posição (data_clique, id) é exclusiva: retorna cliques anteriores a ela
+    """
+    condicoes = []
+    parametros = []
+    if filtros.get('link_id'):
+        condicoes.append('cl.link_id = ?')
+        parametros.append(filtros['link_id'])
+    if filtros.get('desde'):
+        condicoes.append('cl.data_clique >= ?')
+        parametros.append(filtros['desde'])
+    if filtros.get('ate'):
+        condicoes.append('cl.data_clique < ?')
+        parametros.append(filtros['ate'])
+    if posicao:
+        # A primeira condição delimita a faixa do índice; a segunda desempata pelo id
+        condicoes.append('cl.data_clique <= ? AND (cl.data_clique < ? OR cl.id < ?)')
+        parametros.extend([posicao[0], posicao[0], posicao[1]])
+
+    where = f"WHERE {' AND '.join(condicoes)}" if condicoes else ''
+    with conexao_db() as conn:
+        return conn.execute(f'''
+            SELECT cl.id, cl.link_id, COALESCE(h.nome, c.nome) AS nome, c.cpf, COALESCE(h.telefone, c.telefone) AS telefone, cl.data_clique, cl.ip_address, cl.user_agent
+            FROM cliques cl
+            JOIN links l ON l.link_id = cl.link_id
+            JOIN contatos c ON c.id = l.contato_id
+            LEFT JOIN contatos_historico h ON h.id = l.versao_contato_id
+            {where}
+            ORDER BY cl.data_clique DESC, cl.id DESC
+            LIMIT ?
+        ''', parametros + [limite]).fetchall()
+
+def iterar_cliques(filtros, posicao=None, limite=None, tamanho_pagina=1000):
+    """
+    Percorre os cliques página a página, sem manter uma leitura longa aberta
+    Memória constante independentemente do total de cliques
+    """
+    entregues = 0
+    while limite is None or entregues < limite:
+        tamanho = tamanho_pagina if limite is None else min(tamanho_pagina, limite - entregues)
+        pagina = consultar_pagina_cliques(filtros, posicao, tamanho)
+        for linha in pagina:
+            yield linha
+        entregues += len(pagina)
+        if len(pagina) < tamanho:
+            return
+        posicao = (pagina[-1][5], pagina[-1][0])
+
+def clique_para_dict(clique):
+    clique_id, link_id, nome, cpf, telefone, data_clique, ip, user_agent = clique
+    return {
+        'id': clique_id,
+        'link_id': link_id,
+        'nome': nome,
+        'cpf': cpf,
+        'telefone': telefone,
+        'data_clique': data_clique,
+        'ip': ip,
+        'user_agent': user_agent
+    }
+
+def gerar_json_cliques(cliques):
+    """Gera a resposta JSON da listagem em partes, um clique por vez"""
+    yield '{"status": "sucesso", "cliques": ['
+    separador = ''
+    for clique in cliques:
+        yield separador + json.dumps(clique_para_dict(clique), ensure_ascii=False)
+        separador = ','
+    yield ']}'
+
+def gerar_listagem_cliques():
+    """Monta a resposta de /cliques a partir dos parâmetros da requisição"""
+    filtros = {
+        'link_id': request.args.get('link_id'),
+        'desde': request.args.get('desde'),
+        'ate': request.args.get('ate')
+    }
+    cursor = request.args.get('cursor')
+    posicao = decodificar_cursor(cursor) if cursor else None
+    formato = request.args.get('formato', 'json').lower()
+    streaming = formato == 'ndjson' or request.args.get('stream', 'false').lower() == 'true'
+
+    if streaming:
+        limite = request.args.get('limite', type=int)
+        cliques = iterar_cliques(filtros, posicao, limite)
+        if formato == 'ndjson':
+            corpo = (json.dumps(clique_para_dict(clique), ensure_ascii=False) + '\n' for clique in cliques)
+            return Response(corpo, mimetype='application/x-ndjson')
+        return Response(gerar_json_cliques(cliques), mimetype='application/json')
+
+    limite = request.args.get('limite', CLIQUES_LIMITE_PADRAO, type=int)
+    limite = max(1, min(limite, CLIQUES_LIMITE_MAXIMO))
+    pagina = consultar_pagina_cliques(filtros, posicao, limite)
+
+    proximo_cursor = None
+    if len(pagina) == limite:
+        proximo_cursor = codificar_cursor(pagina[-1][5], pagina[-1][0])
+
+    with conexao_db() as conn:
+        total = conn.execute("SELECT valor FROM contadores WHERE nome = 'cliques'").fetchone()
+
+    return jsonify({
+        'status': 'sucesso',
+        'total_cliques': total[0] if total else 0,
+        'quantidade': len(pagina),
+        'proximo_cursor': proximo_cursor,
+        'cliques': [clique_para_dict(clique) for clique in pagina]
+    })
+
 @app.route('/cliques')
 def listar_cliques():
-    """Lista todos os cliques registrados"""
+    """
+    Lista os cliques registrados, do mais recente para o mais antigo
+    Paginação por cursor (parâmetros limite e cursor) com filtros desde, ate e link_id
+    Com formato=ndjson ou stream=true, todos os cliques do filtro são enviados em streaming
+    Responde 304 quando nenhum dado mudou desde o ETag enviado pelo cliente
+    """
     try:
-        conn = sqlite3.connect('kolmeya_webhook.db')
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-            SELECT c.nome, c.cpf, c.telefone, cl.data_clique, cl.ip_address, cl.user_agent
-            FROM cliques cl
-            JOIN clientes c ON cl.link_id = c.link_id
-            ORDER BY cl.data_clique DESC
-        ''')
-        
-        cliques = cursor.fetchall()
-        conn.close()
-        
-        return jsonify({
-            'status': 'sucesso',
-            'total_cliques': len(cliques),
-            'cliques': [
-                {
-                    'nome': clique[0],
-                    'cpf': clique[1],
-                    'telefone': clique[2],
-                    'data_clique': clique[3],
-                    'ip': clique[4],
-                    'user_agent': clique[5]
-                }
-                for clique in cliques
-            ]
-        })
+        return resposta_condicional(versao_dados(), gerar_listagem_cliques, variante=request.full_path)
         
+    except ValueError as e:
+        return jsonify({'erro': str(e)}), 400
     except Exception as e:
-        logger.error(f"Erro ao listar cliques: {str(e)}")
+        logger.error("Erro ao listar cliques: %s", e)
         return jsonify({'erro': str(e)}), 500
 
-if __name__ == '__main__':
-    # Inicializar banco de dados
+def iterar_tabela(tabela, desde_id=0, tamanho_pagina=EXPORTACAO_TAMANHO_PAGINA):
+    """
+    Percorre uma tabela em ordem de id a partir de desde_id (exclusivo)
+    Cada página é uma leitura curta, sem manter o banco bloqueado durante a exportação
+    """
+    colunas = ', '.join(TABELAS_EXPORTACAO[tabela])
+    ultimo_id = desde_id
+    while True:
+        with conexao_db() as conn:
+            pagina = conn.execute(
+                f'SELECT {colunas} FROM {tabela} WHERE id > ? ORDER BY id LIMIT ?',
+                (ultimo_id, tamanho_pagina)
+            ).fetchall()
+        for linha in pagina:
+            yield linha
+        if len(pagina) < tamanho_pagina:
+            return
+        ultimo_id = pagina[-1][0]
+
+def gerar_exportacao(tabela, formato='ndjson', desde_id=0, compactar=False, progresso=None):
+    """
+    Gera a exportação de uma tabela em blocos de bytes (CSV ou NDJSON, opcionalmente gzip)
+    Se informado, progresso['ultimo_id'] é atualizado com o último id exportado
+    """
+    colunas = TABELAS_EXPORTACAO[tabela]
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31) if compactar else None
+    buffer = io.StringIO()
+    escritor = csv.writer(buffer) if formato == 'csv' else None
+    if escritor:
+        escritor.writerow(colunas)
+
+    def esvaziar():
+        dados = buffer.getvalue().encode('utf-8')
+        buffer.seek(0)
+        buffer.truncate()
+        return compressor.compress(dados) if compressor else dados
+
+    linhas_no_buffer = 0
+    for linha in iterar_tabela(tabela, desde_id):
+        if escritor:
+            escritor.writerow(linha)
+        else:
+            buffer.write(json.dumps(dict(zip(colunas, linha)), ensure_ascii=False))
+            buffer.write('\n')
+        linhas_no_buffer += 1
+        if progresso is not None:
+            progresso['ultimo_id'] = linha[0]
+        if linhas_no_buffer >= 1000:
+            linhas_no_buffer = 0
+            bloco = esvaziar()
+            if bloco:
+                yield bloco
+
+    bloco = esvaziar()
+    if compressor:
+        bloco += compressor.flush()
+    if bloco:
+        yield bloco
+
+@app.route('/exportar/<tabela>')
+def exportar(tabela):
+    """
+    Exporta clientes, contatos, links, cliques ou webhooks em streaming
+    Parâmetros: formato (csv ou ndjson), gzip (true/false) e desde_id para exportação incremental
+    """
+    try:
+        if tabela not in TABELAS_EXPORTACAO:
+            return jsonify({'erro': f'Tabela não exportável: {tabela}'}), 404
+
+        formato = request.args.get('formato', 'ndjson').lower()
+        if formato not in ('csv', 'ndjson'):
+            return jsonify({'erro': f'Formato não suportado: {formato}'}), 400
+
+        compactar = request.args.get('gzip', 'false').lower() == 'true'
+        desde_id = request.args.get('desde_id', 0, type=int)
+
+        nome_arquivo = f"{tabela}.{formato}" + ('.gz' if compactar else '')
+        mimetype = 'text/csv' if formato == 'csv' else 'application/x-ndjson'
+        if compactar:
+            mimetype = 'application/gzip'
+
+        return Response(
+            gerar_exportacao(tabela, formato, desde_id, compactar),
+            mimetype=mimetype,
+            headers={'Content-Disposition': f'attachment; filename={nome_arquivo}'}
+        )
+
+    except Exception as e:
+        logger.error("Erro na exportação de %s: %s", tabela, e)
+        return jsonify({'erro': str(e)}), 500
+
+@app.route('/arquivo/<tabela>')
+def ler_arquivo(tabela):
+    """
+    Consulta os cliques ou webhooks arquivados pela retenção, em NDJSON
+    Parâmetros: desde, ate (YYYY-MM-DD ou YYYY-MM-DD HH:MM:SS), link_id e limite
+    """
+    try:
+        if tabela not in COLUNAS_DATA_ARQUIVO:
+            return jsonify({'erro': f'Tabela sem arquivo: {tabela}'}), 404
+
+        limite = min(request.args.get('limite', ARQUIVO_LIMITE_CONSULTA, type=int), ARQUIVO_LIMITE_CONSULTA)
+        registros = consultar_arquivo(
+            tabela,
+            request.args.get('desde'),
+            request.args.get('ate'),
+            request.args.get('link_id'),
+            limite
+        )
+        return Response(
+            (json.dumps(registro, ensure_ascii=False) + '\n' for registro in registros),
+            mimetype='application/x-ndjson'
+        )
+
+    except Exception as e:
+        logger.error("Erro na consulta ao arquivo de %s: %s", tabela, e)
+        return jsonify({'erro': str(e)}), 500
+
+def exportar_para_arquivo(tabela, formato, desde_id, compactar, saida):
+    """Exportação pela linha de comando; informa o último id para a próxima carga incremental"""
+    progresso = {'ultimo_id': desde_id}
+    destino = open(saida, 'wb') if saida and saida != '-' else sys.stdout.buffer
+    try:
+        for bloco in gerar_exportacao(tabela, formato, desde_id, compactar, progresso):
+            destino.write(bloco)
+    finally:
+        if destino is not sys.stdout.buffer:
+            destino.close()
+    print(f"Exportação de {tabela} concluída. Último id: {progresso['ultimo_id']}", file=sys.stderr)
+
+def caminho_arquivo(tabela, mes):
+    """Arquivo mensal de uma tabela: <ARQUIVO_DIRETORIO>/<tabela>/<YYYY-MM>.ndjson.gz"""
+    return os.path.join(ARQUIVO_DIRETORIO, tabela, f'{mes}.ndjson.gz')
+
+def gravar_arquivo(tabela, registros):
+    """
+    Acrescenta os registros aos arquivos mensais, um membro gzip por lote
+    Os dados são sincronizados em disco antes de retornar
+    """
+    coluna = COLUNAS_DATA_ARQUIVO[tabela]
+    por_mes = {}
+    for registro in registros:
+        por_mes.setdefault(str(registro[coluna])[:7], []).append(registro)
+
+    os.makedirs(os.path.join(ARQUIVO_DIRETORIO, tabela), exist_ok=True)
+    for mes, linhas in por_mes.items():
+        conteudo = ''.join(json.dumps(linha, ensure_ascii=False) + '\n' for linha in linhas)
+        with open(caminho_arquivo(tabela, mes), 'ab') as destino:
+            destino.write(gzip.compress(conteudo.encode('utf-8')))
+            destino.flush()
+            os.fsync(destino.fileno())
+
+def arquivar_tabela(tabela, dias, lote=ARQUIVO_LOTE, pausa_ms=ARQUIVO_PAUSA_MS):
+    """
+    Move para os arquivos mensais os registros com mais de `dias` dias, em lotes
+    Cada lote é gravado no arquivo antes de ser apagado do banco, numa transação curta;
+    se o processo cair entre as duas etapas, o lote é gravado de novo na próxima execução
+    (consultar_arquivo descarta as repetições pelo id)
+    Retorna: quantidade de registros arquivados
+    """
+    colunas = TABELAS_EXPORTACAO[tabela]
+    limite = (datetime.utcnow() - timedelta(days=dias)).strftime('%Y-%m-%d %H:%M:%S')
+    consulta = sql_lote_arquivo(tabela)
+    total = 0
+    while True:
+        with conexao_db() as conn:
+            linhas = conn.execute(consulta, (limite, lote)).fetchall()
+        if not linhas:
+            break
+
+        gravar_arquivo(tabela, [dict(zip(colunas, linha)) for linha in linhas])
+
+        with conexao_db() as conn:
+            repositorio.iniciar_escrita(conn)
+            try:
+                apagados = conn.executemany(
+                    f'DELETE FROM {tabela} WHERE id = ?', [(linha[0],) for linha in linhas]
+                ).rowcount
+                conn.execute(
+                    'UPDATE contadores SET valor = valor + ? WHERE nome = ?',
+                    (apagados, f'{tabela}_arquivados')
+                )
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+        total += apagados
+        if len(linhas) < lote:
+            break
+        time.sleep(pausa_ms / 1000)
+
+    cache_dashboard.limpar()
+    logger.info("%s registro(s) de %s anteriores a %s arquivados", total, tabela, limite)
+    return total
+
+def compactar_banco(paginas=ARQUIVO_VACUUM_PAGINAS, pausa_ms=ARQUIVO_PAUSA_MS):
+    """
+    Devolve ao sistema as páginas livres do banco com incremental_vacuum,
+    poucas páginas por vez, para não segurar o bloqueio de escrita por muito tempo
+    Retorna: quantidade de páginas liberadas
+    """
+    with conexao_db() as conn:
+        if conn.execute('PRAGMA auto_vacuum').fetchone()[0] != 2:
+            logger.warning("Banco sem auto_vacuum incremental; execute `arquivar --converter-vacuum` uma vez")
+            return 0
+        liberadas = 0
+        while True:
+            livres = conn.execute('PRAGMA freelist_count').fetchone()[0]
+            if not livres:
+                break
+            # execute() dá um único passo no pragma (uma página); executescript
+            # roda o vacuum até o fim do lote pedido
+            conn.executescript(f'PRAGMA incremental_vacuum({paginas})')
+            passo = livres - conn.execute('PRAGMA freelist_count').fetchone()[0]
+            if passo <= 0:
+                break
+            liberadas += passo
+            time.sleep(pausa_ms / 1000)
+        conn.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+    logger.info("Compactação concluída: %s página(s) liberada(s)", liberadas)
+    return liberadas
+
+def converter_vacuum():
+    """
+    Ativa o auto_vacuum incremental num banco existente
+    O VACUUM reescreve o arquivo inteiro e bloqueia o banco: execute numa janela de manutenção
+    """
+    with conexao_db() as conn:
+        conn.execute('PRAGMA auto_vacuum=INCREMENTAL')
+        conn.execute('VACUUM')
+    logger.info("Banco convertido para auto_vacuum incremental")
+
+def limpar_dados_cliques(lote=ARQUIVO_LOTE, pausa_ms=ARQUIVO_PAUSA_MS):
+    """
+    Esvazia as colunas telefone, nome e cpf dos cliques gravados antes da migração 10
+    (os dados ficam em contatos), uma faixa de ids por transação curta, para que o
+    servidor continue gravando cliques; pode ser interrompida e executada de novo
+    Retorna: quantidade de cliques alterados
+    """
+    if repositorio.nome != 'sqlite':
+        logger.info("PostgreSQL: as colunas pessoais de cliques já foram removidas na migração 10")
+        return 0
+    with conexao_db() as conn:
+        maior_id = conn.execute('SELECT MAX(id) FROM cliques').fetchone()[0] or 0
+    total = 0
+    inicio = 0
+    while inicio < maior_id:
+        with conexao_db() as conn:
+            alterados = conn.execute('''
+                UPDATE cliques SET telefone = NULL, nome = NULL, cpf = NULL
+                WHERE id > ? AND id <= ? AND (telefone IS NOT NULL OR nome IS NOT NULL OR cpf IS NOT NULL)
+            ''', (inicio, inicio + lote)).rowcount
+            conn.commit()
+        total += alterados
+        inicio += lote
+        if alterados:
+            time.sleep(pausa_ms / 1000)
+    logger.info("Dados pessoais removidos de %s clique(s)", total)
+    return total
+
+def arquivar(tabelas=None, dias=None, compactar=True):
+    """Aplica a retenção configurada (ou `dias`, se informado) às tabelas e compacta o banco"""
+    total = 0
+    for tabela in tabelas or sorted(RETENCAO_DIAS):
+        retencao = dias if dias is not None else RETENCAO_DIAS[tabela]
+        if retencao <= 0:
+            logger.info("Retenção de %s desativada", tabela)
+            continue
+        total += arquivar_tabela(tabela, retencao)
+    if compactar and total:
+        repositorio.compactar()
+    return total
+
+def consultar_arquivo(tabela, desde=None, ate=None, link_id=None, limite=ARQUIVO_LIMITE_CONSULTA):
+    """
+    Percorre os arquivos mensais de uma tabela e gera os registros no intervalo [desde, ate)
+    Registros repetidos (ver arquivar_tabela) aparecem uma única vez
+    """
+    diretorio = os.path.join(ARQUIVO_DIRETORIO, tabela)
+    if not os.path.isdir(diretorio):
+        return
+    coluna = COLUNAS_DATA_ARQUIVO[tabela]
+    vistos = set()
+    for nome in sorted(os.listdir(diretorio)):
+        mes = nome.split('.', 1)[0]
+        if not nome.endswith('.ndjson.gz') or (desde and mes < desde[:7]) or (ate and mes > ate[:7]):
+            continue
+        try:
+            with gzip.open(os.path.join(diretorio, nome), 'rt', encoding='utf-8') as origem:
+                for linha in origem:
+                    registro = json.loads(linha)
+                    data = registro[coluna]
+                    if (desde and data < desde) or (ate and data >= ate):
+                        continue
+                    if (link_id and registro.get('link_id') != link_id) or registro['id'] in vistos:
+                        continue
+                    vistos.add(registro['id'])
+                    yield registro
+                    if len(vistos) >= limite:
+                        return
+        except (EOFError, OSError) as e:
+            # Lote interrompido no meio da gravação: os registros continuam no banco
+            logger.warning("Arquivo %s de %s incompleto: %s", nome, tabela, e)
+
+def criar_app():
+    """
+    Prepara o processo atual para atender requisições e retorna o app WSGI
+    Chamado uma vez por processo (em produção, por worker do gunicorn, via wsgi.py);
+    as migrações são serializadas entre processos (BEGIN IMMEDIATE ou bloqueio consultivo)
+    """
+    # Inicializar banco de dados (apenas confere a versão se já estiver migrado)
     init_database()
     
-    # Configurações do servidor
+    # Carregar o filtro de links existentes
+    indice_links.construir()
+    
+    # Compilar o template do dashboard antes da primeira requisição
+    app.jinja_env.get_template('dashboard.html')
+    
+    # Iniciar workers da fila de envio e as threads de gravação em lote
+    iniciar_workers_envio()
+    gravador_cliques.iniciar()
+    gravador_webhooks.iniciar()
+    gravador_bots.iniciar()
+    
+    # Com vários workers, /metrics junta as métricas de todos os processos
+    if WEB_WORKERS > 1:
+        publicador_metricas.iniciar()
+    
+    return app
+
+def encerrar_processo():
+    """
+    Encerramento gracioso: aguarda os envios em andamento, grava os buffers
+    de cliques e webhooks e fecha as conexões do pool
+    """
+    difusor_eventos.encerrar()
+    seguidor_eventos.parar()
+    parar_workers_envio()
+    gravador_cliques.parar()
+    gravador_webhooks.parar()
+    gravador_bots.parar()
+    publicador_metricas.parar()
+    obter_pool().fechar()
+    logger.info("Processo %s encerrado", os.getpid())
+
+def servir(workers=1, threads=1):
+    """
+    Inicia o servidor HTTP
+    Com mais de um worker ou thread, executa o gunicorn (gunicorn.conf.py);
+    caso contrário, usa o servidor de desenvolvimento do Flask
+    """
     port = int(os.getenv('PORT', 5000))
     debug = os.getenv('DEBUG', 'False').lower() == 'true'
+    diretorio = os.path.dirname(os.path.abspath(__file__))
+
+    if workers > 1 or threads > 1:
+        if os.name == 'posix' and importlib.util.find_spec('gunicorn'):
+            os.environ['WEB_WORKERS'] = str(workers)
+            os.environ['WEB_THREADS'] = str(threads)
+            logger.info("Iniciando gunicorn na porta %s com %s workers e %s threads", port, workers, threads)
+            # O gunicorn assume este processo e repassa os sinais aos workers
+            os.execvp(sys.executable, [
+                sys.executable, '-m', 'gunicorn',
+                '--chdir', diretorio,
+                '-c', os.path.join(diretorio, 'gunicorn.conf.py'),
+                'wsgi:app'
+            ])
+        logger.warning("gunicorn indisponível nesta plataforma; usando o servidor de desenvolvimento")
+    
+    # SIGTERM encerra via SystemExit para que os buffers sejam gravados (atexit)
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+    
+    criar_app()
     
-    logger.info(f"Iniciando servidor na porta {port}")
-    logger.info(f"Dashboard disponível em: http://localhost:{port}/dashboard")
+    logger.info("Iniciando servidor na porta %s", port)
+    logger.info("Dashboard disponível em: http://localhost:%s/dashboard", port)
     
     app.run(host='0.0.0.0', port=port, debug=debug)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Sistema de Webhook Kolmeya')
+    comandos = parser.add_subparsers(dest='comando')
+    parser_servir = comandos.add_parser('servir', help='Inicia o servidor (padrão)')
+    parser_servir.add_argument(
+        '--workers', type=int, default=WEB_WORKERS,
+        help='Processos do servidor; acima de 1 usa o gunicorn (padrão: WEB_WORKERS)'
+    )
+    parser_servir.add_argument(
+        '--threads', type=int, default=WEB_THREADS,
+        help='Threads por processo no gunicorn (padrão: WEB_THREADS)'
+    )
+    parser_migrar = comandos.add_parser('migrar', help='Aplica as migrações pendentes do banco')
+    parser_migrar.add_argument(
+        '--check', action='store_true',
+        help='Não altera o banco; exibe a versão do esquema e o plano das consultas principais'
+    )
+    parser_migrar.add_argument(
+        '--limpar-cliques', action='store_true',
+        help='Remove, em lotes, telefone, nome e CPF dos cliques anteriores à migração 10 (SQLite)'
+    )
+    parser_exportar = comandos.add_parser('exportar', help='Exporta uma tabela em CSV ou NDJSON')
+    parser_exportar.add_argument('tabela', choices=sorted(TABELAS_EXPORTACAO))
+    parser_exportar.add_argument('--formato', choices=('csv', 'ndjson'), default='ndjson')
+    parser_exportar.add_argument('--gzip', action='store_true', help='Compacta a saída com gzip')
+    parser_exportar.add_argument('--desde-id', type=int, default=0, help='Exporta apenas ids maiores que este')
+    parser_exportar.add_argument('--saida', default='-', help='Arquivo de saída (padrão: saída padrão)')
+    parser_agregados = comandos.add_parser('agregados', help='Recalcula as agregações de /estatisticas')
+    parser_agregados.add_argument('--reconstruir', action='store_true', help='Recalcula a partir das tabelas de origem')
+    parser_agregados.add_argument('--desde', help='Primeiro dia (YYYY-MM-DD); padrão: início do histórico')
+    parser_agregados.add_argument('--ate', help='Dia final exclusivo (YYYY-MM-DD); padrão: fim do histórico')
+    parser_arquivar = comandos.add_parser('arquivar', help='Move cliques e webhooks antigos para os arquivos mensais')
+    parser_arquivar.add_argument('--tabela', choices=sorted(COLUNAS_DATA_ARQUIVO), action='append', help='Padrão: todas')
+    parser_arquivar.add_argument('--dias', type=int, help='Idade mínima em dias (padrão: RETENCAO_*_DIAS)')
+    parser_arquivar.add_argument('--sem-vacuum', action='store_true', help='Não compacta o banco após arquivar')
+    parser_arquivar.add_argument(
+        '--converter-vacuum', action='store_true',
+        help='Ativa o auto_vacuum incremental num banco existente (executa VACUUM completo)'
+    )
+    parser_consultar = comandos.add_parser('consultar-arquivo', help='Lê registros arquivados em NDJSON')
+    parser_consultar.add_argument('tabela', choices=sorted(COLUNAS_DATA_ARQUIVO))
+    parser_consultar.add_argument('--desde', help='Data inicial (YYYY-MM-DD[ HH:MM:SS])')
+    parser_consultar.add_argument('--ate', help='Data final exclusiva (YYYY-MM-DD[ HH:MM:SS])')
+    parser_consultar.add_argument('--link-id')
+    parser_consultar.add_argument('--limite', type=int, default=ARQUIVO_LIMITE_CONSULTA)
+    args = parser.parse_args()
+    
+    if args.comando == 'arquivar':
+        init_database()
+        if args.converter_vacuum:
+            if repositorio.nome != 'sqlite':
+                parser_arquivar.error('--converter-vacuum se aplica apenas ao SQLite')
+            converter_vacuum()
+        arquivar(args.tabela, args.dias, not args.sem_vacuum)
+    elif args.comando == 'consultar-arquivo':
+        for registro in consultar_arquivo(args.tabela, args.desde, args.ate, args.link_id, args.limite):
+            print(json.dumps(registro, ensure_ascii=False))
+    elif args.comando == 'agregados':
+        if not args.reconstruir:
+            parser_agregados.error('informe --reconstruir')
+        init_database()
+        reconstruir_agregados(args.desde, args.ate)
+    elif args.comando == 'exportar':
+        exportar_para_arquivo(args.tabela, args.formato, args.desde_id, args.gzip, args.saida)
+    elif args.comando == 'migrar':
+        if args.check:
+            verificar_banco()
+        else:
+            init_database()
+            if args.limpar_cliques:
+                limpar_dados_cliques()
+    elif args.comando == 'servir':
+        servir(args.workers, args.threads)
+    else:
+        servir(WEB_WORKERS, WEB_THREADS)
@@ -0,0 +1,8 @@
+"""
+Ponto de entrada WSGI do Sistema de Webhook Kolmeya
+Uso em produção: gunicorn -c gunicorn.conf.py wsgi:app
+"""
+
+from webkolm import criar_app
+
+app = criar_app()